@@ -1,28 +1,45 @@
 from typing import Any, Dict
 
-from runtime.actions import Action, ValidationError, all_data_var
+from runtime.actions import (
+    PRIORITY_HIGH,
+    Action,
+    ValidationError,
+    all_data_var,
+    register_priority_permission,
+)
+from runtime.all_data import register_index
+
+
+register_index("core/config", "key", unique=True)
+
+# Admins and projector operators overtake other writes, when the server is
+# busy.
+register_priority_permission("core.can_manage_projector")
 
 
 def key_to_id(key: str) -> int:
     all_data = all_data_var.get()
-    for config_id, config in all_data["core/config"].items():
-        if config["key"] == key:
-            return config_id
-    raise ValidationError("Unknown config key `{key}`")
+    config_id = all_data["core/config"].get_by("key", key)
+    if config_id is None:
+        raise ValidationError(f"Unknown config key `{key}`")
+    return config_id
 
 
 class SetConfig(Action, name="core/set_config"):
+    # The config changes, what the projectors show.
+    priority = PRIORITY_HIGH
+
+    schema = {
+        "type": "object",
+        "properties": {"key": {"type": "string"}, "value": True},
+        "required": ["key", "value"],
+        "additionalProperties": False,
+    }
+
     async def validate(self, payload: Dict[str, Any]) -> None:
-        if "key" not in payload:
-            ValidationError("no key given")
-        if "value" not in payload:
-            ValidationError("no value given")
         all_data = all_data_var.get()
-
-        if payload["key"] not in [
-            config["key"] for config in all_data["core/config"].values()
-        ]:
-            ValidationError(f"unknown config variable {payload['key']}")
+        if all_data["core/config"].get_by("key", payload["key"]) is None:
+            raise ValidationError(f"unknown config variable {payload['key']}")
 
     async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         all_data = all_data_var.get()
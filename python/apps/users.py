@@ -1,15 +1,133 @@
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Mapping, Optional
 
-from runtime.actions import Action, ValidationError, all_data_var
+from runtime.actions import (
+    Action,
+    BulkCreateAction,
+    BulkDeleteAction,
+    BulkUpdateAction,
+    ValidationError,
+    all_data_var,
+)
+from runtime.all_data import CollectionType, Element, ElementID, register_index
+from runtime.references import register_referenced_data, register_related_elements
+from runtime.restrict import Permissions, register_permissions, register_restrict
+from runtime.schema import Schema
+
+
+register_index("users/user", "username", unique=True)
+
+# Every user and anonymous is in the default group.
+DEFAULT_GROUP_ID = 1
+
+# Users in the admin group have all permissions.
+ADMIN_GROUP_ID = 2
+
+# Fields of a user, that are never sent to the clients.
+USER_SECRET_FIELDS = {"password", "session_auth_hash"}
+
+# Fields of a user, that need the permission users.can_see_extra_data.
+USER_EXTRA_FIELDS = {"email", "comment", "is_active", "last_email_send"}
+
+# Fields of a user, that need the permission users.can_manage.
+USER_MANAGE_FIELDS = {"default_password"}
+
+# Fields of a user, that can be set with create_users and update_users.
+USER_FIELDS = frozenset(
+    {
+        "username",
+        "password",
+        "title",
+        "first_name",
+        "last_name",
+        "gender",
+        "structure_level",
+        "number",
+        "about_me",
+        "groups_id",
+        "is_present",
+        "is_committee",
+    }
+    | USER_EXTRA_FIELDS
+    | USER_MANAGE_FIELDS
+)
+
+# Schemas of the user fields, that are checked. See runtime/schema.py.
+USER_FIELD_SCHEMAS: Dict[str, Schema] = {
+    "username": {"type": "string", "minLength": 1},
+    "password": {"type": "string"},
+    "groups_id": {"type": "array", "items": {"type": "integer"}},
+    "is_present": {"type": "boolean"},
+    "is_committee": {"type": "boolean"},
+    "is_active": {"type": "boolean"},
+}
+
+
+def user_related_elements(user: Element) -> Iterable[ElementID]:
+    """
+    A user embeds its groups.
+    """
+    return [("users/group", group_id) for group_id in user.get("groups_id") or []]
+
+
+def group_referenced_data(group: Element) -> Element:
+    """
+    Only the name of a group is embedded in users.
+    """
+    return {"id": group["id"], "name": group["name"]}
+
+
+def get_permissions(
+    database: Mapping[str, CollectionType], user_id: Optional[int]
+) -> Permissions:
+    """
+    Returns the permissions of the groups of a user.
+    """
+    groups = database.get("users/group", {})
+    group_ids = {DEFAULT_GROUP_ID}
+    user = database.get("users/user", {}).get(user_id) if user_id is not None else None
+    if user is not None:
+        group_ids.update(user.get("groups_id") or [])
+    if ADMIN_GROUP_ID in group_ids:
+        group_ids = set(groups)
+    return frozenset(
+        permission
+        for group_id in group_ids
+        for permission in groups.get(group_id, {}).get("permissions", [])
+    )
+
+
+def restrict_user(user: Element, permissions: Permissions) -> Optional[Element]:
+    """
+    Users need users.can_see_name. Some fields need more permissions.
+    """
+    if "users.can_see_name" not in permissions:
+        return None
+    hidden = set(USER_SECRET_FIELDS)
+    if "users.can_see_extra_data" not in permissions:
+        hidden.update(USER_EXTRA_FIELDS)
+    if "users.can_manage" not in permissions:
+        hidden.update(USER_MANAGE_FIELDS)
+    return {key: value for key, value in user.items() if key not in hidden}
+
+
+register_related_elements("users/user", user_related_elements)
+register_referenced_data("users/group", group_referenced_data)
+register_permissions(get_permissions)
+register_restrict("users/user", restrict_user)
 
 
 class CreateUser(Action, name="users/create_user"):
+    schema = {
+        "type": "object",
+        "properties": {"username": USER_FIELD_SCHEMAS["username"]},
+        "required": ["username"],
+        "additionalProperties": False,
+    }
+
     async def validate(self, payload: Dict[str, Any]) -> None:
         all_data = all_data_var.get()
-        username = payload.get("username")
-        if username is None:
-            raise ValidationError("create_user action needs a username")
-        if username in [user["username"] for user in all_data["users/user"].values()]:
+        username = payload["username"]
+        if all_data["users/user"].get_by("username", username) is not None:
             raise ValidationError(f"username `{username}` already exists")
 
     async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -25,12 +143,18 @@ class CreateUser(Action, name="users/create_user"):
 
 
 class UpdatePassword(Action, name="users/update_password"):
+    schema = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "password": USER_FIELD_SCHEMAS["password"],
+        },
+        "required": ["id", "password"],
+        "additionalProperties": False,
+    }
+
     async def validate(self, payload: Dict[str, Any]) -> None:
         all_data = all_data_var.get()
-        if "password" not in payload:
-            raise ValidationError("update_password needs a password")
-        if "id" not in payload:
-            raise ValidationError("update_passwod needs a user id")
         if payload["id"] not in all_data["users/user"]:
             raise ValidationError(f"User with id `{payload['id']}` does not exist.")
 
@@ -40,3 +164,51 @@ class UpdatePassword(Action, name="users/update_password"):
         user["password"] = payload["password"]
         user["last_updated"] = payload["current_time"]
         return {}
+
+
+class CreateUsers(BulkCreateAction, name="users/create_users"):
+    """
+    Creates many users at once, for example for an import.
+
+    {"elements": [{"username": "max"}, {"username": "erika", "groups_id": [3]}]}
+    """
+
+    collection = "users/user"
+    fields = USER_FIELDS
+    required_fields = ("username",)
+    unique_fields = ("username",)
+    field_schemas = USER_FIELD_SCHEMAS
+
+    def create_element(
+        self, element: Dict[str, Any], payload: Dict[str, Any]
+    ) -> Element:
+        current_time = payload["current_time"]
+        return dict(element, created=current_time, last_updated=current_time)
+
+
+class UpdateUsers(BulkUpdateAction, name="users/update_users"):
+    """
+    Changes fields of many users at once.
+
+    {"elements": [{"id": 5, "is_present": true}, {"id": 6, "is_present": true}]}
+    """
+
+    collection = "users/user"
+    fields = USER_FIELDS | {"id"}
+    unique_fields = ("username",)
+    field_schemas = USER_FIELD_SCHEMAS
+
+    def update_element(
+        self, element: Dict[str, Any], payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        fields = super().update_element(element, payload)
+        fields["last_updated"] = payload["current_time"]
+        return fields
+
+
+class DeleteUsers(BulkDeleteAction, name="users/delete_users"):
+    """
+    Deletes many users at once.
+    """
+
+    collection = "users/user"
@@ -0,0 +1,78 @@
+"""
+Compares the memory of the database as dict of dicts with CompactCollections.
+
+The data from all_data.msgpack is copied SCALE times with new ids, to get an
+event with many users and motions.
+
+  python python/benchmark_memory.py
+"""
+
+from __future__ import annotations
+
+import gc
+import tracemalloc
+from time import perf_counter
+from typing import Any, Callable, Dict, Mapping
+
+import msgpack
+
+from runtime.all_data import CompactCollection, copy_element
+from runtime.db import DB_FILE
+
+
+SCALE = 50
+
+
+def load_data() -> Dict[str, Dict[int, Dict]]:
+    with open(DB_FILE, "rb") as file:
+        data = msgpack.unpack(file, raw=False, strict_map_key=False)
+
+    database: Dict[str, Dict[int, Dict]] = {}
+    for collection, elements in data.items():
+        database[collection] = {}
+        max_id = max(elements, default=0)
+        for copy in range(SCALE):
+            for item_id, element in elements.items():
+                new_id = item_id + copy * max_id
+                database[collection][new_id] = copy_element(element)
+                database[collection][new_id]["id"] = new_id
+    return database
+
+
+def measure(name: str, build: Callable[[], Mapping[str, Mapping[int, Any]]]) -> None:
+    gc.collect()
+    tracemalloc.start()
+    database = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = perf_counter()
+    gc.collect()
+    gc_time = perf_counter() - start
+
+    start = perf_counter()
+    for elements in database.values():
+        for item_id in elements:
+            elements[item_id]
+    read_time = perf_counter() - start
+
+    count = sum(len(elements) for elements in database.values())
+    print(
+        f"{name:>8}: {count} elements, {size / 1024 / 1024:.1f} MiB, "
+        f"full gc {gc_time * 1000:.1f} ms, read all {read_time * 1000:.1f} ms"
+    )
+
+
+def main() -> None:
+    print(f"Data from {DB_FILE} copied {SCALE} times")
+    measure("dict", load_data)
+    measure(
+        "compact",
+        lambda: {
+            collection: CompactCollection(elements)
+            for collection, elements in load_data().items()
+        },
+    )
+
+
+main()
@@ -0,0 +1,85 @@
+"""
+Compares the snapshot formats with the data from all_data.msgpack.
+
+For each format, it measures the time until the server could accept
+connections and the time until all collections are decoded.
+
+  python python/benchmark_startup.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+from typing import Any, Dict, Tuple
+
+import msgpack
+
+from apps import core, users  # noqa: F401
+from runtime import db
+from runtime.references import reference_index
+
+
+# Number of times, the data is copied with new ids.
+SCALES = [1, 50]
+
+# Number of times, each measurement is repeated. The best time is used.
+REPEAT = 5
+
+
+def scale_data(scale: int) -> Dict[str, Dict[int, Dict[str, Any]]]:
+    with open(db.DB_FILE, "rb") as file:
+        data = msgpack.unpack(file, raw=False, strict_map_key=False)
+
+    database: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for collection, elements in data.items():
+        database[collection] = {}
+        max_id = max(elements, default=0)
+        for copy in range(scale):
+            for item_id, element in elements.items():
+                new_id = item_id + copy * max_id
+                database[collection][new_id] = dict(element, id=new_id)
+    return database
+
+
+def measure() -> Tuple[float, float]:
+    """
+    Returns the seconds until the server is ready and until all collections
+    are decoded.
+    """
+    best_ready = best_all = float("inf")
+    for _ in range(REPEAT):
+        start = perf_counter()
+        db.CHANGE_ID, database = db.load_snapshot()
+        db.DATABASE.clear()
+        db.DATABASE.update(database)
+        reference_index.build(db.DATABASE)
+        ready = perf_counter() - start
+        asyncio.get_event_loop().run_until_complete(db.load_lazy_collections())
+        best_ready = min(best_ready, ready)
+        best_all = min(best_all, perf_counter() - start)
+    return best_ready, best_all
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.SNAPSHOT_FILE = os.path.join(tmp_dir, "snapshot.msgpack")
+        for scale in SCALES:
+            for snapshot_format in ("msgpack", "indexed"):
+                db.DATABASE.clear()
+                db.DATABASE.update(scale_data(scale))
+                db.SNAPSHOT_FORMAT = snapshot_format
+                db.write_snapshot()
+                size = os.path.getsize(db.SNAPSHOT_FILE)
+
+                ready, all_loaded = measure()
+                print(
+                    f"scale {scale:>3} {snapshot_format:>8}: {size / 1024:.0f} KiB, "
+                    f"ready after {ready * 1000:.1f} ms, "
+                    f"all decoded after {all_loaded * 1000:.1f} ms"
+                )
+
+
+main()
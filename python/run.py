@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from importlib import import_module
 
+from runtime import cluster
 from runtime.db import init_db
 from runtime.websocket import serve
 
@@ -17,4 +18,7 @@ def init() -> None:
 
 
 init()
-serve("localhost", 8000)
+if cluster.WORKERS:
+    cluster.serve_cluster("localhost", 8000, cluster.WORKERS)
+else:
+    serve("localhost", 8000)
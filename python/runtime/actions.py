@@ -1,20 +1,82 @@
 from __future__ import annotations
 
+import asyncio
+from collections import deque
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Type
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
 
 from mypy_extensions import TypedDict
 
 from contextvars import ContextVar
 
-from .all_data import AllData
+from .all_data import AllData, Element, is_hashable
 from .autoupdate import inform_changed_elements
-from .db import db_write_lock, get_all_data, save_database
+from .db import (
+    db_write_lock,
+    get_all_data,
+    get_change_id,
+    get_changed_elements_since,
+    save_database,
+)
+from .metrics import inc, observe, timer
+from .schema import Schema, SchemaError, Validator, compile_schema
 from .utils import debug
 
 
 all_data_var: ContextVar[AllData] = ContextVar("all_data")
 
+# Maximal number of messages, that are saved together.
+BATCH_MAX_SIZE = 100
+
+# Seconds to wait for more messages before a batch is executed.
+BATCH_WINDOW = 0.0
+
+# Execute messages without db_write_lock. See run_optimistic().
+OPTIMISTIC_WRITES = False
+
+# How often a message is executed again after a conflict, before it is given
+# to the write_scheduler.
+OPTIMISTIC_RETRIES = 3
+
+# Maximal number of elements in the payload of a bulk action. It is part of the
+# schemas, so it has to be set before the apps are imported.
+BULK_MAX_SIZE = 10_000
+
+# Priority classes of messages. Messages with a smaller number are executed
+# first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK)
+
+# Maximal number of messages, that wait in the write_scheduler. When it is
+# full, new messages are rejected as busy, if there is no message with a lower
+# priority, that can be rejected instead.
+WRITE_QUEUE_SIZE = 10_000
+
+# Seconds a message can wait in the write_scheduler. Older messages are
+# rejected as busy before they are executed.
+WRITE_DEADLINE = 10.0
+
+# Seconds, after which a client should send a busy message again.
+BUSY_RETRY_AFTER = 0.5
+
+# Users with one of these permissions get PRIORITY_HIGH for their messages,
+# that would have PRIORITY_NORMAL. See register_priority_permission().
+priority_permissions: Set[str] = set()
+
 
 class ValidationError(Exception):
     """
@@ -22,14 +84,47 @@ class ValidationError(Exception):
     """
 
 
+class Busy(Exception):
+    """
+    Exception, if the server has too many messages. The client can send the
+    message again after BUSY_RETRY_AFTER seconds. Nothing was saved.
+    """
+
+
+def register_priority_permission(permission: str) -> None:
+    """
+    Declares a permission, that gives the messages of a user PRIORITY_HIGH.
+    """
+    priority_permissions.add(permission)
+
+
 class Action:
     all_actions: Dict[str, Type["Action"]] = {}
+    # The compiled schemas of the actions.
+    validators: Dict[str, Validator] = {}
     name: str
 
-    def __init_subclass__(cls, name: str, **kwargs: Any) -> None:
+    # The json schema of the payload. See schema.py.
+    schema: Schema = {"type": "object"}
+
+    # The priority class of the action. A message has the lowest priority of
+    # its actions.
+    priority = PRIORITY_NORMAL
+
+    def __init_subclass__(cls, name: Optional[str] = None, **kwargs: Any) -> None:
+        """
+        Registers the action with its name and compiles its schema. Base
+        classes have no name.
+        """
         super().__init_subclass__(**kwargs)  # type: ignore
-        cls.name = name
-        cls.all_actions[name] = cls
+        if name is not None:
+            cls.name = name
+            cls.all_actions[name] = cls
+            cls.validators[name] = compile_schema(cls.get_schema())
+
+    @classmethod
+    def get_schema(cls) -> Schema:
+        return cls.schema
 
     @classmethod
     def get_action(cls, name: str) -> "Action":
@@ -40,9 +135,11 @@ class Action:
 
     async def validate(self, payload: Dict[str, Any]) -> None:
         """
-        The implementation of an action should validate the payload.
+        The implementation of an action should validate the payload against
+        the data, for example, that an element exists.
 
-        This is called before the database lock. So do not edit anything here.
+        This is called in db_write_lock, after the payload matched the schema.
+        So do not edit anything here.
         """
 
     async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -51,19 +148,200 @@ class Action:
         """
 
 
+class BulkAction(Action):
+    """
+    Base for actions, that change many elements of one collection at once.
+
+    The payload has a list `elements`. The whole list is validated in one
+    pass before anything is changed, so a bulk action changes all elements
+    or none. All elements are saved with one change_id and one autoupdate.
+
+    Subclasses set `collection`, the fields an element can have and must
+    have, and the fields, that have to be unique. The unique fields need an
+    index. See all_data.register_index(). If id is a required field, the
+    elements with these ids have to exist.
+
+    The schema of the payload is built from the fields. `field_schemas` can
+    have a schema for some fields.
+    """
+
+    priority = PRIORITY_BULK
+    collection: str
+    fields: Optional[FrozenSet[str]] = None
+    required_fields: Tuple[str, ...] = ()
+    unique_fields: Tuple[str, ...] = ()
+    field_schemas: Dict[str, Schema] = {}
+
+    @classmethod
+    def get_schema(cls) -> Schema:
+        return {
+            "type": "object",
+            "properties": {
+                "elements": {
+                    "type": "array",
+                    "minItems": 1,
+                    "maxItems": BULK_MAX_SIZE,
+                    "items": cls.get_element_schema(),
+                }
+            },
+            "required": ["elements"],
+        }
+
+    @classmethod
+    def get_element_schema(cls) -> Dict[str, Any]:
+        properties: Dict[str, Schema] = {"id": {"type": "integer"}}
+        properties.update(cls.field_schemas)
+        schema: Dict[str, Any] = {
+            "type": "object",
+            "properties": properties,
+            "required": list(cls.required_fields),
+        }
+        if cls.fields is not None:
+            for field in cls.fields:
+                properties.setdefault(field, True)
+            schema["additionalProperties"] = False
+        return schema
+
+    async def validate(self, payload: Dict[str, Any]) -> None:
+        elements = payload["elements"]
+        for element in elements:
+            self.validate_element(element)
+        if "id" in self.required_fields:
+            validate_ids(self, elements)
+        self.validate_unique(elements)
+
+    def validate_element(self, element: Dict[str, Any]) -> None:
+        """
+        Validates one element of the payload against the data. Raises
+        ValidationError, if it is wrong.
+        """
+
+    def validate_unique(self, elements: List[Dict[str, Any]]) -> None:
+        """
+        Checks, that the unique fields have no value twice in the payload and
+        no value of another element in the collection.
+        """
+        collection = all_data_var.get()[self.collection]
+        for field in self.unique_fields:
+            values: Dict[Any, Optional[int]] = {}
+            for element in elements:
+                if field not in element:
+                    continue
+                value = element[field]
+                if not is_hashable(value):
+                    raise ValidationError(f"{field} `{value}` is not valid")
+                if value in values:
+                    raise ValidationError(f"{field} `{value}` is used more than once")
+                values[value] = element.get("id")
+
+            # Elements of the payload, that get a new value, do not have their
+            # old value anymore.
+            changing = set(values.values())
+            for value, item_ids in collection.lookup_many(field, values).items():
+                if item_ids - changing:
+                    raise ValidationError(f"{field} `{value}` already exists")
+
+
+class BulkCreateAction(BulkAction):
+    """
+    Base for actions, that create many elements. The new elements get a
+    block of ids. Returns the ids in the order of the payload.
+    """
+
+    @classmethod
+    def get_element_schema(cls) -> Dict[str, Any]:
+        schema = super().get_element_schema()
+        schema["properties"]["id"] = False
+        return schema
+
+    async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        collection = all_data_var.get()[self.collection]
+        item_ids = collection.add_elements(
+            self.create_element(element, payload) for element in payload["elements"]
+        )
+        return {"ids": item_ids}
+
+    def create_element(
+        self, element: Dict[str, Any], payload: Dict[str, Any]
+    ) -> Element:
+        """
+        Returns the new element for an element of the payload.
+        """
+        return dict(element)
+
+
+class BulkUpdateAction(BulkAction):
+    """
+    Base for actions, that change fields of many elements. Each element of
+    the payload needs the id of the element, it changes.
+    """
+
+    required_fields = ("id",)
+
+    async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        collection = all_data_var.get()[self.collection]
+        for element in payload["elements"]:
+            collection[element["id"]].update(self.update_element(element, payload))
+        return {}
+
+    def update_element(
+        self, element: Dict[str, Any], payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Returns the fields, that are changed, for an element of the payload.
+        """
+        return {key: value for key, value in element.items() if key != "id"}
+
+
+class BulkDeleteAction(BulkAction):
+    """
+    Base for actions, that delete many elements. The elements of the payload
+    only have an id.
+    """
+
+    fields = frozenset({"id"})
+    required_fields = ("id",)
+
+    async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        collection = all_data_var.get()[self.collection]
+        for element in payload["elements"]:
+            del collection[element["id"]]
+        return {}
+
+
+def validate_ids(action: BulkAction, elements: List[Dict[str, Any]]) -> None:
+    """
+    Checks, that the ids of the payload of a bulk action exist and are not
+    used twice.
+    """
+    collection = all_data_var.get()[action.collection]
+    item_ids: Set[int] = set()
+    for element in elements:
+        item_id = element["id"]
+        if not isinstance(item_id, int) or item_id not in collection:
+            raise ValidationError(
+                f"{action.name}: element with id `{item_id}` does not exist"
+            )
+        if item_id in item_ids:
+            raise ValidationError(f"id `{item_id}` is used more than once")
+        item_ids.add(item_id)
+
+
 class ActionData(TypedDict):
     action: str
     payload: Dict[str, Any]
 
 
 async def prepare_actions(
-    actions: List[ActionData],
+    actions: Any,
     # request_user: str,
     now: Callable[[], datetime] = None,
 ) -> List[ActionData]:
     """
-    Adds the current time and the request user to the payload of any action.
+    Checks the message with validate_message() and adds the current time and
+    the request user to the payload of any action.
     """
+    validate_message(actions)
     if now is None:
         now = datetime.utcnow
 
@@ -77,21 +355,308 @@ async def prepare_actions(
     return list(map(add_data, actions))
 
 
-async def handle_actions(actions_data: List[ActionData]) -> List[Dict[str, Any]]:
-    all_data = await get_all_data()
-    all_data_var.set(all_data)
-    return_values: List[Dict[str, Any]] = []
+def validate_message(actions: Any) -> None:
+    """
+    Checks the format of a message and the payload of each action with the
+    schema of the action. Runs before db_write_lock, so wrong messages do not
+    wait for the lock. Raises ValidationError.
+    """
+    if not isinstance(actions, list) or not actions:
+        raise ValidationError("A message needs a list of actions")
+    for index, action_data in enumerate(actions):
+        if not isinstance(action_data, dict) or not isinstance(
+            action_data.get("action"), str
+        ):
+            raise ValidationError(f"Action {index} of the message is not valid")
+        name = action_data["action"]
+        validator = Action.validators.get(name)
+        if validator is None:
+            raise ValidationError(f"Unknown action with name `{name}`")
+        payload = action_data.get("payload")
+        try:
+            if not isinstance(payload, dict):
+                raise SchemaError("has to be object", ("payload",))
+            validator(payload)
+        except SchemaError as err:
+            raise ValidationError(f"{name}: {err}")
 
-    async with db_write_lock:
-        for action_data in actions_data:
-            debug(
-                f"handle action {action_data['action']} with payload {action_data['payload']}"
-            )
-            action = Action.get_action(action_data["action"])
-            await action.validate(action_data["payload"])
-            return_values.append(await action.execute(action_data["payload"]))
 
-        await save_database(all_data)
+def get_priority(actions_data: List[ActionData], permissions: FrozenSet[str]) -> int:
+    """
+    Returns the priority class of a message.
+
+    This is the lowest priority of its actions. Messages of users with a
+    priority permission overtake messages with PRIORITY_NORMAL.
+    """
+    priority = max(
+        (
+            Action.all_actions[action_data["action"]].priority
+            for action_data in actions_data
+            if action_data.get("action") in Action.all_actions
+        ),
+        default=PRIORITY_NORMAL,
+    )
+    if priority == PRIORITY_NORMAL and not priority_permissions.isdisjoint(
+        permissions
+    ):
+        return PRIORITY_HIGH
+    return priority
+
+
+async def handle_actions(
+    actions_data: List[ActionData], priority: int = PRIORITY_NORMAL
+) -> List[Dict[str, Any]]:
+    """
+    Runs the actions of one message and returns their return values.
+
+    The message is executed together with other messages by the
+    write_scheduler. Raises ValidationError, if one of the actions is invalid.
+    In this case, no action of the message is saved. Raises Busy, if the
+    write_scheduler has too many messages.
+    """
+    with timer("openslides_handle_actions_seconds"):
+        if OPTIMISTIC_WRITES:
+            return_values = await run_optimistic(actions_data)
+            if return_values is not None:
+                return return_values
+            inc("openslides_optimistic_fallbacks_total")
+        return await write_scheduler.submit(actions_data, priority)
+
+
+async def run_optimistic(
+    actions_data: List[ActionData]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Executes the actions of one message without db_write_lock.
+
+    The actions run on the database at the current change_id and all_data
+    records, which elements they read. Before the commit, the elements that
+    other writes changed since that change_id are compared with the read
+    elements. If one of them was read, the actions are executed again.
+
+    Returns None, if there was still a conflict after OPTIMISTIC_RETRIES
+    retries.
+    """
+    for _ in range(OPTIMISTIC_RETRIES + 1):
+        change_id = get_change_id()
+        all_data = await get_all_data()
+        all_data_var.set(all_data)
+        try:
+            return_values = await run_actions(actions_data)
+        except Exception:
+            # The error could be caused by a concurrent write.
+            if not has_conflicts(all_data, change_id):
+                raise
+            continue
+
+        # Only wait for the lock, if a batch is running. The check and the
+        # commit do not wait for anything else.
+        lock_start = perf_counter()
+        async with db_write_lock:
+            observe("openslides_db_write_lock_wait_seconds", perf_counter() - lock_start)
+            if has_conflicts(all_data, change_id):
+                inc("openslides_optimistic_conflicts_total")
+                continue
+            written = await save_database(all_data, actions_data)
+            new_change_id = get_change_id()
+
+        await written
+        await inform_changed_elements(all_data, new_change_id)
+        return return_values
+    return None
+
 
-    await inform_changed_elements(all_data)
+def has_conflicts(all_data: AllData, change_id: int) -> bool:
+    """
+    Returns True, if all_data read an element, that was changed after the
+    change_id.
+    """
+    if change_id == get_change_id():
+        return False
+    changed = get_changed_elements_since(change_id)
+    return changed is None or all_data.has_conflicts(changed)
+
+
+async def run_actions(actions_data: List[ActionData]) -> List[Dict[str, Any]]:
+    """
+    Validates and executes the actions of one message on the all_data from
+    all_data_var. Then checks the unique indexes.
+    """
+    return_values: List[Dict[str, Any]] = []
+    for action_data in actions_data:
+        debug(
+            f"handle action {action_data['action']} with payload {action_data['payload']}"
+        )
+        action = Action.get_action(action_data["action"])
+        try:
+            with timer("openslides_action_seconds", action=action.name, stage="validate"):
+                await action.validate(action_data["payload"])
+            with timer("openslides_action_seconds", action=action.name, stage="execute"):
+                return_values.append(await action.execute(action_data["payload"]))
+        except Exception:
+            inc("openslides_actions_total", action=action.name, result="error")
+            raise
+        inc("openslides_actions_total", action=action.name, result="ok")
+    all_data_var.get().check_unique()
     return return_values
+
+
+# A message, the future for its return values and its deadline.
+WriteRequest = Tuple[List[ActionData], "asyncio.Future[List[Dict[str, Any]]]", float]
+
+
+class WriteScheduler:
+    """
+    Collects incoming messages and executes them in batches.
+
+    Each message runs in its own nested transaction, so an invalid message
+    does not change the data. All valid messages of a batch are saved with
+    one commit, one change_id and one autoupdate.
+
+    A batch starts as soon as the previous batch is saved. It contains all
+    messages that came in until then, but not more than BATCH_MAX_SIZE.
+    With BATCH_WINDOW, the scheduler waits some seconds for more messages.
+
+    There is one queue for each priority class. A batch takes the messages
+    with higher priority first. The queues together have at most
+    WRITE_QUEUE_SIZE messages and a message waits at most WRITE_DEADLINE
+    seconds. Else messages are rejected with Busy.
+    """
+
+    def __init__(self) -> None:
+        self.queues: List[Deque[WriteRequest]] = [deque() for _ in PRIORITIES]
+        self.running = False
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+    async def submit(
+        self, actions_data: List[ActionData], priority: int = PRIORITY_NORMAL
+    ) -> List[Dict[str, Any]]:
+        if len(self) >= WRITE_QUEUE_SIZE and not self.reject_lower(priority):
+            inc("openslides_busy_total", reason="queue")
+            raise Busy("The server has too many messages. Try again later.")
+        loop = asyncio.get_event_loop()
+        future: asyncio.Future[List[Dict[str, Any]]] = loop.create_future()
+        self.queues[priority].append(
+            (actions_data, future, loop.time() + WRITE_DEADLINE)
+        )
+        if not self.running:
+            self.running = True
+            asyncio.ensure_future(self.run())
+        return await future
+
+    def reject_lower(self, priority: int) -> bool:
+        """
+        Rejects the newest message with a lower priority than the given one.
+        Returns False, if there is none.
+        """
+        for queue in reversed(self.queues[priority + 1:]):
+            if queue:
+                _, future, _ = queue.pop()
+                inc("openslides_busy_total", reason="priority")
+                if not future.done():
+                    future.set_exception(
+                        Busy("The server has too many messages. Try again later.")
+                    )
+                return True
+        return False
+
+    def take_batch(self) -> List[WriteRequest]:
+        """
+        Returns the next batch. Messages after their deadline are rejected.
+        """
+        now = asyncio.get_event_loop().time()
+        batch: List[WriteRequest] = []
+        for queue in self.queues:
+            while queue and len(batch) < BATCH_MAX_SIZE:
+                request = queue.popleft()
+                if request[1].done():
+                    continue
+                if request[2] < now:
+                    inc("openslides_busy_total", reason="deadline")
+                    request[1].set_exception(
+                        Busy("The message waited too long. Try again later.")
+                    )
+                    continue
+                batch.append(request)
+        return batch
+
+    async def run(self) -> None:
+        try:
+            while len(self):
+                if BATCH_WINDOW:
+                    await asyncio.sleep(BATCH_WINDOW)
+                batch = self.take_batch()
+                if not batch:
+                    continue
+                try:
+                    await self.run_batch(batch)
+                except Exception as err:
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(err)
+        finally:
+            self.running = False
+
+    async def run_batch(self, batch: List[WriteRequest]) -> None:
+        """
+        Executes and saves one batch.
+
+        Does not wait until the batch is written to disk, so the next batch can
+        be executed in the meantime.
+        """
+        results: List[Tuple[asyncio.Future, List[Dict[str, Any]]]] = []
+        saved_actions: List[ActionData] = []
+
+        lock_start = perf_counter()
+        async with db_write_lock:
+            observe("openslides_db_write_lock_wait_seconds", perf_counter() - lock_start)
+            inc("openslides_batches_total")
+            inc("openslides_batch_messages_total", len(batch))
+            all_data = await get_all_data()
+            for actions_data, future, _ in batch:
+                message_data = all_data.begin()
+                all_data_var.set(message_data)
+                try:
+                    return_values = await run_actions(actions_data)
+                except Exception as err:
+                    if not future.done():
+                        future.set_exception(err)
+                    continue
+                message_data.commit()
+                saved_actions.extend(actions_data)
+                results.append((future, return_values))
+
+            if not results:
+                return
+            written = await save_database(all_data, saved_actions)
+            change_id = get_change_id()
+
+        asyncio.ensure_future(self.finish_batch(all_data, change_id, written, results))
+
+    async def finish_batch(
+        self,
+        all_data: AllData,
+        change_id: int,
+        written: asyncio.Future,
+        results: List[Tuple[asyncio.Future, List[Dict[str, Any]]]],
+    ) -> None:
+        """
+        Sends the autoupdate and the responses, when the batch is on disk.
+        """
+        try:
+            await written
+        except Exception as err:
+            for future, _ in results:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        await inform_changed_elements(all_data, change_id)
+        for future, return_values in results:
+            if not future.done():
+                future.set_result(return_values)
+
+
+write_scheduler = WriteScheduler()
@@ -4,37 +4,197 @@ Container classes to handle all_data
 
 from __future__ import annotations
 
-from collections import UserDict
-from typing import Any, Dict, Generator, Tuple
+import sys
+from collections import UserDict, defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generator,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import msgpack
 
 
 ElementID = Tuple[str, int]
 Element = Dict[str, Any]
-CollectionType = Dict[int, Element]
+CollectionType = MutableMapping[int, Element]
+Buffer = Union[bytes, memoryview]
+
+# The indexed fields of each collection. True means, that the index is unique.
+index_definitions: Dict[str, Dict[str, bool]] = defaultdict(dict)
+
+
+def register_index(collection: str, field: str, unique: bool = False) -> None:
+    """
+    Declares an index on a field of a collection.
+
+    Apps should call this on import, for example:
+
+        register_index("users/user", "username", unique=True)
+
+    Values, that are not hashable, are not indexed. With unique, two elements
+    can not have the same value. None is not checked. See
+    AllData.check_unique().
+    """
+    index_definitions[collection][field] = unique
+    committed_indexes.pop(collection, None)
+
+
+def is_hashable(value: Any) -> bool:
+    """
+    Returns True, if the value can be used as key of a dict.
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def copy_element(element: Any) -> Any:
+    """
+    Creates a deep copy of one element or of a value inside an element. Views
+    of committed elements are copied as plain dicts and lists.
+    """
+    return msgpack.unpackb(
+        msgpack.packb(element, default=plain), raw=False, strict_map_key=False
+    )
+
+
+def plain(value: Any) -> Any:
+    """
+    Returns the plain dict or list of a view, that Collection.__getitem__()
+    returns, or of a list or dict inside it. Do not change it.
+
+    It can be used as default for serializers:
+
+        json.dumps(collection[item_id], default=plain)
+    """
+    if isinstance(value, (CopyOnWriteElement, TrackedValue)):
+        return value.current()
+    raise TypeError(f"can not serialize {type(value).__name__!r}")
 
 
 class AllData(UserDict):
     """
     Container for the all_data dict.
 
-    Like a normal dict but with the method get_changed_elements.
+    It is a copy-on-write view on the committed database. Reads fall through
+    to the committed data. Only elements that are written are copied into an
+    overlay. Use commit() to write the overlay into the committed data.
+
+    Use begin() to start a nested transaction. Its commit() writes the changes
+    into the parent AllData instead of the committed data.
+
+    The indexes of the committed data are saved in `indexes`. Use an own dict,
+    if the committed data is not the database.
     """
 
-    def __init__(self, initialdata: Dict[str, CollectionType]) -> None:
-        for name, collection in initialdata.items():
-            if isinstance(collection, dict):
-                initialdata[name] = Collection(collection)  # type: ignore
-        super().__init__(initialdata)
+    parent: Optional[AllData] = None
+
+    def __init__(
+        self,
+        committed: Dict[str, CollectionType],
+        indexes: Optional[Dict[str, Indexes]] = None,
+    ) -> None:
+        self.committed = committed
+        self.indexes = committed_indexes if indexes is None else indexes
+        super().__init__(committed)
+
+    def begin(self) -> AllData:
+        """
+        Returns a nested transaction on this AllData.
+
+        If the nested transaction is not committed, its changes are lost.
+        """
+        child = AllData({}, self.indexes)
+        child.parent = self
+        for name, collection in self.items():
+            child.data[name] = collection.begin()
+        return child
+
+    def __setitem__(self, name: str, collection: Any) -> None:
+        if not isinstance(collection, Collection):
+            if name in self.committed and collection is self.committed[name]:
+                collection = Collection(name, collection, indexes=self.indexes)
+            else:
+                # A new collection. All its elements are part of the overlay.
+                elements = collection
+                collection = Collection(name, indexes=self.indexes)
+                collection.update(elements)
+        super().__setitem__(name, collection)
 
     def get_changed_elements(self) -> Generator[ElementID, None, None]:
         """
-        Generator that returns all elements that have changed since the
+        Generator that returns all elements that were created or changed since
+        the initialisation.
+        """
+        for name, collection in self.items():
+            for item_id in collection.changed:
+                yield (name, item_id)
+
+    def get_deleted_elements(self) -> Generator[ElementID, None, None]:
+        """
+        Generator that returns all elements that were deleted since the
         initialisation.
         """
         for name, collection in self.items():
-            for item_id in collection.get_changed_elements():
+            for item_id in collection.deleted:
                 yield (name, item_id)
 
+    def has_conflicts(self, changed: Set[ElementID]) -> bool:
+        """
+        Returns True, if one of the given elements was read or an index lookup
+        would now find other elements.
+
+        Use it with the elements that were changed by other writes since this
+        AllData was created.
+        """
+        changed_collections = {collection for collection, _ in changed}
+        for name, collection in self.items():
+            if name not in changed_collections:
+                continue
+            if collection.read_all or collection.lookups_changed():
+                return True
+        for name, item_id in changed:
+            if name in self and item_id in self[name].read:
+                return True
+        return False
+
+    def check_unique(self) -> None:
+        """
+        Raises ValidationError, if a changed element has the value of a unique
+        index, that another element has.
+        """
+        for collection in self.values():
+            collection.check_unique()
+
+    def commit(self) -> None:
+        """
+        Writes all changed elements into the committed data or, for a nested
+        transaction, into the parent.
+        """
+        for name, collection in self.items():
+            if self.parent is not None and collection.parent is None:
+                # A new collection of the nested transaction.
+                self.parent[name] = collection.as_dict()
+                continue
+            collection.commit()
+            self.committed.setdefault(name, collection.committed)  # type: ignore
+
     def as_dict(self) -> Dict[str, CollectionType]:
         """
         Returns the data of the container as normal dict.
@@ -42,45 +202,657 @@ class AllData(UserDict):
         return {key: value.as_dict() for key, value in self.items()}
 
 
-class Collection(UserDict):
+class Collection(MutableMapping):
     """
     Container for one collection inside all_data.
 
-    Like a dict but with methods to add one element and get_changed_elements.
+    Like a dict but with methods to add one element and to get the changed
+    elements.
+
+    Elements that were not written yet are returned as CopyOnWriteElement.
+    Changed, new or deleted elements are saved in the overlay. A deleted
+    element is saved as None. All writes are recorded in the sets changed and
+    deleted.
+
+    The ids of all committed elements, that were read, are recorded in the set
+    read. If all ids were read, for example by iterating over the collection,
+    read_all is True. Index lookups record the field, the value and the found
+    committed ids in read_values.
+
+    The collection of a nested transaction has a parent collection. It reads
+    the current elements of the parent instead of the committed data.
     """
 
-    data: Dict[int, Element]
     name: str
-    init_hashes: Dict[int, int]
+    committed: MutableMapping[int, Element]
+    all_indexes: Dict[str, Indexes]
+    parent: Optional[Collection]
+    overlay: Dict[int, Optional[Element]]
+    changed: Set[int]
+    deleted: Set[int]
+    read: Set[int]
+    read_all: bool
+    read_values: Dict[Tuple[str, Hashable], FrozenSet[int]]
+
+    def __init__(
+        self,
+        name: str,
+        committed: Optional[CollectionType] = None,
+        parent: Optional[Collection] = None,
+        indexes: Optional[Dict[str, Indexes]] = None,
+    ) -> None:
+        self.name = name
+        self.parent = parent
+        self.all_indexes = committed_indexes if indexes is None else indexes
+        if parent is not None:
+            self.committed = ParentView(parent)
+        else:
+            self.committed = {} if committed is None else committed
+        self.overlay = {}
+        self.changed = set()
+        self.deleted = set()
+        self.read = set()
+        self.read_all = False
+        self.read_values = {}
 
-    def __init__(self, initialdata: Dict[int, Element]) -> None:
-        self.init_hashes = {}
-        for item_id, element in initialdata.items():
-            self.init_hashes[item_id] = hash(repr(element))
-        super().__init__(initialdata)
+    def __getitem__(self, item_id: int) -> Any:
+        """
+        Returns an element, that was not changed in this transaction, as
+        CopyOnWriteElement. It is a Mapping and its lists and dicts are views
+        too. It is copied, when it is changed. Use get_element() or plain() to
+        get a plain dict, for example for json.dumps().
+        """
+        if item_id in self.overlay:
+            element = self.overlay[item_id]
+            if element is None:
+                raise KeyError(item_id)
+            return element
+        self.read.add(item_id)
+        return CopyOnWriteElement(self, item_id, self.committed[item_id])
+
+    def __setitem__(self, item_id: int, element: Any) -> None:
+        if not isinstance(element, dict) or any(
+            isinstance(value, TrackedValue) for value in element.values()
+        ):
+            element = copy_element(dict(element))
+        self.overlay[item_id] = element
+        self.changed.add(item_id)
+        self.deleted.discard(item_id)
+
+    def __delitem__(self, item_id: int) -> None:
+        if item_id not in self:
+            raise KeyError(item_id)
+        self.changed.discard(item_id)
+        if item_id in self.committed:
+            self.overlay[item_id] = None
+            self.deleted.add(item_id)
+        else:
+            del self.overlay[item_id]
+
+    def __contains__(self, item_id: object) -> bool:
+        if item_id in self.overlay:
+            return self.overlay[item_id] is not None  # type: ignore
+        self.read.add(item_id)  # type: ignore
+        return item_id in self.committed
+
+    def __iter__(self) -> Iterator[int]:
+        self.read_all = True
+        overlay = self.overlay
+        for item_id in self.committed:
+            if item_id not in overlay or overlay[item_id] is not None:
+                yield item_id
+        for item_id, element in overlay.items():
+            if element is not None and item_id not in self.committed:
+                yield item_id
+
+    def __len__(self) -> int:
+        self.read_all = True
+        length = len(self.committed) - len(self.deleted)
+        for item_id in self.changed:
+            if item_id not in self.committed:
+                length += 1
+        return length
+
+    def __repr__(self) -> str:
+        return f"Collection({self.as_dict()!r})"
+
+    def begin(self) -> Collection:
+        """
+        Returns the collection for a nested transaction.
+        """
+        return Collection(self.name, parent=self)
+
+    def touch(self, item_id: int) -> Element:
+        """
+        Returns the element from the overlay. Copies it from the committed
+        data, if this is the first write.
+        """
+        if item_id not in self.overlay:
+            self.read.add(item_id)
+            self[item_id] = copy_element(self.committed[item_id])
+        element = self.overlay[item_id]
+        if element is None:
+            raise KeyError(item_id)
+        return element
+
+    def get_element(self, item_id: int) -> Element:
+        """
+        Returns the current version of an element as plain dict without
+        copying it. Do not change the returned element.
+        """
+        if item_id in self.overlay:
+            element = self.overlay[item_id]
+            if element is None:
+                raise KeyError(item_id)
+            return element
+        self.read.add(item_id)
+        return self.committed[item_id]
+
+    @property
+    def indexes(self) -> "Indexes":
+        return get_indexes(self.name, self.committed, self.all_indexes)
+
+    def lookup(self, field: str, value: Any) -> Set[int]:
+        """
+        Returns the ids of all elements, where the field has the value.
+
+        The field needs an index. See register_index().
+        """
+        if self.parent is not None:
+            item_ids = self.parent.lookup(field, value)
+        else:
+            item_ids = set(self.indexes.lookup(field, value))
+            if is_hashable(value):
+                self.read_values[(field, value)] = frozenset(item_ids)
+        for item_id, element in self.overlay.items():
+            if element is not None and element.get(field) == value:
+                item_ids.add(item_id)
+            else:
+                item_ids.discard(item_id)
+        return item_ids
+
+    def lookup_many(self, field: str, values: Iterable[Any]) -> Dict[Any, Set[int]]:
+        """
+        Like lookup() for many values at once. The overlay is only read once.
+
+        The values have to be hashable.
+        """
+        if self.parent is not None:
+            result = self.parent.lookup_many(field, values)
+        else:
+            result = {value: set(self.indexes.lookup(field, value)) for value in values}
+            for value, item_ids in result.items():
+                self.read_values[(field, value)] = frozenset(item_ids)
+        for item_id, element in self.overlay.items():
+            old_element = self.committed.get(item_id)
+            if old_element is not None and is_hashable(old_element.get(field)):
+                result.get(old_element.get(field), set()).discard(item_id)
+            if element is not None and is_hashable(element.get(field)):
+                if element.get(field) in result:
+                    result[element.get(field)].add(item_id)
+        return result
+
+    def lookups_changed(self) -> bool:
+        """
+        Returns True, if an index lookup would now find other committed
+        elements than before.
+        """
+        if not self.read_values:
+            return False
+        indexes = self.indexes
+        return any(
+            indexes.lookup(field, value) != item_ids
+            for (field, value), item_ids in self.read_values.items()
+        )
+
+    def check_unique(self) -> None:
+        """
+        Raises ValidationError, if a changed element has the value of a unique
+        index, that another element has. Values, that did not change, are not
+        looked up.
+        """
+        from .actions import ValidationError
+
+        for field, unique in index_definitions.get(self.name, {}).items():
+            if not unique:
+                continue
+            values: Dict[Hashable, int] = {}
+            for item_id in self.changed:
+                element = self.overlay[item_id]
+                value = None if element is None else element.get(field)
+                if value is None or not is_hashable(value):
+                    continue
+                old_element = self.committed.get(item_id)
+                if old_element is not None and old_element.get(field) == value:
+                    continue
+                if value in values:
+                    raise ValidationError(f"{field} `{value}` already exists")
+                values[value] = item_id
+            if not values:
+                continue
+            for value, item_ids in self.lookup_many(field, values).items():
+                if item_ids - {values[value]}:
+                    raise ValidationError(f"{field} `{value}` already exists")
+
+    def get_by(self, field: str, value: Any) -> Optional[int]:
+        """
+        Returns the id of the element, where the field has the value, or None.
+
+        Use this for fields with an unique index.
+        """
+        item_ids = self.lookup(field, value)
+        return min(item_ids) if item_ids else None
+
+    def next_id(self) -> int:
+        """
+        Returns the id for a new element. This is the highest id plus one.
+        """
+        self.read_all = True
+        if self.parent is not None:
+            max_id = self.parent.next_id() - 1
+        else:
+            max_id = self.indexes.max_id
+        if max_id in self.deleted:
+            return max(self, default=0) + 1
+        for item_id in self.changed:
+            max_id = max(max_id, item_id)
+        return max_id + 1
 
     def add_element(self, element: Element) -> int:
         """
         Helper to add one element to the dict. Automaticly creates an id.
         """
-        new_id = max(self) + 1
+        new_id = self.next_id()
         element["id"] = new_id
         self[new_id] = element
         return new_id
 
-    def get_changed_elements(self) -> Generator[int, None, None]:
+    def add_elements(self, elements: Iterable[Element]) -> List[int]:
         """
-        Generator that returns all elements that have changed since the
-        initialisation.
+        Adds many elements. They get a block of ids after the highest id.
         """
-        for item_id, element in self.items():
-            if hash(repr(element)) != self.init_hashes.get(item_id):
-                yield item_id
+        new_ids: List[int] = []
+        new_id = self.next_id()
+        for element in elements:
+            element["id"] = new_id
+            self[new_id] = element
+            new_ids.append(new_id)
+            new_id += 1
+        return new_ids
 
-        yield from self.init_hashes.keys() - self.keys()
+    def commit(self) -> None:
+        """
+        Writes the changed elements into the committed data or into the parent
+        collection.
+
+        The sets changed and deleted are kept, so the autoupdate can use them
+        after the commit.
+        """
+        if self.parent is not None:
+            for item_id in self.changed:
+                self.parent[item_id] = self.overlay[item_id]
+            for item_id in self.deleted:
+                del self.parent[item_id]
+            return
+
+        indexes = self.indexes
+        for item_id in self.changed:
+            element = self.overlay[item_id]
+            indexes.remove(item_id, self.committed.get(item_id))
+            self.committed[item_id] = element  # type: ignore
+            indexes.add(item_id, element)
+        for item_id in self.deleted:
+            indexes.remove(item_id, self.committed.pop(item_id, None))
+            if item_id == indexes.max_id:
+                indexes.max_id = max(self.committed, default=0)
 
     def as_dict(self) -> Dict[int, Element]:
         """
         Returns the data of the collection as normal dict.
         """
-        return self.data
+        return {item_id: self.get_element(item_id) for item_id in self}
+
+
+class ParentView(MutableMapping):
+    """
+    Read only view on the current elements of a parent collection. It is
+    used as committed data of a nested transaction.
+    """
+
+    def __init__(self, parent: Collection) -> None:
+        self.parent = parent
+
+    def __getitem__(self, item_id: int) -> Element:
+        return self.parent.get_element(item_id)
+
+    def __setitem__(self, item_id: int, element: Element) -> None:
+        raise TypeError("The parent of a nested transaction is read only.")
+
+    def __delitem__(self, item_id: int) -> None:
+        raise TypeError("The parent of a nested transaction is read only.")
+
+    def __contains__(self, item_id: object) -> bool:
+        return item_id in self.parent
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.parent)
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+
+# Marks a field, that an element of a CompactCollection does not have.
+MISSING = object()
+
+
+class CompactCollection(MutableMapping):
+    """
+    Committed elements of one collection, that need less memory than a dict
+    of dicts.
+
+    The field names of all elements are saved once in a list. Each element is
+    saved as tuple with its values in the order of this list.
+    Reading an element returns a new dict. Do not change it, use a Collection
+    to change elements.
+    """
+
+    def __init__(self, elements: Optional[Mapping[int, Element]] = None) -> None:
+        self.fields: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.records: Dict[int, Tuple[Any, ...]] = {}
+        if elements is not None:
+            for item_id, element in elements.items():
+                self[item_id] = element
+
+    def __getitem__(self, item_id: int) -> Element:
+        return {
+            key: value
+            for key, value in zip(self.fields, self.records[item_id])
+            if value is not MISSING
+        }
+
+    def __setitem__(self, item_id: int, element: Element) -> None:
+        for key in element:
+            if key not in self.positions:
+                self.positions[key] = len(self.fields)
+                self.fields.append(sys.intern(key))
+        self.records[item_id] = tuple(element.get(key, MISSING) for key in self.fields)
+
+    def __delitem__(self, item_id: int) -> None:
+        del self.records[item_id]
+
+    def __contains__(self, item_id: object) -> bool:
+        return item_id in self.records
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class LazyCollection(MutableMapping):
+    """
+    Committed elements of one collection, that are decoded on first access.
+
+    `raw` is the encoded collection until it is decoded. load() decodes it.
+    """
+
+    def __init__(
+        self, raw: Buffer, decode: Callable[[Buffer], CollectionType]
+    ) -> None:
+        self.raw: Optional[Buffer] = raw
+        self.decode = decode
+        self.elements: Optional[CollectionType] = None
+
+    def load(self) -> CollectionType:
+        """
+        Returns the decoded collection.
+        """
+        if self.elements is None:
+            assert self.raw is not None
+            self.elements = self.decode(self.raw)
+            self.raw = None
+        return self.elements
+
+    def __getitem__(self, item_id: int) -> Element:
+        return self.load()[item_id]
+
+    def __setitem__(self, item_id: int, element: Element) -> None:
+        self.load()[item_id] = element
+
+    def __delitem__(self, item_id: int) -> None:
+        del self.load()[item_id]
+
+    def __contains__(self, item_id: object) -> bool:
+        return item_id in self.load()
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+def compact_database(
+    database: MutableMapping[str, CollectionType], names: Iterable[str]
+) -> None:
+    """
+    Replaces the given collections of a database with CompactCollections.
+    """
+    for name in names:
+        if name in database and not isinstance(database[name], CompactCollection):
+            database[name] = CompactCollection(database[name])
+
+
+class Indexes:
+    """
+    The indexes and the highest id of the committed elements of one
+    collection.
+
+    They are updated, when a Collection is committed. A rollback does not
+    change them, because the overlay is only thrown away.
+    """
+
+    def __init__(self, name: str, committed: Mapping[int, Element]) -> None:
+        self.committed = committed
+        self.unique = index_definitions.get(name, {})
+        self.values: Dict[str, Dict[Hashable, Set[int]]] = {
+            field: defaultdict(set) for field in self.unique
+        }
+        self.max_id = 0
+        for item_id, element in committed.items():
+            self.add(item_id, element)
+
+    def lookup(self, field: str, value: Any) -> Set[int]:
+        try:
+            index = self.values[field]
+        except KeyError:
+            raise KeyError(f"There is no index for field `{field}`")
+        try:
+            return index.get(value, set())
+        except TypeError:
+            # Values, that are not hashable, are not in the index.
+            return set()
+
+    def add(self, item_id: int, element: Optional[Element]) -> None:
+        if element is None:
+            return
+        self.max_id = max(self.max_id, item_id)
+        for field, index in self.values.items():
+            value = element.get(field)
+            if isinstance(value, Hashable):
+                index[value].add(item_id)
+
+    def remove(self, item_id: int, element: Optional[Element]) -> None:
+        if element is None:
+            return
+        for field, index in self.values.items():
+            value = element.get(field)
+            if isinstance(value, Hashable) and value in index:
+                index[value].discard(item_id)
+                if not index[value]:
+                    del index[value]
+
+
+committed_indexes: Dict[str, Indexes] = {}
+
+
+def get_indexes(
+    name: str,
+    committed: Mapping[int, Element],
+    all_indexes: Optional[Dict[str, Indexes]] = None,
+) -> Indexes:
+    """
+    Returns the indexes of a committed collection.
+
+    They are built on first use and again, when the committed dict of the
+    collection was replaced. They are saved in all_indexes, which is
+    committed_indexes for the database.
+    """
+    if all_indexes is None:
+        all_indexes = committed_indexes
+    indexes = all_indexes.get(name)
+    if indexes is None or indexes.committed is not committed:
+        indexes = all_indexes[name] = Indexes(name, committed)
+    return indexes
+
+
+def track(element: CopyOnWriteElement, path: Tuple[Any, ...], value: Any) -> Any:
+    """
+    Wraps a nested list or dict of an element that was not copied yet, so
+    writes to it are tracked.
+    """
+    if element.copied or not isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, dict):
+        return TrackedDict(element, path)
+    return TrackedList(element, path)
+
+
+class CopyOnWriteElement(MutableMapping):
+    """
+    Read only view on a committed element.
+
+    The element is copied into the overlay of its collection on the first
+    write. Nested lists and dicts are returned as tracked values, so writing
+    them also copies the element.
+    """
+
+    def __init__(self, collection: Collection, item_id: int, element: Element) -> None:
+        self.collection = collection
+        self.item_id = item_id
+        self.element = element
+        self.copied = False
+
+    def current(self) -> Element:
+        """
+        Returns the element, or its copy, if it was copied by someone else.
+        """
+        if not self.copied and self.collection.overlay.get(self.item_id):
+            self.element = self.collection.touch(self.item_id)
+            self.copied = True
+        return self.element
+
+    def writable(self) -> Element:
+        """
+        Returns the copy of the element from the overlay.
+        """
+        if not self.copied:
+            self.element = self.collection.touch(self.item_id)
+            self.copied = True
+        return self.element
+
+    def __getitem__(self, key: str) -> Any:
+        return track(self, (key,), self.current()[key])
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.writable()[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.writable()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.current())
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+    def __repr__(self) -> str:
+        return repr(self.current())
+
+
+class TrackedValue:
+    """
+    Base class for a nested value of a CopyOnWriteElement.
+
+    The value is looked up by its path every time, so it always points into
+    the current version of the element.
+    """
+
+    def __init__(self, element: CopyOnWriteElement, path: Tuple[Any, ...]) -> None:
+        self.element = element
+        self.path = path
+
+    def resolve(self, element: Element) -> Any:
+        value: Any = element
+        for key in self.path:
+            value = value[key]
+        return value
+
+    def current(self) -> Any:
+        return self.resolve(self.element.current())
+
+    def writable(self) -> Any:
+        return self.resolve(self.element.writable())
+
+    def __repr__(self) -> str:
+        return repr(self.current())
+
+
+class TrackedDict(TrackedValue, MutableMapping):
+    """
+    Tracked dict inside an element.
+    """
+
+    def __getitem__(self, key: Any) -> Any:
+        return track(self.element, self.path + (key,), self.current()[key])
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.writable()[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        del self.writable()[key]
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.current())
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+
+class TrackedList(TrackedValue, MutableSequence):
+    """
+    Tracked list inside an element.
+    """
+
+    def __getitem__(self, index: Any) -> Any:
+        value = self.current()[index]
+        if isinstance(index, slice):
+            return copy_element(value)
+        return track(self.element, self.path + (index,), value)
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        self.writable()[index] = value
+
+    def __delitem__(self, index: Any) -> None:
+        del self.writable()[index]
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+    def __eq__(self, other: object) -> bool:
+        return list(self) == other
+
+    def insert(self, index: int, value: Any) -> None:
+        self.writable().insert(index, value)
@@ -1,31 +1,188 @@
 from __future__ import annotations
 
 from collections import defaultdict
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-from .all_data import AllData
+from .all_data import AllData, ElementID
+from .db import (
+    DATABASE,
+    get_change_id,
+    get_changed_elements_at,
+    get_changed_elements_since,
+)
+from .delta import PreviousType, previous_elements
+from .metrics import timer
+from .references import reference_index
 
 
 ChangedElementsType = Dict[str, List[Dict[str, Any]]]
 DeletedElementsType = Dict[str, List[int]]
 
+# Functions, that get each change, when it is saved. They are called in the
+# order of the change_ids. See cluster.py.
+change_listeners: List[Callable[[AllData, int], None]] = []
 
-async def inform_changed_elements(all_data: AllData) -> None:
+
+async def inform_changed_elements(all_data: AllData, change_id: int) -> None:
+    """
+    Sends the elements of one change to all clients.
+
+    This are the changed elements of all_data and the elements, that embed
+    one of them. The versions, that the clients had before, are given to
+    send_to_all() for the clients, that get patches. See delta.py.
+    """
     from .websocket import Client
 
+    for listener in change_listeners:
+        listener(all_data, change_id)
+
+    element_ids = get_changed_elements_at(change_id)
+    if element_ids is None:
+        element_ids = set(all_data.get_changed_elements())
+        element_ids.update(all_data.get_deleted_elements())
+    if not Client.all_clients:
+        previous_elements.discard(element_ids)
+        return
+
+    with timer("openslides_inform_changed_elements_seconds"):
+        with timer("openslides_render_elements_seconds"):
+            changed_elements, deleted_elements = render_elements(element_ids, all_data)
+            previous: PreviousType = {}
+            for collection, elements in changed_elements.items():
+                for element in elements:
+                    item_id = element["id"]
+                    old_element = previous_elements.replace((collection, item_id), element)
+                    if old_element is not None:
+                        previous.setdefault(collection, {})[item_id] = old_element
+            for collection, item_ids in deleted_elements.items():
+                previous_elements.discard(
+                    (collection, item_id) for item_id in item_ids
+                )
+
+        await Client.send_to_all(
+            {
+                "type": "autoupdate",
+                "changed": changed_elements,
+                "deleted": deleted_elements,
+                "all_data": False,
+                "change_id": change_id,
+                "from_change_id": change_id - 1,
+            },
+            previous,
+        )
+
+
+def get_autoupdate_since(change_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Returns one autoupdate with all changes after the given change_id.
+
+    Returns None, if the change history does not go back to the change_id. In
+    this case, the client needs all data.
+    """
+    element_ids = get_changed_elements_since(change_id)
+    if element_ids is None:
+        return None
+
+    changed_elements, deleted_elements = render_elements(element_ids)
+    return {
+        "type": "autoupdate",
+        "changed": changed_elements,
+        "deleted": deleted_elements,
+        "all_data": False,
+        "change_id": get_change_id(),
+        "from_change_id": change_id,
+    }
+
+
+def render_elements(
+    element_ids: Set[ElementID], all_data: Optional[AllData] = None
+) -> Tuple[ChangedElementsType, DeletedElementsType]:
+    """
+    Returns the current version of the elements with their referenced_data.
+    Elements, that are not in the database, are returned as deleted.
+
+    The elements, that all_data changed or deleted, are taken from all_data,
+    because the database could already have newer changes.
+    """
+    changed_ids: Set[ElementID] = set()
+    deleted_ids: Set[ElementID] = set()
+    if all_data is not None:
+        changed_ids.update(all_data.get_changed_elements())
+        deleted_ids.update(all_data.get_deleted_elements())
+
     changed_elements: ChangedElementsType = defaultdict(list)
     deleted_elements: DeletedElementsType = defaultdict(list)
-    for collection, item_id in all_data.get_changed_elements():
-        if item_id in all_data[collection]:
-            changed_elements[collection].append(all_data[collection][item_id])
+    for collection, item_id in element_ids:
+        if all_data is not None and (collection, item_id) in changed_ids:
+            element = all_data[collection].get_element(item_id)
+        elif (collection, item_id) in deleted_ids:
+            element = None
         else:
+            element = DATABASE.get(collection, {}).get(item_id)
+        if element is None:
             deleted_elements[collection].append(item_id)
+        else:
+            changed_elements[collection].append(
+                reference_index.render(DATABASE, collection, element)
+            )
+    return changed_elements, deleted_elements
+
+
+def get_full_data() -> Dict[str, Any]:
+    """
+    Returns an autoupdate with all data.
+
+    Elements in the database are never changed in place, so the lists of the
+    returned autoupdate can be used after the next write. Elements with
+    referenced_data are copies.
+    """
+    all_data: ChangedElementsType = {
+        collection: [
+            reference_index.render(DATABASE, collection, element)
+            for element in data.values()
+        ]
+        for collection, data in DATABASE.items()
+    }
+    return {
+        "type": "autoupdate",
+        "changed": all_data,
+        "deleted": {},
+        "all_data": True,
+        "change_id": get_change_id(),
+        "from_change_id": 0,
+    }
+
+
+def merge_autoupdates(autoupdates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges autoupdates into one autoupdate. The autoupdates have to be in the
+    order of their change_ids.
+    """
+    changed: Dict[str, Dict[int, Dict[str, Any]]] = defaultdict(dict)
+    deleted: Dict[str, Set[int]] = defaultdict(set)
+    for autoupdate in autoupdates:
+        for collection, elements in autoupdate["changed"].items():
+            for element in elements:
+                changed[collection][element["id"]] = element
+                deleted[collection].discard(element["id"])
+        for collection, item_ids in autoupdate["deleted"].items():
+            for item_id in item_ids:
+                changed[collection].pop(item_id, None)
+                deleted[collection].add(item_id)
 
-    await Client.send_to_all(
-        {
-            "type": "autoupdate",
-            "changed": changed_elements,
-            "deleted": deleted_elements,
-            "all_data": False,
-        }
-    )
+    return {
+        "type": "autoupdate",
+        "changed": {
+            collection: list(elements.values())
+            for collection, elements in changed.items()
+            if elements
+        },
+        "deleted": {
+            collection: list(item_ids)
+            for collection, item_ids in deleted.items()
+            if item_ids
+        },
+        "all_data": False,
+        "change_id": autoupdates[-1]["change_id"],
+        "from_change_id": autoupdates[0]["from_change_id"],
+    }
@@ -0,0 +1,350 @@
+"""
+Runs the server with many processes.
+
+Konzept.md: One asyncio process uses one core. With WORKERS > 0, the server
+starts that many worker processes, that share the websocket port. Each worker
+has a replica of the database and its own clients.
+
+The main process is the owner of the writes. It has the action log and the
+db_write_lock. Workers send their writes to the owner. The owner saves them
+and publishes each change to all workers. The workers apply it to their
+replica and send the autoupdate to their clients.
+
+Owner and workers talk over a unix socket (BROKER_SOCKET). This stands in for
+a central service like redis streams. Each message is msgpack with its length
+in front.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import struct
+import sys
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import msgpack
+
+from . import actions, db, metrics
+from .actions import PRIORITY_NORMAL, ActionData, Busy, ValidationError, handle_actions
+from .all_data import AllData
+from .autoupdate import change_listeners, inform_changed_elements
+from .compactor import run_compactor
+from .metrics import inc, serve_metrics
+from .utils import debug
+
+
+# Number of worker processes. With 0, the server runs in one process.
+WORKERS = 0
+
+BROKER_SOCKET = "openslides.sock"
+
+# Number of changes, that the owner keeps to send them to workers, that
+# connect later than the changes were saved.
+BROKER_HISTORY_SIZE = 1000
+
+# Seconds a worker waits for the broker when it starts.
+BROKER_CONNECT_TIMEOUT = 10.0
+
+MESSAGE_HEADER = struct.Struct("!I")
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    data = msgpack.packb(message)
+    return MESSAGE_HEADER.pack(len(data)) + data
+
+
+async def read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    """
+    Reads one message. Raises asyncio.IncompleteReadError, when the other side
+    closed the connection.
+    """
+    (size,) = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    return msgpack.unpackb(
+        await reader.readexactly(size), raw=False, strict_map_key=False
+    )
+
+
+class Broker:
+    """
+    The owner side of the unix socket.
+
+    Workers send {"type": "write", "id": 1, "priority": 1, "actions": [...]}
+    and get {"type": "result", "id": 1, "responses": [...]} or an error. Each
+    saved change is sent to all workers as {"type": "change", "change_id": 42,
+    "changed": {...}, "deleted": {...}}. For a worker, the change comes
+    before the result of its write.
+    """
+
+    def __init__(self) -> None:
+        self.workers: Set[asyncio.StreamWriter] = set()
+        self.changes: Deque[Tuple[int, bytes]] = deque(maxlen=BROKER_HISTORY_SIZE)
+
+    def publish(self, all_data: AllData, change_id: int) -> None:
+        """
+        Sends a change to all workers. Called with each change in the order
+        of the change_ids, when it is on disk.
+
+        The elements are taken from all_data, because the database could
+        already have newer changes.
+        """
+        changed: Dict[str, Dict[int, Any]] = {}
+        deleted: Dict[str, List[int]] = {}
+        for collection, item_id in all_data.get_changed_elements():
+            element = all_data[collection].get_element(item_id)
+            changed.setdefault(collection, {})[item_id] = element
+        for collection, item_id in all_data.get_deleted_elements():
+            deleted.setdefault(collection, []).append(item_id)
+
+        frame = encode_message(
+            {
+                "type": "change",
+                "change_id": change_id,
+                "changed": changed,
+                "deleted": deleted,
+            }
+        )
+        self.changes.append((change_id, frame))
+        inc("openslides_broker_changes_total")
+        for writer in self.workers:
+            writer.write(frame)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Handles the connection of one worker.
+
+        The worker says first, which change it has. It gets the newer changes,
+        before it gets new ones.
+        """
+        try:
+            hello = await read_message(reader)
+            missed = [
+                frame
+                for change_id, frame in self.changes
+                if change_id > hello["change_id"]
+            ]
+            if len(missed) < db.get_change_id() - hello["change_id"]:
+                print(f"Worker at change {hello['change_id']} is too old")
+                return
+            for frame in missed:
+                writer.write(frame)
+            self.workers.add(writer)
+            debug(f"Worker connected, {len(self.workers)} workers")
+
+            while True:
+                message = await read_message(reader)
+                if message["type"] == "write":
+                    asyncio.ensure_future(self.write(writer, message))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+    async def write(
+        self, writer: asyncio.StreamWriter, message: Dict[str, Any]
+    ) -> None:
+        """
+        Saves the actions of a worker and sends the result back.
+        """
+        result: Dict[str, Any] = {"type": "result", "id": message["id"]}
+        try:
+            result["responses"] = await handle_actions(
+                message["actions"], message.get("priority", PRIORITY_NORMAL)
+            )
+        except Busy as err:
+            result["error"] = str(err)
+            result["busy"] = True
+        except ValidationError as err:
+            result["error"] = str(err)
+            result["validation"] = True
+        except Exception as err:
+            result["error"] = f"{type(err).__name__}: {err}"
+            result["validation"] = False
+        if not writer.is_closing():
+            writer.write(encode_message(result))
+
+
+class RemoteWriteScheduler:
+    """
+    Write scheduler of a worker. It sends the actions to the owner instead
+    of saving them. Replaces actions.write_scheduler.
+    """
+
+    def __init__(self) -> None:
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.requests: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    async def submit(
+        self, actions_data: List[ActionData], priority: int = PRIORITY_NORMAL
+    ) -> List[Dict[str, Any]]:
+        if self.writer is None:
+            raise RuntimeError("The worker is not connected to the broker.")
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_event_loop().create_future()
+        self.requests[request_id] = future
+        self.writer.write(
+            encode_message(
+                {
+                    "type": "write",
+                    "id": request_id,
+                    "priority": priority,
+                    "actions": actions_data,
+                }
+            )
+        )
+        try:
+            return await future
+        finally:
+            self.requests.pop(request_id, None)
+
+    def set_result(self, message: Dict[str, Any]) -> None:
+        future = self.requests.get(message["id"])
+        if future is None or future.done():
+            return
+        if "error" not in message:
+            future.set_result(message["responses"])
+        elif message.get("busy"):
+            future.set_exception(Busy(message["error"]))
+        elif message["validation"]:
+            future.set_exception(ValidationError(message["error"]))
+        else:
+            future.set_exception(RuntimeError(message["error"]))
+
+    async def connect(self) -> asyncio.StreamReader:
+        """
+        Opens the connection to the broker. Waits, until the owner started it.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + BROKER_CONNECT_TIMEOUT
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(BROKER_SOCKET)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+            else:
+                break
+        self.writer.write(encode_message({"type": "hello", "change_id": db.CHANGE_ID}))
+        return reader
+
+    async def run(self, reader: asyncio.StreamReader) -> None:
+        """
+        Handles the messages of the broker. Returns, when the connection is
+        closed.
+        """
+        try:
+            while True:
+                message = await read_message(reader)
+                if message["type"] == "change":
+                    await apply_change(message)
+                elif message["type"] == "result":
+                    self.set_result(message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        for future in self.requests.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Lost the connection to the broker."))
+
+
+remote_write_scheduler = RemoteWriteScheduler()
+
+
+async def apply_change(message: Dict[str, Any]) -> None:
+    """
+    Saves a change from the owner in the replica of a worker and sends the
+    autoupdate to its clients.
+    """
+    change_id = message["change_id"]
+    if change_id <= db.CHANGE_ID:
+        return
+    all_data = await db.get_all_data()
+    for collection, elements in message["changed"].items():
+        if collection not in all_data:
+            all_data[collection] = {}
+        all_data[collection].update(elements)
+    for collection, item_ids in message["deleted"].items():
+        for item_id in item_ids:
+            if collection in all_data and item_id in all_data[collection]:
+                del all_data[collection][item_id]
+    db.commit(all_data, change_id)
+    await inform_changed_elements(all_data, change_id)
+
+
+def run_worker(host: str, port: int, index: int) -> None:
+    """
+    Runs one worker process. Does not return.
+    """
+    from .websocket import register_gauges, start_server
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    loop = asyncio.get_event_loop()
+    # The owner has the log and writes the snapshots.
+    db.action_log.close()
+    db.HISTORY_SNAPSHOT_INTERVAL = 0
+    # Optimistic writes would commit in the replica.
+    actions.OPTIMISTIC_WRITES = False
+    actions.write_scheduler = remote_write_scheduler  # type: ignore
+
+    try:
+        reader = loop.run_until_complete(remote_write_scheduler.connect())
+        loop.run_until_complete(start_server(host, port, reuse_port=True))
+        if metrics.METRICS_ENABLED:
+            register_gauges()
+            loop.run_until_complete(
+                serve_metrics(host, metrics.METRICS_PORT + index + 1)
+            )
+        loop.run_until_complete(remote_write_scheduler.run(reader))
+    finally:
+        print(f"Worker {index} stopped")
+        os._exit(0)
+
+
+def serve_cluster(host: str, port: int, workers: int) -> None:
+    """
+    Starts the workers and runs the owner in this process.
+
+    Call it after init_db(). The workers get the database with fork().
+    """
+    pids: List[int] = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(host, port, index)
+        pids.append(pid)
+
+    def stop(*args: Any) -> None:
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    broker = Broker()
+    change_listeners.append(broker.publish)
+    if os.path.exists(BROKER_SOCKET):
+        os.remove(BROKER_SOCKET)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.start_unix_server(broker.handle, BROKER_SOCKET))
+    print(f"Started {workers} workers on {host}:{port}")
+    asyncio.ensure_future(db.load_lazy_collections())
+    asyncio.ensure_future(run_compactor())
+    if metrics.METRICS_ENABLED:
+        loop.run_until_complete(serve_metrics(host, metrics.METRICS_PORT))
+    try:
+        loop.run_forever()
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        os.remove(BROKER_SOCKET)
@@ -0,0 +1,173 @@
+"""
+Codecs for the messages on the websocket connection.
+
+The client selects the codec with the websocket subprotocol. Clients without
+a subprotocol use json.
+
+With COMPRESSION = "frame", there is a compressed variant of each codec, for
+example msgpack+zlib. Frames are compressed when they are encoded. Since
+broadcasts and full data frames are encoded once, they are also compressed
+once and the same buffer is sent to all clients.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Union
+
+import msgpack
+
+
+# How frames are compressed:
+# "connection": The websocket extension permessage-deflate. Each connection
+#     compresses each frame again.
+# "frame": Clients, that use a +zlib subprotocol, get frames that are
+#     compressed once. Other clients use permessage-deflate.
+# None: No compression.
+COMPRESSION: Optional[str] = "frame"
+
+# Frames smaller than this number of bytes are not compressed.
+COMPRESSION_THRESHOLD = 1024
+
+# zlib level from 1 (fast) to 9 (small).
+COMPRESSION_LEVEL = 6
+
+# First byte of a frame of a compressed codec.
+RAW_FRAME = b"\x00"
+ZLIB_FRAME = b"\x01"
+
+# An encoded message. Text frames for json, binary frames for msgpack and the
+# compressed codecs.
+Frame = Union[str, bytes]
+
+
+class Codec:
+    name: str
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        raise NotImplementedError
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """
+    Sends text frames. Int keys in dicts become strings.
+    """
+
+    name = "json"
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        return json.dumps(message)
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        return json.loads(frame)
+
+
+class MsgpackCodec(Codec):
+    """
+    Sends binary frames. Smaller and faster than json and keeps int keys.
+    """
+
+    name = "msgpack"
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        return msgpack.packb(message)
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        if isinstance(frame, str):
+            frame = frame.encode()
+        return msgpack.unpackb(frame, raw=False, strict_map_key=False)
+
+
+class CompressedCodec(Codec):
+    """
+    Wraps a codec and compresses frames, that are bigger than
+    COMPRESSION_THRESHOLD, with zlib.
+
+    Each frame starts with one byte, that tells if the rest is compressed.
+    """
+
+    # Counters for all compressed frames since the server started. Frames are
+    # also compressed in executor threads.
+    stats_lock = threading.Lock()
+    compressed_frames = 0
+    uncompressed_bytes = 0
+    compressed_bytes = 0
+    cpu_time = 0.0
+
+    def __init__(self, codec: Codec) -> None:
+        self.codec = codec
+        self.name = f"{codec.name}+zlib"
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        data = self.codec.encode(message)
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) < COMPRESSION_THRESHOLD:
+            return RAW_FRAME + data
+
+        start = time.thread_time()
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        cpu_time = time.thread_time() - start
+        with self.stats_lock:
+            CompressedCodec.compressed_frames += 1
+            CompressedCodec.uncompressed_bytes += len(data)
+            CompressedCodec.compressed_bytes += len(compressed)
+            CompressedCodec.cpu_time += cpu_time
+        return ZLIB_FRAME + compressed
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        if isinstance(frame, str):
+            return self.codec.decode(frame)
+        data = frame[1:]
+        if frame[:1] == ZLIB_FRAME:
+            data = zlib.decompress(data)
+        return self.codec.decode(data)
+
+
+def get_compression_stats() -> Dict[str, Any]:
+    """
+    Returns how many bytes the compression saved and how much cpu time it
+    needed.
+    """
+    with CompressedCodec.stats_lock:
+        return {
+            "compressed_frames": CompressedCodec.compressed_frames,
+            "uncompressed_bytes": CompressedCodec.uncompressed_bytes,
+            "compressed_bytes": CompressedCodec.compressed_bytes,
+            "saved_bytes": CompressedCodec.uncompressed_bytes
+            - CompressedCodec.compressed_bytes,
+            "cpu_time": CompressedCodec.cpu_time,
+        }
+
+
+def get_codecs() -> Dict[str, Codec]:
+    """
+    Returns all codecs by their subprotocol name. The first one is preferred,
+    if a client supports more than one.
+    """
+    plain_codecs: List[Codec] = [MsgpackCodec(), JSONCodec()]
+    all_codecs: List[Codec] = []
+    for codec in plain_codecs:
+        if COMPRESSION == "frame":
+            all_codecs.append(CompressedCodec(codec))
+        all_codecs.append(codec)
+    return {codec.name: codec for codec in all_codecs}
+
+
+codecs = get_codecs()
+
+DEFAULT_CODEC = "json"
+
+
+def get_codec(subprotocol: Optional[str]) -> Codec:
+    """
+    Returns the codec for the subprotocol, that was selected in the websocket
+    handshake.
+    """
+    return codecs.get(subprotocol or DEFAULT_CODEC, codecs[DEFAULT_CODEC])
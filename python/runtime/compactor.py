@@ -0,0 +1,99 @@
+"""
+Background compaction of the action log.
+
+This is the create-all-data-action from Konzept.md: When the log gets too big,
+a snapshot of the database replaces the old records. The snapshot is written
+to the history directory and used as new snapshot of the server. Then the
+records, that are in the snapshot, are removed from the start of the log.
+
+The database is copied in a thread, while writes wait. Writing the snapshot
+and the log runs in a thread, too, so writes are not stalled by it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import traceback
+from typing import Dict, Tuple
+
+from . import db
+from .all_data import CollectionType
+from .metrics import inc, timer
+from .utils import debug
+
+
+# The log is compacted, when it is bigger than this many bytes. 0 disables the
+# trigger.
+COMPACTION_LOG_SIZE = 64 * 1024 * 1024
+
+# The log is compacted, when it has more than this many actions. 0 disables
+# the trigger.
+COMPACTION_ACTIONS = 100_000
+
+# Seconds between two checks of the triggers.
+COMPACTION_CHECK_INTERVAL = 1.0
+
+
+def needs_compaction() -> bool:
+    log = db.action_log
+    if log.error is not None:
+        # The log accepts no writes. See ActionLog.fail().
+        return False
+    if COMPACTION_LOG_SIZE and log.size > COMPACTION_LOG_SIZE:
+        return True
+    return bool(COMPACTION_ACTIONS and log.action_count > COMPACTION_ACTIONS)
+
+
+async def compact() -> None:
+    """
+    Writes a snapshot of the current database and removes the records up to
+    its change_id from the log.
+    """
+    change_id, database = await db.get_database_copy()
+    debug(f"Compact the action log at change {change_id}")
+    with timer("openslides_compaction_seconds"):
+        removed_bytes, removed_actions = await asyncio.get_event_loop().run_in_executor(
+            None, write_and_truncate, change_id, database
+        )
+    db.action_log.size -= removed_bytes
+    db.action_log.action_count -= removed_actions
+    inc("openslides_compactions_total")
+    debug(f"Removed {removed_bytes} bytes from the action log")
+
+
+def write_and_truncate(
+    change_id: int, database: Dict[str, CollectionType]
+) -> Tuple[int, int]:
+    """
+    Writes the snapshot and truncates the log. Runs in a thread.
+
+    The snapshot is on disk before the log is changed. If the server stops
+    between the two steps, it replays only the records after the snapshot.
+    Then old history snapshots are removed. See db.HISTORY_KEEP_SNAPSHOTS.
+    """
+    db.write_history_snapshot(change_id, database)
+    tmp_file = f"{db.SNAPSHOT_FILE}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    os.link(db.get_history_snapshot_path(change_id), tmp_file)
+    os.replace(tmp_file, db.SNAPSHOT_FILE)
+    result = db.action_log.truncate(change_id)
+    db.prune_history_snapshots()
+    return result
+
+
+async def run_compactor() -> None:
+    """
+    Checks the triggers and compacts the log. Runs as long as the server.
+    Errors are printed and the log is compacted again at the next check.
+    """
+    while True:
+        await asyncio.sleep(COMPACTION_CHECK_INTERVAL)
+        try:
+            if needs_compaction():
+                await compact()
+        except Exception:
+            print("Compaction of the action log failed:", file=sys.stderr)
+            traceback.print_exc()
@@ -4,22 +4,348 @@ Creates a fake db and defines functions to read or write data.
 Initialtes the database when the server starts.
 
 Use get_all_data() and save_database() to handle the database.
+
+Every write is appended to the action log. When the server starts, it loads
+the latest snapshot and replays the actions from the log, that are newer than
+the snapshot.
 """
 
 
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Dict
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+import traceback
+import zlib
+from collections import deque
+from typing import IO, Any, Deque, Dict, Generator, List, Optional, Set, Tuple
 
 import msgpack
 
-from .all_data import AllData, CollectionType
+from .all_data import (
+    AllData,
+    Buffer,
+    CollectionType,
+    ElementID,
+    LazyCollection,
+    compact_database,
+)
+from .metrics import observe, timer
+from .references import reference_index
+from .utils import debug, startup_metrics
 
 
 DB_FILE = "all_data.msgpack"
+SNAPSHOT_FILE = "snapshot.msgpack"
+LOG_FILE = "actions.log"
+
+# Format of new snapshots:
+# "indexed": Each collection is encoded on its own. The file starts with an
+#     index of the collections. When the server starts, the file is memory
+#     mapped and a collection is decoded on first access or in the background.
+# "msgpack": The whole database as one msgpack dict.
+# Both formats can be read.
+SNAPSHOT_FORMAT = "indexed"
+
+# Seconds to wait before a log flush, so more writers can share one fsync. With
+# 0, all records that come in while an fsync is running are written together
+# with the next one.
+GROUP_COMMIT_DELAY = 0.0
+
+# Save the elements as CompactCollection instead of dicts. Needs less memory
+# but each read of an element creates a dict.
+COMPACT_STORAGE = False
+
+# Number of change sets that are kept in memory, so reconnecting clients only
+# get the elements that changed since their last change_id.
+HISTORY_SIZE = 1000
+
+# Every HISTORY_SNAPSHOT_INTERVAL changes, a copy of the database is written
+# to HISTORY_DIR. Historical reads replay the action log from the nearest of
+# these snapshots. See history.py.
+HISTORY_DIR = "history"
+HISTORY_SNAPSHOT_INTERVAL = 1000
+
+# Number of history snapshots, that are kept. Older snapshots are removed
+# after a new one is written. 0 keeps all, so no history is removed.
+HISTORY_KEEP_SNAPSHOTS = 0
+
+# History snapshots older than this many seconds are removed, too. The newest
+# snapshot is always kept. 0 disables it.
+HISTORY_MAX_AGE = 0.0
+
 DATABASE: Dict[str, CollectionType] = {}
+CHANGE_ID = 0
+CHANGE_HISTORY: Deque[Tuple[int, Set[ElementID]]] = deque(maxlen=HISTORY_SIZE)
+# The change_id of the last change of each element, that changed since the
+# server started.
+ELEMENT_VERSIONS: Dict[ElementID, int] = {}
 db_write_lock = asyncio.Lock()
+# Held while a history snapshot is written. See write_history_snapshot().
+history_lock = threading.Lock()
+
+LogRecord = Dict[str, Any]
+FRAME_HEADER = struct.Struct("!II")
+
+# Start of a snapshot in the indexed format and the length of its index.
+SNAPSHOT_MAGIC = b"OSSNAP1\n"
+SNAPSHOT_INDEX_HEADER = struct.Struct("!I")
+
+
+class ActionLogError(Exception):
+    """
+    Exception, if the action log could not be written. After it, the server
+    accepts no writes until it is started again.
+    """
+
+
+class ActionLog:
+    """
+    Append only log of all actions that were saved to the database.
+
+    Each record is a msgpack encoded dict with the keys `change_id` and
+    `actions`. It is prefixed with its length and crc32, so a record, that was
+    only partly written when the server crashed, can be detected.
+
+    Records are written with group commit: All records that are appended while
+    the log is written to disk share the next fsync.
+
+    `size` is the size of the log in bytes and `action_count` the number of
+    actions in the log. The compactor uses them. See compactor.py.
+
+    If a write fails, the log is cut off after the last record, that is on
+    disk, and no more records are accepted. See fail().
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file: Optional[IO[bytes]] = None
+        self.pending: List[bytes] = []
+        self.waiters: List[asyncio.Future] = []
+        self.flushing = False
+        self.size = 0
+        self.action_count = 0
+        # Size of the file up to the end of the last record, that is on disk.
+        self.synced_size = 0
+        # The error of a failed write.
+        self.error: Optional[Exception] = None
+        # The future of the last appended record.
+        self.last_record: Optional[asyncio.Future] = None
+        # Held while the file is written or replaced.
+        self.lock = threading.Lock()
+
+    def read(
+        self, after: int = 0, repair: bool = True
+    ) -> Generator[LogRecord, None, None]:
+        """
+        Generator that returns all records with a change_id greater than
+        `after`.
+
+        If the log ends with an incomplete record, it is cut off. Use
+        repair=False to read the log while the server writes to it.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        valid_size = 0
+        for record, valid_size in self.read_frames():
+            if record["change_id"] > after:
+                yield record
+
+        if repair and valid_size < os.path.getsize(self.path):
+            debug(f"Cut off broken end of the action log at byte {valid_size}")
+            os.truncate(self.path, valid_size)
+
+    def read_frames(self) -> Generator[Tuple[LogRecord, int], None, None]:
+        """
+        Generator that returns all complete records with the position of their
+        end in the file.
+        """
+        with open(self.path, "rb") as file:
+            while True:
+                header = file.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                size, checksum = FRAME_HEADER.unpack(header)
+                data = file.read(size)
+                if len(data) < size or zlib.crc32(data) != checksum:
+                    break
+                record = msgpack.unpackb(data, raw=False, strict_map_key=False)
+                yield record, file.tell()
+
+    def open(self) -> None:
+        self.file = open(self.path, "ab")
+        self.size = self.synced_size = self.file.tell()
+        self.error = None
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def check(self) -> None:
+        """
+        Raises ActionLogError, if a write failed before.
+        """
+        if self.error is not None:
+            raise ActionLogError(
+                "The action log could not be written. The server accepts no writes."
+            ) from self.error
+
+    def append(self, record: LogRecord) -> asyncio.Future:
+        """
+        Adds a record to the log.
+
+        Returns a future, that is done, when the record is written to disk.
+        The order of the records is the order of the calls.
+        """
+        self.check()
+        data = msgpack.packb(record)
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append(FRAME_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        self.size += FRAME_HEADER.size + len(data)
+        self.action_count += len(record["actions"])
+        self.waiters.append(future)
+        self.last_record = future
+        if not self.flushing:
+            self.flushing = True
+            asyncio.ensure_future(self.flush())
+        return future
+
+    def synced(self) -> asyncio.Future:
+        """
+        Returns a future, that is done, when all records, that were appended
+        until now, are on disk.
+        """
+        if self.last_record is None:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(None)
+            return future
+        return self.last_record
+
+    async def flush(self) -> None:
+        """
+        Writes all pending records to disk. Runs until there are no more
+        pending records.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while self.pending:
+                if GROUP_COMMIT_DELAY:
+                    await asyncio.sleep(GROUP_COMMIT_DELAY)
+                data = b"".join(self.pending)
+                waiters = self.waiters
+                self.pending, self.waiters = [], []
+                try:
+                    await loop.run_in_executor(None, self.write, data)
+                except Exception as err:
+                    self.fail(err, waiters)
+                    return
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self.flushing = False
+
+    def fail(self, err: Exception, waiters: List[asyncio.Future]) -> None:
+        """
+        Handles a failed write.
+
+        The failed records and all pending records are not written, so there
+        is no gap in the change_ids of the log. Their changes are already in
+        the database, so it is loaded again from the disk. See
+        restore_database().
+        """
+        print(f"The action log could not be written: {err!r}", file=sys.stderr)
+        self.error = err
+        waiters = waiters + self.waiters
+        self.pending, self.waiters = [], []
+        self.size = self.synced_size
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(err)
+        asyncio.ensure_future(restore_database())
+
+    def write(self, data: bytes) -> None:
+        """
+        Writes data to the log and waits until it is on the disk.
+
+        Runs in a thread.
+        """
+        with self.lock:
+            if self.file is None:
+                raise RuntimeError("The action log is not open.")
+            start = time.perf_counter()
+            try:
+                self.file.write(data)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception:
+                self.cut_off()
+                raise
+            self.synced_size += len(data)
+        observe("openslides_action_log_write_seconds", time.perf_counter() - start)
+
+    def cut_off(self) -> None:
+        """
+        Closes the file and removes the data after the last record, that is
+        on disk. A record, that was only partly written, can not be followed
+        by later records. Has to be called with the lock.
+        """
+        file, self.file = self.file, None
+        try:
+            if file is not None:
+                file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.path, self.synced_size)
+        except OSError as err:
+            # The broken end is removed, when the server starts again.
+            print(f"The action log could not be cut off: {err!r}", file=sys.stderr)
+
+    def truncate(self, change_id: int) -> Tuple[int, int]:
+        """
+        Removes all records up to the change_id from the start of the log.
+        They have to be in a snapshot. Returns the number of removed bytes and
+        actions.
+
+        The rest of the log is copied to a new file, that replaces the log
+        atomically. Only the copy of the rest blocks writes. Runs in a thread.
+        """
+        offset = actions = 0
+        frames = self.read_frames()
+        for record, end in frames:
+            if record["change_id"] > change_id:
+                break
+            offset = end
+            actions += len(record["actions"])
+        frames.close()
+        if not offset:
+            return 0, 0
+
+        tmp_file = f"{self.path}.tmp"
+        with self.lock:
+            with open(self.path, "rb") as source, open(tmp_file, "wb") as target:
+                source.seek(offset)
+                shutil.copyfileobj(source, target)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(tmp_file, self.path)
+            self.synced_size -= offset
+            if self.file is not None:
+                self.file.close()
+                self.file = open(self.path, "ab")
+        return offset, actions
+
+
+action_log = ActionLog(LOG_FILE)
 
 
 def init_db() -> None:
@@ -27,39 +353,443 @@ def init_db() -> None:
     Loads the database from file and save it into memory.
 
     Use msgpack instead of json, because msgpack supports int-keys in dics.
+
+    Loads the snapshot, if there is one, and replays the newer actions from
+    the action log.
+    """
+    start = time.monotonic()
+    records = load_database()
+    startup_metrics["load_snapshot"] = time.monotonic() - start
+    if records:
+        debug(f"Replay {len(records)} records from the action log")
+
+        async def replay() -> None:
+            async with db_write_lock:
+                await replay_actions(records)
+
+        asyncio.get_event_loop().run_until_complete(replay())
+    if records or not os.path.exists(SNAPSHOT_FILE):
+        write_snapshot()
+
+    action_log.open()
+    startup_metrics["init_db"] = time.monotonic() - start
+
+
+def load_database() -> List[LogRecord]:
     """
+    Loads the latest snapshot into memory. Returns the records of the action
+    log, that are newer than the snapshot and have to be replayed.
+    """
+    global CHANGE_ID, CHANGE_HISTORY
     DATABASE.clear()
+    # Created here, so a changed HISTORY_SIZE is used.
+    CHANGE_HISTORY = deque(maxlen=HISTORY_SIZE)
+    ELEMENT_VERSIONS.clear()
+    CHANGE_ID, database = load_snapshot()
+    DATABASE.update(database)
+    if COMPACT_STORAGE:
+        compact_database(DATABASE, list(DATABASE))
+    reference_index.build(DATABASE)
+
+    log_records = list(action_log.read())
+    action_log.action_count = sum(len(record["actions"]) for record in log_records)
+    return [record for record in log_records if record["change_id"] > CHANGE_ID]
+
+
+async def restore_database() -> None:
+    """
+    Loads the database again from the disk, after a write to the action log
+    failed. So the changes, that are not on disk, are removed from memory.
+
+    The clients are disconnected, because they could have got these changes
+    with all data. They get all data again, when they reconnect.
+    """
+    from .websocket import Client
+
+    async with db_write_lock:
+        await replay_actions(load_database())
+    print(f"Restored the database at change {CHANGE_ID}", file=sys.stderr)
+    for client in list(Client.all_clients):
+        asyncio.ensure_future(client.websocket.close(1011))
+
+
+async def load_lazy_collections() -> None:
+    """
+    Decodes all collections, that were not used yet, one after the other.
+
+    Runs in the background, after the server accepts connections.
+    """
+    start = time.monotonic()
+    for name in list(DATABASE):
+        collection = DATABASE.get(name)
+        if isinstance(collection, LazyCollection):
+            DATABASE[name] = collection.load()
+            await asyncio.sleep(0)
+    startup_metrics["load_lazy_collections"] = time.monotonic() - start
+
+
+async def replay_actions(records: List[LogRecord]) -> None:
+    """
+    Executes the actions of log records again and saves the result in the
+    database, without writing them to the log again. Has to be called inside
+    the db_write_lock.
+
+    The actions are not validated again. They were valid, when they were
+    written to the log.
+    """
+    from .actions import Action, all_data_var
+
+    for record in records:
+        all_data = await get_all_data()
+        all_data_var.set(all_data)
+        for action_data in record["actions"]:
+            action = Action.get_action(action_data["action"])
+            await action.execute(action_data["payload"])
+        commit(all_data, record["change_id"])
+
+
+def load_snapshot() -> Tuple[int, Dict[str, CollectionType]]:
+    """
+    Returns the change_id and the data of the latest snapshot.
+
+    Uses the initial database file, if there is no snapshot.
+    """
+    if os.path.exists(SNAPSHOT_FILE):
+        return load_snapshot_file(SNAPSHOT_FILE)
+    return load_initial_data()
+
+
+def load_snapshot_file(path: str) -> Tuple[int, Dict[str, CollectionType]]:
+    """
+    Returns the change_id and the data of a snapshot in any format.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+            return load_indexed_snapshot(file)
+        file.seek(0)
+        snapshot = msgpack.unpack(file, raw=False, strict_map_key=False)
+    return snapshot["change_id"], snapshot["all_data"]
+
+
+def load_initial_data() -> Tuple[int, Dict[str, CollectionType]]:
+    """
+    Returns the data from the initial database file with the change_id 0.
+    """
     with open(DB_FILE, "rb") as file:
-        database: Dict[str, Dict[int, Dict[str, Any]]] = {}
-        for collection, data in msgpack.unpack(file, raw=False).items():
+        database: Dict[str, CollectionType] = {}
+        for collection, data in msgpack.unpack(
+            file, raw=False, strict_map_key=False
+        ).items():
             database[collection] = {}
             for item_id, element in data.items():
                 database[collection][item_id] = element
+    return 0, database
+
+
+def load_indexed_snapshot(file: IO[bytes]) -> Tuple[int, Dict[str, CollectionType]]:
+    """
+    Returns the change_id and the collections of a snapshot in the indexed
+    format. The collections are LazyCollections on a memory map of the file.
+    """
+    (index_size,) = SNAPSHOT_INDEX_HEADER.unpack(
+        file.read(SNAPSHOT_INDEX_HEADER.size)
+    )
+    index = msgpack.unpackb(file.read(index_size), raw=False)
+    start = file.tell()
+    data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    database: Dict[str, CollectionType] = {}
+    for name, (offset, size) in index["collections"].items():
+        raw = data[start + offset:start + offset + size]
+        database[name] = LazyCollection(raw, decode_collection)
+    return index["change_id"], database
+
+
+def decode_collection(raw: Buffer) -> CollectionType:
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+def write_snapshot() -> None:
+    """
+    Writes the current database with its change_id as snapshot.
+    """
+    write_snapshot_file(SNAPSHOT_FILE, CHANGE_ID, DATABASE)
+
+
+def write_snapshot_file(
+    path: str, change_id: int, database: Dict[str, CollectionType]
+) -> None:
+    """
+    Writes a database with its change_id as snapshot to path.
+
+    The file is replaced atomically.
+    """
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, "wb") as file:
+        if SNAPSHOT_FORMAT == "indexed":
+            write_indexed_snapshot(file, change_id, database)
+        else:
+            msgpack.pack(
+                {"change_id": change_id, "all_data": database}, file, default=dict
+            )
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, path)
+
+
+def write_indexed_snapshot(
+    file: IO[bytes], change_id: int, database: Dict[str, CollectionType]
+) -> None:
+    """
+    Writes a database in the indexed format.
+
+    Collections, that were not decoded yet, are copied without decoding.
+    """
+    collections: Dict[str, List[int]] = {}
+    blobs: List[Buffer] = []
+    offset = 0
+    for name, collection in database.items():
+        if isinstance(collection, LazyCollection) and collection.raw is not None:
+            blob = collection.raw
+        else:
+            blob = msgpack.packb(collection, default=dict)
+        collections[name] = [offset, len(blob)]
+        blobs.append(blob)
+        offset += len(blob)
+
+    index = msgpack.packb({"change_id": change_id, "collections": collections})
+    file.write(SNAPSHOT_MAGIC)
+    file.write(SNAPSHOT_INDEX_HEADER.pack(len(index)))
+    file.write(index)
+    for blob in blobs:
+        file.write(blob)
+
+
+def copy_database(database: Dict[str, CollectionType]) -> Dict[str, CollectionType]:
+    """
+    Returns a copy of the database, that does not change with the next
+    commit.
+
+    The elements are not copied, because committed elements are never changed
+    in place.
+    """
+    database_copy: Dict[str, CollectionType] = {}
+    for name, collection in database.items():
+        if isinstance(collection, LazyCollection) and collection.raw is not None:
+            database_copy[name] = LazyCollection(collection.raw, decode_collection)
+        else:
+            database_copy[name] = dict(collection)
+    return database_copy
+
+
+async def get_database_copy() -> Tuple[int, Dict[str, CollectionType]]:
+    """
+    Returns the change_id and a copy of the database, when the change is on
+    disk. Raises an exception, if it could not be written.
+
+    The database is copied in a thread. db_write_lock is held meanwhile, so
+    there is no commit during the copy, but the event loop is not blocked.
+    """
+    async with db_write_lock:
+        action_log.check()
+        change_id = CHANGE_ID
+        written = action_log.synced()
+        database = await asyncio.get_event_loop().run_in_executor(
+            None, copy_database, DATABASE
+        )
+    await written
+    return change_id, database
+
+
+def get_history_snapshot_path(change_id: int) -> str:
+    return os.path.join(HISTORY_DIR, f"{change_id}.msgpack")
+
+
+def get_history_snapshots() -> List[int]:
+    """
+    Returns the change_ids of all history snapshots.
+    """
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    change_ids: List[int] = []
+    for file_name in os.listdir(HISTORY_DIR):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".msgpack" and name.isdigit():
+            change_ids.append(int(name))
+    return sorted(change_ids)
+
 
-        DATABASE.update(database)
+def write_history_snapshot(
+    change_id: int, database: Dict[str, CollectionType]
+) -> None:
+    """
+    Writes a copy of the database to the history directory.
+
+    Runs in a thread.
+    """
+    path = get_history_snapshot_path(change_id)
+    with history_lock:
+        if os.path.exists(path):
+            return
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        write_snapshot_file(path, change_id, database)
+    debug(f"Wrote history snapshot {path}")
+
+
+def prune_history_snapshots() -> List[int]:
+    """
+    Removes the history snapshots, that are not kept by HISTORY_KEEP_SNAPSHOTS
+    and HISTORY_MAX_AGE. Returns their change_ids.
+
+    Runs in a thread.
+    """
+    with history_lock:
+        snapshots = get_history_snapshots()
+        keep = set(snapshots)
+        if HISTORY_KEEP_SNAPSHOTS:
+            keep = set(snapshots[-HISTORY_KEEP_SNAPSHOTS:])
+        if HISTORY_MAX_AGE:
+            min_time = time.time() - HISTORY_MAX_AGE
+            keep = {
+                change_id
+                for change_id in keep
+                if os.path.getmtime(get_history_snapshot_path(change_id)) >= min_time
+            }
+        if snapshots:
+            keep.add(snapshots[-1])
+        removed = [change_id for change_id in snapshots if change_id not in keep]
+        for change_id in removed:
+            os.remove(get_history_snapshot_path(change_id))
+    if removed:
+        debug(f"Removed {len(removed)} history snapshots")
+    return removed
+
+
+def save_history_snapshot(
+    change_id: int, database: Dict[str, CollectionType]
+) -> None:
+    """
+    Writes a history snapshot and removes the old ones. Runs in a thread.
+    """
+    write_history_snapshot(change_id, database)
+    prune_history_snapshots()
+
+
+async def take_history_snapshot() -> None:
+    """
+    Writes a history snapshot of the database in the background. See commit().
+    """
+    try:
+        change_id, database = await get_database_copy()
+        await asyncio.get_event_loop().run_in_executor(
+            None, save_history_snapshot, change_id, database
+        )
+    except Exception:
+        print("Writing a history snapshot failed:", file=sys.stderr)
+        traceback.print_exc()
+
+
+def get_change_id() -> int:
+    """
+    Returns the change_id of the last write.
+    """
+    return CHANGE_ID
+
+
+def get_element_version(element_id: ElementID) -> int:
+    """
+    Returns a number, that changes each time the element or its
+    referenced_data changes.
+    """
+    return ELEMENT_VERSIONS.get(element_id, 0)
+
+
+def get_changed_elements_since(change_id: int) -> Optional[Set[ElementID]]:
+    """
+    Returns the ids of all elements that were changed or deleted after the
+    given change_id.
+
+    Returns None, if the change history does not go back that far.
+    """
+    if change_id > CHANGE_ID:
+        return None
+    if change_id < CHANGE_ID and (
+        not CHANGE_HISTORY or CHANGE_HISTORY[0][0] > change_id + 1
+    ):
+        return None
+
+    element_ids: Set[ElementID] = set()
+    for history_change_id, changed in reversed(CHANGE_HISTORY):
+        if history_change_id <= change_id:
+            break
+        element_ids.update(changed)
+    return element_ids
+
+
+def get_changed_elements_at(change_id: int) -> Optional[Set[ElementID]]:
+    """
+    Returns the ids of the elements that were changed or deleted with the
+    given change_id.
+
+    Returns None, if the change is not in the change history.
+    """
+    for history_change_id, changed in reversed(CHANGE_HISTORY):
+        if history_change_id == change_id:
+            return changed
+        if history_change_id < change_id:
+            break
+    return None
 
 
 async def get_all_data() -> AllData:
     """
     Returns an all_data dict for the current database.
+
+    The all_data dict does not copy the database. Changes are written into an
+    overlay until save_database() is called.
     """
-    return AllData(await get_database())
+    return AllData(DATABASE)
 
 
-async def get_database() -> Dict[str, CollectionType]:
-    return dict_copy(DATABASE)
+async def save_database(all_data: AllData, actions: List[Any]) -> asyncio.Future:
+    """
+    Saves the changed elements of an AllData dict into the database and
+    appends the actions to the action log.
 
+    Has to be called inside the db_write_lock. Returns a future, that is done
+    when the actions are written to disk. Await it after the lock is released,
+    so many writes can share one fsync.
 
-async def save_database(all_data: AllData) -> None:
-    """
-    Saves an ALLData dict as new database.
+    Raises ActionLogError without changing the database, if a write to the
+    action log failed before.
     """
-    DATABASE.clear()
-    DATABASE.update(all_data.as_dict())
+    action_log.check()
+    with timer("openslides_save_database_seconds"):
+        commit(all_data, CHANGE_ID + 1)
+        return action_log.append({"change_id": CHANGE_ID, "actions": actions})
 
 
-def dict_copy(input_dict: dict) -> dict:
+def commit(all_data: AllData, change_id: int) -> None:
     """
-    Creates a copy of a dict.
+    Writes the changes of all_data into the database and adds them to the
+    change history.
+
+    The elements, in which a changed element is embedded, are added to the
+    change history, too. See ReferenceIndex.update().
     """
-    return msgpack.unpackb(msgpack.packb(input_dict), raw=False)
+    global CHANGE_ID
+    all_data.commit()
+    if COMPACT_STORAGE:
+        # Collections, that were created by the commit.
+        compact_database(DATABASE, all_data)
+    CHANGE_ID = change_id
+    changed = set(all_data.get_changed_elements())
+    changed.update(all_data.get_deleted_elements())
+    changed.update(reference_index.update(DATABASE, changed))
+    CHANGE_HISTORY.append((change_id, changed))
+    for element_id in changed:
+        ELEMENT_VERSIONS[element_id] = change_id
+
+    if HISTORY_SNAPSHOT_INTERVAL and change_id % HISTORY_SNAPSHOT_INTERVAL == 0:
+        # The snapshot is taken, when the next writer releases the lock.
+        asyncio.ensure_future(take_history_snapshot())
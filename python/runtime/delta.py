@@ -0,0 +1,119 @@
+"""
+Field patches for autoupdates.
+
+Clients, that connect with ?delta=1, get changed elements as patches against
+the version, they already have:
+
+    "patched": {
+        "users/user": [{"id": 5, "set": {"is_present": true}, "removed": []}]
+    }
+
+A patch is only sent, if it is much smaller than the element. Else the whole
+element is in "changed" as before.
+
+The version a client has, is the version of the last autoupdate. So the
+server keeps the last sent version of each changed element in
+previous_elements.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import msgpack
+
+from .all_data import Element, ElementID
+from .restrict import Permissions, restrict_hooks
+
+
+# Maximal number of elements, that are kept as base for patches.
+DELTA_CACHE_SIZE = 100_000
+
+# A patch is sent, if its size is at most this part of the size of the
+# element.
+DELTA_MAX_RATIO = 0.5
+
+# Previous versions of the elements of one autoupdate.
+PreviousType = Dict[str, Dict[int, Element]]
+
+
+class PreviousElements:
+    """
+    The last sent version of changed elements, with their referenced_data.
+    Elements, that are not in the cache, are sent as whole.
+    """
+
+    def __init__(self) -> None:
+        self.elements: OrderedDict[ElementID, Element] = OrderedDict()
+
+    def replace(self, element_id: ElementID, element: Element) -> Optional[Element]:
+        """
+        Saves the new version of an element and returns the previous one.
+        """
+        previous = self.elements.pop(element_id, None)
+        self.elements[element_id] = element
+        if len(self.elements) > DELTA_CACHE_SIZE:
+            self.elements.popitem(last=False)
+        return previous
+
+    def discard(self, element_ids: Iterable[ElementID]) -> None:
+        """
+        Removes elements. Use it for changes, that are not sent.
+        """
+        for element_id in element_ids:
+            self.elements.pop(element_id, None)
+
+
+previous_elements = PreviousElements()
+
+
+def get_patch(previous: Element, element: Element) -> Optional[Dict[str, Any]]:
+    """
+    Returns the patch from the previous version to the element or None, if
+    the patch is not small enough.
+    """
+    changed = {
+        key: value
+        for key, value in element.items()
+        if key not in previous or previous[key] != value
+    }
+    removed = [key for key in previous if key not in element]
+    patch = {"id": element["id"], "set": changed, "removed": removed}
+    if len(changed) + len(removed) >= len(element):
+        return None
+    patch_size = len(msgpack.packb(patch, default=dict))
+    if patch_size > DELTA_MAX_RATIO * len(msgpack.packb(element, default=dict)):
+        return None
+    return patch
+
+
+def get_delta_autoupdate(
+    autoupdate: Dict[str, Any], previous: PreviousType, permissions: Permissions
+) -> Dict[str, Any]:
+    """
+    Returns a restricted autoupdate, with patches instead of the elements,
+    where this is smaller.
+
+    The previous versions are not restricted. They are restricted here with
+    the same permissions.
+    """
+    changed: Dict[str, List[Element]] = {}
+    patched: Dict[str, List[Dict[str, Any]]] = {}
+    for collection, elements in autoupdate["changed"].items():
+        restrict = restrict_hooks.get(collection)
+        for element in elements:
+            old_element = previous.get(collection, {}).get(element["id"])
+            if old_element is not None and restrict is not None:
+                old_element = restrict(old_element, permissions)
+            patch = None if old_element is None else get_patch(old_element, element)
+            if patch is None:
+                changed.setdefault(collection, []).append(element)
+            else:
+                patched.setdefault(collection, []).append(patch)
+
+    delta_autoupdate = dict(autoupdate)
+    delta_autoupdate["changed"] = changed
+    if patched:
+        delta_autoupdate["patched"] = patched
+    return delta_autoupdate
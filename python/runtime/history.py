@@ -0,0 +1,198 @@
+"""
+Historical reads: the data of the database, as it was after a past change.
+
+A version is built from the nearest base before the change, which is a cached
+version, a history snapshot (see db.HISTORY_SNAPSHOT_INTERVAL) or the initial
+database file. The actions from the action log since the base are executed
+again on a copy of the base.
+
+This runs in a thread. The live database is not read, copied or locked.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import db
+from .all_data import AllData, CollectionType, Element, Indexes
+from .references import ReferenceIndex
+from .restrict import Permissions, restrict_hooks
+from .utils import debug
+
+
+# Number of built versions, that are kept in memory.
+HISTORY_CACHE_SIZE = 10
+
+
+class HistoryNotAvailable(Exception):
+    """
+    Exception, if a version can not be built, because the action log does not
+    go back that far.
+    """
+
+
+class Version:
+    """
+    The database after one change.
+
+    Do not change `database`. Versions are cached and used as base of newer
+    versions.
+    """
+
+    def __init__(self, change_id: int, database: Dict[str, CollectionType]) -> None:
+        self.change_id = change_id
+        self.database = database
+        self.references = ReferenceIndex()
+        self.references.build(database)
+
+    def get_elements(
+        self, collection: str, item_id: Optional[int], permissions: Permissions
+    ) -> List[Element]:
+        """
+        Returns the elements of a collection, or only one element, with their
+        referenced_data as a client with the permissions sees them.
+        """
+        elements = self.database.get(collection, {})
+        if item_id is None:
+            item_ids = list(elements)
+        else:
+            item_ids = [item_id] if item_id in elements else []
+
+        restrict = restrict_hooks.get(collection)
+        result: List[Element] = []
+        for element_id in item_ids:
+            element: Optional[Element] = self.references.render(
+                self.database, collection, elements[element_id]
+            )
+            if restrict is not None and element is not None:
+                element = restrict(element, permissions)
+            if element is not None:
+                result.append(element)
+        return result
+
+
+class History:
+    """
+    Builds versions of the database and keeps the last used versions in an
+    LRU cache.
+    """
+
+    def __init__(self) -> None:
+        self.versions: OrderedDict[int, Version] = OrderedDict()
+        # The cache is read from the threads, that build versions.
+        self.lock = threading.Lock()
+        self.building: Dict[int, asyncio.Future] = {}
+
+    async def get_version(self, change_id: int) -> Version:
+        """
+        Returns the database after the given change.
+
+        Raises HistoryNotAvailable, if the version can not be built.
+        """
+        with self.lock:
+            version = self.versions.get(change_id)
+            if version is not None:
+                self.versions.move_to_end(change_id)
+                return version
+
+        # Requests for the same version wait for the same build.
+        future = self.building.get(change_id)
+        if future is None:
+            future = asyncio.get_event_loop().run_in_executor(
+                None, self.build_version, change_id
+            )
+            self.building[change_id] = future
+            future.add_done_callback(lambda _: self.building.pop(change_id, None))
+        return await asyncio.shield(future)
+
+    def build_version(self, change_id: int) -> Version:
+        """
+        Builds a version from the nearest base and the action log.
+
+        Runs in a thread.
+        """
+        base_change_id, base = self.get_base(change_id)
+        records = [
+            record
+            for record in db.action_log.read(after=base_change_id, repair=False)
+            if record["change_id"] <= change_id
+        ]
+        expected = list(range(base_change_id + 1, change_id + 1))
+        if [record["change_id"] for record in records] != expected:
+            snapshots = db.get_history_snapshots()
+            if snapshots and change_id < snapshots[0]:
+                raise HistoryNotAvailable(
+                    f"The history before the change_id {snapshots[0]} was removed."
+                )
+            raise HistoryNotAvailable(
+                f"There is no history for the change_id {change_id}."
+            )
+
+        debug(f"Build version {change_id} from the base {base_change_id}")
+        database: Dict[str, CollectionType] = {
+            name: dict(collection) for name, collection in base.items()
+        }
+        asyncio.run(replay(database, records))
+        version = Version(change_id, database)
+        with self.lock:
+            self.versions[change_id] = version
+            self.versions.move_to_end(change_id)
+            if len(self.versions) > HISTORY_CACHE_SIZE:
+                self.versions.popitem(last=False)
+        return version
+
+    def get_base(self, change_id: int) -> Tuple[int, Dict[str, CollectionType]]:
+        """
+        Returns the newest cached version or history snapshot, that is not
+        newer than the change_id. Uses the initial database file, if there is
+        none.
+        """
+        with self.lock:
+            cached = [
+                version for version in self.versions.values()
+                if version.change_id <= change_id
+            ]
+        best = max(cached, key=lambda version: version.change_id, default=None)
+        snapshots = [
+            snapshot for snapshot in db.get_history_snapshots() if snapshot <= change_id
+        ]
+        if snapshots and (best is None or snapshots[-1] > best.change_id):
+            try:
+                return db.load_snapshot_file(
+                    db.get_history_snapshot_path(snapshots[-1])
+                )
+            except FileNotFoundError:
+                # The snapshot was removed in the meantime.
+                raise HistoryNotAvailable(
+                    f"There is no history for the change_id {change_id}."
+                )
+        if best is not None:
+            return best.change_id, best.database
+        return db.load_initial_data()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.versions.clear()
+
+
+async def replay(database: Dict[str, CollectionType], records: List[Any]) -> None:
+    """
+    Executes the actions of log records on a database, that is not the live
+    database. Like db.replay_actions() but without db.commit().
+    """
+    from .actions import Action, all_data_var
+
+    indexes: Dict[str, Indexes] = {}
+    for record in records:
+        all_data = AllData(database, indexes)
+        all_data_var.set(all_data)
+        for action_data in record["actions"]:
+            action = Action.get_action(action_data["action"])
+            await action.execute(action_data["payload"])
+        all_data.commit()
+
+
+history = History()
@@ -0,0 +1,203 @@
+"""
+Counters and timers for the hot paths of the server.
+
+The metrics are served in the Prometheus text format on
+http://host:METRICS_PORT/metrics. With METRICS_ENABLED = False, nothing is
+recorded and the functions return at once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .utils import debug
+
+
+METRICS_ENABLED = False
+
+METRICS_PORT = 8001
+
+# Upper bounds of the histogram buckets in seconds.
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+
+Labels = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, Labels]
+
+# Values are changed from the event loop and from executor threads.
+lock = threading.Lock()
+counters: Dict[MetricKey, float] = defaultdict(float)
+
+# Bucket counts followed by sum and count.
+histograms: Dict[MetricKey, List[float]] = {}
+
+# Functions, that return the current value of a gauge.
+gauges: Dict[str, Callable[[], float]] = {}
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """
+    Adds the value to a counter.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] += value
+
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    """
+    Adds a duration to a histogram.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0.0] * (len(BUCKETS) + 2)
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+class Timer:
+    """
+    Context manager, that adds the duration of its block to a histogram.
+    """
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, str]) -> None:
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> Timer:
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        observe(self.name, perf_counter() - self.start, **self.labels)
+
+
+class NullTimer:
+    """
+    Timer, that does nothing. Used when the metrics are disabled.
+    """
+
+    def __enter__(self) -> NullTimer:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+null_timer = NullTimer()
+
+
+def timer(name: str, **labels: str) -> Any:
+    """
+    Returns a context manager, that measures the duration of its block.
+
+        with timer("openslides_save_database_seconds"):
+            ...
+    """
+    if not METRICS_ENABLED:
+        return null_timer
+    return Timer(name, labels)
+
+
+def register_gauge(name: str, func: Callable[[], float]) -> None:
+    """
+    Declares a gauge. The function is called, when the metrics are read.
+    """
+    gauges[name] = func
+
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    if extra is not None:
+        labels = labels + (extra,)
+    if not labels:
+        return ""
+    values = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{{{values}}}"
+
+
+def render() -> str:
+    """
+    Returns all metrics in the Prometheus text format.
+    """
+    lines: List[str] = []
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, list(value)) for key, value in histograms.items())
+
+    last_name = None
+    for (name, labels), value in counter_items:
+        if name != last_name:
+            lines.append(f"# TYPE {name} counter")
+            last_name = name
+        lines.append(f"{name}{format_labels(labels)} {value}")
+
+    for (name, labels), histogram in histogram_items:
+        if name != last_name:
+            lines.append(f"# TYPE {name} histogram")
+            last_name = name
+        cumulative = 0.0
+        for bound, count in zip(BUCKETS, histogram):
+            cumulative += count
+            lines.append(
+                f"{name}_bucket{format_labels(labels, ('le', str(bound)))} {cumulative}"
+            )
+        lines.append(
+            f"{name}_bucket{format_labels(labels, ('le', '+Inf'))} {histogram[-1]}"
+        )
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram[-2]}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram[-1]}")
+
+    for name, func in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {func()}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Minimal HTTP handler. Every GET request gets the metrics.
+    """
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            # Skip the headers.
+            pass
+        if request_line.startswith(b"GET /metrics"):
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError as err:
+        debug(f"Metrics request failed: {err}")
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host: str, port: int) -> None:
+    await asyncio.start_server(handle_request, host, port)
+    print(f"Serve metrics on http://{host}:{port}/metrics")
@@ -0,0 +1,201 @@
+"""
+Elements, that reference other elements, get the referenced_data of these
+elements embedded, when they are sent to the clients.
+
+Apps declare the references with hooks:
+
+    register_related_elements("users/user", user_related_elements)
+    register_referenced_data("users/group", group_referenced_data)
+
+The ReferenceIndex knows for each element, in which elements it is embedded.
+So when an element changes, only these elements have to be sent again.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Set
+
+from .all_data import CollectionType, Element, ElementID
+
+
+RelatedElementsHook = Callable[[Element], Iterable[ElementID]]
+ReferencedDataHook = Callable[[Element], Any]
+
+# Functions, that return the ids of all elements, an element references.
+related_elements_hooks: Dict[str, RelatedElementsHook] = {}
+
+# Functions, that render an element, when it is embedded in other elements.
+referenced_data_hooks: Dict[str, ReferencedDataHook] = {}
+
+# Key of the embedded elements in a rendered element.
+REFERENCED_KEY = "referenced"
+
+
+def register_related_elements(collection: str, hook: RelatedElementsHook) -> None:
+    """
+    Declares, which elements an element of the collection references.
+
+    The hook gets an element and returns the ids of the referenced elements,
+    for example [("users/group", 1)].
+    """
+    related_elements_hooks[collection] = hook
+
+
+def register_referenced_data(collection: str, hook: ReferencedDataHook) -> None:
+    """
+    Declares, how an element of the collection is rendered, when it is
+    embedded in other elements.
+
+    Without a hook, the whole element is embedded.
+    """
+    referenced_data_hooks[collection] = hook
+
+
+def get_element_key(element_id: ElementID) -> str:
+    """
+    Returns a string like users/user:5 for an element id.
+    """
+    return f"{element_id[0]}:{element_id[1]}"
+
+
+class ReferenceIndex:
+    """
+    Index of the references between elements.
+
+    `related` has the referenced elements of each element and `dependents`
+    the reverse: the elements in which an element is embedded. `rendered` has
+    the last referenced_data of each embedded element.
+
+    The index is updated with each commit.
+    """
+
+    def __init__(self) -> None:
+        self.related: Dict[ElementID, Set[ElementID]] = {}
+        self.dependents: Dict[ElementID, Set[ElementID]] = defaultdict(set)
+        self.rendered: Dict[ElementID, Any] = {}
+
+    def build(self, database: Mapping[str, CollectionType]) -> None:
+        """
+        Creates the index for all elements in the database.
+        """
+        self.related.clear()
+        self.dependents.clear()
+        self.rendered.clear()
+        for collection in related_elements_hooks:
+            for item_id, element in database.get(collection, {}).items():
+                self.set_related(database, (collection, item_id), element)
+
+    def update(
+        self, database: Mapping[str, CollectionType], element_ids: Set[ElementID]
+    ) -> Set[ElementID]:
+        """
+        Updates the index for changed or deleted elements.
+
+        Returns the ids of the elements, that embed one of these elements and
+        have to be sent again. An element is only returned, if the
+        referenced_data of the changed element is different than before.
+        """
+        dependents: Set[ElementID] = set()
+        for element_id in element_ids:
+            element = database.get(element_id[0], {}).get(element_id[1])
+            if element_id[0] in related_elements_hooks:
+                self.set_related(database, element_id, element)
+
+            if element_id not in self.dependents:
+                self.rendered.pop(element_id, None)
+                continue
+            if element is None:
+                self.rendered.pop(element_id, None)
+                dependents.update(self.dependents[element_id])
+                continue
+            rendered = render_referenced_data(element_id[0], element)
+            if self.rendered.get(element_id) != rendered:
+                self.rendered[element_id] = rendered
+                dependents.update(self.dependents[element_id])
+
+        # Elements, that were deleted, are not sent again.
+        return {
+            element_id
+            for element_id in dependents - element_ids
+            if element_id[1] in database.get(element_id[0], {})
+        }
+
+    def set_related(
+        self,
+        database: Mapping[str, CollectionType],
+        element_id: ElementID,
+        element: Optional[Element],
+    ) -> None:
+        """
+        Saves the referenced elements of one element.
+
+        The referenced_data of an element is rendered, when it is referenced
+        the first time, so later changes can be compared with it.
+        """
+        old_related = self.related.pop(element_id, set())
+        new_related = (
+            set(related_elements_hooks[element_id[0]](element))
+            if element is not None
+            else set()
+        )
+        if new_related:
+            self.related[element_id] = new_related
+
+        for related_id in old_related - new_related:
+            self.dependents[related_id].discard(element_id)
+            if not self.dependents[related_id]:
+                del self.dependents[related_id]
+                self.rendered.pop(related_id, None)
+        for related_id in new_related - old_related:
+            if related_id not in self.dependents:
+                self.get_referenced_data(database, related_id)
+            self.dependents[related_id].add(element_id)
+
+    def get_referenced_data(
+        self, database: Mapping[str, CollectionType], element_id: ElementID
+    ) -> Any:
+        """
+        Returns the referenced_data of an element or None, if the element does
+        not exist.
+        """
+        if element_id in self.rendered:
+            return self.rendered[element_id]
+        element = database.get(element_id[0], {}).get(element_id[1])
+        if element is None:
+            return None
+        rendered = render_referenced_data(element_id[0], element)
+        self.rendered[element_id] = rendered
+        return rendered
+
+    def render(
+        self, database: Mapping[str, CollectionType], collection: str, element: Element
+    ) -> Element:
+        """
+        Returns the element with the referenced_data of its referenced
+        elements.
+
+        Elements without references are returned unchanged and not copied.
+        """
+        if collection not in related_elements_hooks:
+            return element
+        related = self.related.get((collection, element["id"]), set())
+        rendered = dict(element)
+        rendered[REFERENCED_KEY] = {
+            get_element_key(element_id): self.get_referenced_data(database, element_id)
+            for element_id in related
+        }
+        return rendered
+
+
+def render_referenced_data(collection: str, element: Element) -> Any:
+    """
+    Renders an element, so it can be embedded in other elements.
+    """
+    hook = referenced_data_hooks.get(collection)
+    if hook is None:
+        return element
+    return hook(element)
+
+
+reference_index = ReferenceIndex()
@@ -0,0 +1,145 @@
+"""
+Clients get the data as restricted_data, depending on their permissions.
+
+Apps declare with register_restrict(), how the elements of a collection are
+restricted, and with register_permissions(), which permissions a user has.
+Elements of collections without a restrict hook are sent unchanged.
+
+Clients with the same permissions see the same data. So the permissions are
+used as fingerprint: each autoupdate is restricted once for all clients with
+the same permissions.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from .all_data import CollectionType, Element, ElementID
+from .db import DATABASE, get_element_version
+
+
+Permissions = FrozenSet[str]
+RestrictHook = Callable[[Element, Permissions], Optional[Element]]
+PermissionsHook = Callable[[Mapping[str, CollectionType], Optional[int]], Permissions]
+
+# Maximal number of restricted elements, that are kept in memory.
+RESTRICTED_CACHE_SIZE = 100_000
+
+# Functions, that return the restricted version of an element or None, if the
+# element is not visible with the given permissions.
+restrict_hooks: Dict[str, RestrictHook] = {}
+
+permissions_hooks: List[PermissionsHook] = []
+
+
+def register_restrict(collection: str, hook: RestrictHook) -> None:
+    """
+    Declares, how an element of the collection is restricted.
+
+    The hook gets the element, with its referenced_data, and the permissions
+    of the client. It must not change the element.
+    """
+    restrict_hooks[collection] = hook
+    restricted_cache.clear()
+
+
+def register_permissions(hook: PermissionsHook) -> None:
+    """
+    Declares, how the permissions of a user are calculated.
+
+    The hook gets the database and the user_id, which is None for anonymous
+    clients.
+    """
+    permissions_hooks[:] = [hook]
+
+
+def get_permissions(user_id: Optional[int]) -> Permissions:
+    """
+    Returns the permissions of a user. Without a permissions hook, all
+    clients have the same permissions.
+    """
+    if not permissions_hooks:
+        return frozenset()
+    return permissions_hooks[0](DATABASE, user_id)
+
+
+class RestrictedCache:
+    """
+    Cache for restricted elements.
+
+    An entry is valid as long as the version of the element is the same. The
+    version changes, when the element or its referenced_data changes. See
+    db.get_element_version().
+    """
+
+    def __init__(self) -> None:
+        self.elements: OrderedDict[
+            Tuple[ElementID, Permissions], Tuple[int, Optional[Element]]
+        ] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, collection: str, element: Element, permissions: Permissions
+    ) -> Optional[Element]:
+        """
+        Returns the restricted element.
+        """
+        element_id = (collection, element["id"])
+        version = get_element_version(element_id)
+        key = (element_id, permissions)
+        cached = self.elements.get(key)
+        if cached is not None and cached[0] == version:
+            self.elements.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        restricted = restrict_hooks[collection](element, permissions)
+        self.elements[key] = (version, restricted)
+        self.elements.move_to_end(key)
+        if len(self.elements) > RESTRICTED_CACHE_SIZE:
+            self.elements.popitem(last=False)
+        return restricted
+
+    def clear(self) -> None:
+        self.elements.clear()
+
+
+restricted_cache = RestrictedCache()
+
+
+def restrict_autoupdate(
+    autoupdate: Dict[str, Any], permissions: Permissions
+) -> Dict[str, Any]:
+    """
+    Returns the autoupdate as the client with the given permissions sees it.
+
+    Elements, that the client can not see, are sent as deleted. In an
+    autoupdate with all data, they are left out.
+    """
+    changed: Dict[str, List[Element]] = {}
+    deleted: Dict[str, List[int]] = {
+        collection: list(item_ids)
+        for collection, item_ids in autoupdate["deleted"].items()
+    }
+    for collection, elements in autoupdate["changed"].items():
+        if collection not in restrict_hooks:
+            changed[collection] = elements
+            continue
+
+        visible: List[Element] = []
+        for element in elements:
+            restricted = restricted_cache.get(collection, element, permissions)
+            if restricted is not None:
+                visible.append(restricted)
+            elif not autoupdate["all_data"]:
+                deleted.setdefault(collection, []).append(element["id"])
+        if visible:
+            changed[collection] = visible
+
+    restricted_autoupdate = dict(autoupdate)
+    restricted_autoupdate["changed"] = changed
+    restricted_autoupdate["deleted"] = deleted
+    return restricted_autoupdate
@@ -0,0 +1,250 @@
+"""
+Validators for the payloads of actions.
+
+Konzept.md: For each action, there is a json schema, that defines the format
+of the payload. The schema is compiled once, when the action is registered,
+into a function, that checks a payload without looking at the schema again.
+The payloads of a message are checked before db_write_lock.
+
+Only a part of json schema is supported: type, enum, properties, required,
+additionalProperties, items, minItems, maxItems, minLength, maxLength, minimum
+and maximum. The schema true accepts everything and false nothing.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+
+Schema = Union[bool, Dict[str, Any]]
+Validator = Callable[[Any], None]
+Path = Tuple[Union[str, int], ...]
+
+# Python types of the json schema types. bool is not an integer or a number.
+TYPES: Dict[str, Tuple[type, ...]] = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+    "null": (type(None),),
+}
+
+KEYWORDS = {
+    "type",
+    "enum",
+    "properties",
+    "required",
+    "additionalProperties",
+    "items",
+    "minItems",
+    "maxItems",
+    "minLength",
+    "maxLength",
+    "minimum",
+    "maximum",
+    "description",
+}
+
+
+class SchemaError(Exception):
+    """
+    Exception, if a value does not match its schema. `path` is the place of
+    the value in the payload.
+    """
+
+    def __init__(self, message: str, path: Path = ()) -> None:
+        super().__init__(message)
+        self.message = message
+        self.path = path
+
+    def __str__(self) -> str:
+        if not self.path:
+            return self.message
+        return f"{format_path(self.path)} {self.message}"
+
+    def at(self, key: Union[str, int]) -> SchemaError:
+        return SchemaError(self.message, (key,) + self.path)
+
+
+def format_path(path: Path) -> str:
+    """
+    Returns a path like elements[3].username.
+    """
+    result = ""
+    for key in path:
+        if isinstance(key, int):
+            result += f"[{key}]"
+        else:
+            result += f".{key}" if result else key
+    return result
+
+
+def accept(value: Any) -> None:
+    pass
+
+
+def reject(value: Any) -> None:
+    raise SchemaError("is not allowed")
+
+
+def compile_schema(schema: Schema) -> Validator:
+    """
+    Returns a function, that raises SchemaError, if a value does not match the
+    schema. Raises ValueError, if the schema itself is not valid.
+    """
+    if schema is True:
+        return accept
+    if schema is False:
+        return reject
+    if not isinstance(schema, dict):
+        raise ValueError(f"A schema has to be a dict or a bool, not {schema!r}")
+    unknown = set(schema) - KEYWORDS
+    if unknown:
+        raise ValueError(f"Unknown schema keywords {', '.join(sorted(unknown))}")
+
+    checks = [
+        check
+        for check in (
+            compile_type(schema),
+            compile_enum(schema),
+            compile_object(schema),
+            compile_array(schema),
+            compile_string(schema),
+            compile_number(schema),
+        )
+        if check is not None
+    ]
+    if not checks:
+        return accept
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value: Any) -> None:
+        for check in checks:
+            check(value)
+
+    return validate
+
+
+def compile_type(schema: Dict[str, Any]) -> Optional[Validator]:
+    if "type" not in schema:
+        return None
+    names: List[str] = (
+        [schema["type"]] if isinstance(schema["type"], str) else schema["type"]
+    )
+    for name in names:
+        if name not in TYPES:
+            raise ValueError(f"Unknown type {name}")
+    types = tuple(python_type for name in names for python_type in TYPES[name])
+    allow_bool = "boolean" in names
+    message = f"has to be {' or '.join(names)}"
+
+    def check_type(value: Any) -> None:
+        if not isinstance(value, types) or (
+            isinstance(value, bool) and not allow_bool
+        ):
+            raise SchemaError(message)
+
+    return check_type
+
+
+def compile_enum(schema: Dict[str, Any]) -> Optional[Validator]:
+    if "enum" not in schema:
+        return None
+    values = list(schema["enum"])
+    message = f"has to be one of {', '.join(map(repr, values))}"
+
+    def check_enum(value: Any) -> None:
+        if value not in values:
+            raise SchemaError(message)
+
+    return check_enum
+
+
+def compile_object(schema: Dict[str, Any]) -> Optional[Validator]:
+    if not {"properties", "required", "additionalProperties"} & set(schema):
+        return None
+    properties = {
+        key: compile_schema(sub_schema)
+        for key, sub_schema in schema.get("properties", {}).items()
+    }
+    required = tuple(schema.get("required", ()))
+    additional = compile_schema(schema.get("additionalProperties", True))
+
+    def check_object(value: Any) -> None:
+        if not isinstance(value, dict):
+            return
+        for key in required:
+            if key not in value:
+                raise SchemaError(f"{key} is required")
+        for key, item in value.items():
+            validator = properties.get(key, additional)
+            if validator is accept:
+                continue
+            try:
+                validator(item)
+            except SchemaError as err:
+                raise err.at(key) from None
+
+    return check_object
+
+
+def compile_array(schema: Dict[str, Any]) -> Optional[Validator]:
+    if not {"items", "minItems", "maxItems"} & set(schema):
+        return None
+    items = compile_schema(schema.get("items", True))
+    min_items = schema.get("minItems", 0)
+    max_items = schema.get("maxItems")
+
+    def check_array(value: Any) -> None:
+        if not isinstance(value, list):
+            return
+        if len(value) < min_items:
+            raise SchemaError(f"needs at least {min_items} items")
+        if max_items is not None and len(value) > max_items:
+            raise SchemaError(f"can not have more than {max_items} items")
+        if items is accept:
+            return
+        for index, item in enumerate(value):
+            try:
+                items(item)
+            except SchemaError as err:
+                raise err.at(index) from None
+
+    return check_array
+
+
+def compile_string(schema: Dict[str, Any]) -> Optional[Validator]:
+    if not {"minLength", "maxLength"} & set(schema):
+        return None
+    min_length = schema.get("minLength", 0)
+    max_length = schema.get("maxLength")
+
+    def check_string(value: Any) -> None:
+        if not isinstance(value, str):
+            return
+        if len(value) < min_length:
+            raise SchemaError(f"needs at least {min_length} characters")
+        if max_length is not None and len(value) > max_length:
+            raise SchemaError(f"can not have more than {max_length} characters")
+
+    return check_string
+
+
+def compile_number(schema: Dict[str, Any]) -> Optional[Validator]:
+    if not {"minimum", "maximum"} & set(schema):
+        return None
+    minimum = schema.get("minimum")
+    maximum = schema.get("maximum")
+
+    def check_number(value: Any) -> None:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return
+        if minimum is not None and value < minimum:
+            raise SchemaError(f"has to be at least {minimum}")
+        if maximum is not None and value > maximum:
+            raise SchemaError(f"can not be more than {maximum}")
+
+    return check_number
@@ -0,0 +1,254 @@
+"""
+Clients can subscribe to some collections or elements. They only get these
+elements, on connect and in autoupdates. Clients without a subscription get
+everything.
+
+    {"id": "1", "type": "subscribe", "collections": {"core/config": null}}
+    {"id": "2", "type": "subscribe", "collections": {"users/user": [1, 5]}}
+    {"id": "3", "type": "unsubscribe", "collections": {"users/user": [5]}}
+
+null means all elements of the collection. With "collections": null, the
+client gets everything again.
+
+The SubscriptionIndex knows the clients of each collection and element. So
+for a change, only the interested clients are looked at. Clients, that see
+the same part of a change, share one restricted and encoded autoupdate.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from .all_data import Element, ElementID
+from .autoupdate import ChangedElementsType
+from .db import DATABASE, get_change_id
+from .references import reference_index
+
+
+# The part of a change, that a client gets: the collections, that it gets
+# as whole, and the single elements.
+Shape = Tuple[Tuple[str, ...], Tuple[ElementID, ...]]
+
+
+class Subscription:
+    """
+    The collections and elements, that a client gets.
+
+    `collections` are subscribed as whole. `elements` has the ids of the
+    other subscribed elements.
+    """
+
+    def __init__(self) -> None:
+        self.collections: Set[str] = set()
+        self.elements: Dict[str, Set[int]] = defaultdict(set)
+
+    @classmethod
+    def everything(cls) -> Subscription:
+        """
+        Returns a subscription of all collections, that exist now.
+        """
+        subscription = cls()
+        subscription.collections.update(DATABASE)
+        return subscription
+
+    def add(self, collections: Dict[str, Optional[List[int]]]) -> None:
+        for collection, item_ids in collections.items():
+            if item_ids is None:
+                self.collections.add(collection)
+                self.elements.pop(collection, None)
+            elif collection not in self.collections:
+                self.elements[collection].update(item_ids)
+
+    def remove(self, collections: Dict[str, Optional[List[int]]]) -> None:
+        for collection, item_ids in collections.items():
+            if item_ids is None:
+                self.collections.discard(collection)
+                self.elements.pop(collection, None)
+            elif collection in self.collections:
+                # Only some elements of a whole collection are removed.
+                self.collections.discard(collection)
+                self.elements[collection] = set(DATABASE.get(collection, {}))
+                self.elements[collection].difference_update(item_ids)
+            elif collection in self.elements:
+                self.elements[collection].difference_update(item_ids)
+                if not self.elements[collection]:
+                    del self.elements[collection]
+
+    def contains(self, collection: str, item_id: int) -> bool:
+        return collection in self.collections or item_id in self.elements.get(
+            collection, ()
+        )
+
+    def as_dict(self) -> Dict[str, Optional[List[int]]]:
+        result: Dict[str, Optional[List[int]]] = {
+            collection: None for collection in self.collections
+        }
+        for collection, item_ids in self.elements.items():
+            result[collection] = sorted(item_ids)
+        return result
+
+
+def parse_collections(value: Any) -> Dict[str, Optional[List[int]]]:
+    """
+    Checks the collections of a subscribe message. A list of names is the
+    same as a dict with null values. Raises ValueError, if they are wrong.
+    """
+    if isinstance(value, list):
+        value = {collection: None for collection in value}
+    if not isinstance(value, dict):
+        raise ValueError("collections has to be a dict or a list")
+    for collection, item_ids in value.items():
+        if not isinstance(collection, str):
+            raise ValueError(f"Collection `{collection}` is not valid")
+        if item_ids is not None and not (
+            isinstance(item_ids, list)
+            and all(isinstance(item_id, int) for item_id in item_ids)
+        ):
+            raise ValueError(f"The ids of {collection} have to be a list of ints")
+    return value
+
+
+class SubscriptionIndex:
+    """
+    Index from collections and elements to the subscribed clients.
+
+    Clients without subscription are in `everything`.
+    """
+
+    def __init__(self) -> None:
+        self.everything: Set[Hashable] = set()
+        self.collections: Dict[str, Set[Hashable]] = defaultdict(set)
+        self.elements: Dict[ElementID, Set[Hashable]] = defaultdict(set)
+
+    def add(self, client: Hashable, subscription: Optional[Subscription]) -> None:
+        if subscription is None:
+            self.everything.add(client)
+            return
+        for collection in subscription.collections:
+            self.collections[collection].add(client)
+        for collection, item_ids in subscription.elements.items():
+            for item_id in item_ids:
+                self.elements[(collection, item_id)].add(client)
+
+    def remove(self, client: Hashable, subscription: Optional[Subscription]) -> None:
+        if subscription is None:
+            self.everything.discard(client)
+            return
+        for collection in subscription.collections:
+            discard(self.collections, collection, client)
+        for collection, item_ids in subscription.elements.items():
+            for item_id in item_ids:
+                discard(self.elements, (collection, item_id), client)
+
+    def get_shapes(self, autoupdate: Dict[str, Any]) -> Dict[Hashable, Optional[Shape]]:
+        """
+        Returns the clients, that get a part of the autoupdate, with the part
+        they get. None means the whole autoupdate.
+        """
+        collections: Dict[Hashable, List[str]] = defaultdict(list)
+        elements: Dict[Hashable, List[ElementID]] = defaultdict(list)
+        for collection, element_ids in iter_element_ids(autoupdate):
+            for client in self.collections.get(collection, ()):
+                collections[client].append(collection)
+            for element_id in element_ids:
+                for client in self.elements.get(element_id, ()):
+                    elements[client].append(element_id)
+
+        shapes: Dict[Hashable, Optional[Shape]] = {
+            client: None for client in self.everything
+        }
+        for client in set(collections) | set(elements):
+            shapes[client] = (tuple(collections[client]), tuple(elements[client]))
+        return shapes
+
+
+def discard(index: Dict[Any, Set[Hashable]], key: Any, client: Hashable) -> None:
+    clients = index.get(key)
+    if clients is not None:
+        clients.discard(client)
+        if not clients:
+            del index[key]
+
+
+def iter_element_ids(
+    autoupdate: Dict[str, Any]
+) -> Iterable[Tuple[str, List[ElementID]]]:
+    """
+    Returns the collections of an autoupdate with the ids of their changed and
+    deleted elements.
+    """
+    element_ids: Dict[str, List[ElementID]] = defaultdict(list)
+    for collection, elements in autoupdate["changed"].items():
+        element_ids[collection].extend(
+            (collection, element["id"]) for element in elements
+        )
+    for collection, item_ids in autoupdate["deleted"].items():
+        element_ids[collection].extend((collection, item_id) for item_id in item_ids)
+    return element_ids.items()
+
+
+def filter_autoupdate(
+    autoupdate: Dict[str, Any], subscription: Optional[Subscription]
+) -> Dict[str, Any]:
+    """
+    Returns the part of an autoupdate, that a client with the subscription
+    gets.
+    """
+    if subscription is None:
+        return autoupdate
+    changed: ChangedElementsType = {}
+    for collection, elements in autoupdate["changed"].items():
+        subscribed = [
+            element
+            for element in elements
+            if subscription.contains(collection, element["id"])
+        ]
+        if subscribed:
+            changed[collection] = subscribed
+    deleted: Dict[str, List[int]] = {}
+    for collection, item_ids in autoupdate["deleted"].items():
+        subscribed_ids = [
+            item_id
+            for item_id in item_ids
+            if subscription.contains(collection, item_id)
+        ]
+        if subscribed_ids:
+            deleted[collection] = subscribed_ids
+
+    filtered = dict(autoupdate)
+    filtered["changed"] = changed
+    filtered["deleted"] = deleted
+    return filtered
+
+
+def get_subscribed_data(subscription: Subscription) -> Dict[str, Any]:
+    """
+    Returns an autoupdate with all elements of the subscription.
+    """
+    changed: ChangedElementsType = {}
+
+    def add(collection: str, element: Element) -> None:
+        changed.setdefault(collection, []).append(
+            reference_index.render(DATABASE, collection, element)
+        )
+
+    for collection in subscription.collections:
+        for element in DATABASE.get(collection, {}).values():
+            add(collection, element)
+    for collection, item_ids in subscription.elements.items():
+        elements = DATABASE.get(collection, {})
+        for item_id in item_ids:
+            if item_id in elements:
+                add(collection, elements[item_id])
+    return {
+        "type": "autoupdate",
+        "changed": changed,
+        "deleted": {},
+        "all_data": True,
+        "change_id": get_change_id(),
+        "from_change_id": 0,
+    }
+
+
+subscription_index = SubscriptionIndex()
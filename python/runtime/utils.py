@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import time
+from typing import Dict
+
 
 DEBUG = False
 
+# Time, when the server was started.
+START_TIME = time.monotonic()
+
+# Durations of the steps of the server start in seconds.
+startup_metrics: Dict[str, float] = {}
+
 
 def debug(message: str) -> None:
     if DEBUG:
@@ -6,41 +6,241 @@ Each client is an instance of the Consumer class.
 from __future__ import annotations
 
 import asyncio
-import json
-from collections import defaultdict
-from typing import Any, Dict, List, Set
+import sys
+import time
+import traceback
+from collections import defaultdict, deque
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qs, urlparse
 
 import websockets
+from websockets.datastructures import Headers
+from websockets.extensions import Extension, ServerExtensionFactory
+from websockets.legacy.server import WebSocketServerProtocol
 
-from .actions import ValidationError, handle_actions, prepare_actions
-from .db import get_database
-from .utils import debug
+from . import actions, metrics
+from .actions import (
+    BUSY_RETRY_AFTER,
+    Busy,
+    ValidationError,
+    get_priority,
+    handle_actions,
+    prepare_actions,
+)
+from .autoupdate import get_autoupdate_since, get_full_data, merge_autoupdates
+from .codec import (
+    COMPRESSION,
+    Codec,
+    CompressedCodec,
+    Frame,
+    codecs,
+    get_codec,
+    get_compression_stats,
+)
+from .compactor import run_compactor
+from .db import (
+    ActionLogError,
+    action_log,
+    get_change_id,
+    get_changed_elements_since,
+    load_lazy_collections,
+)
+from .delta import PreviousType, get_delta_autoupdate
+from .history import HistoryNotAvailable, history
+from .metrics import inc, register_gauge, serve_metrics, timer
+from .restrict import (
+    Permissions,
+    get_permissions,
+    restrict_autoupdate,
+    restricted_cache,
+)
+from .subscriptions import (
+    Shape,
+    Subscription,
+    filter_autoupdate,
+    get_subscribed_data,
+    parse_collections,
+    subscription_index,
+)
+from .utils import START_TIME, debug, startup_metrics
+
+
+# Number of changes a cached full data frame can be behind the database. New
+# clients get the cached frame and the changes since then.
+FULL_DATA_MAX_AGE = 100
+
+# Maximal number of frames in the send queue of one client.
+SEND_QUEUE_SIZE = 100
+
+# What to do with a new autoupdate, when the send queue of a client is full:
+# "coalesce": Merge all autoupdates in the queue into one.
+# "resync": Drop all autoupdates in the queue and send all data instead.
+SEND_QUEUE_POLICY = "coalesce"
+
+# Maximal number of messages of one client, that are handled at the same
+# time. More messages are rejected as busy.
+CLIENT_MAX_IN_FLIGHT = 10
+
+# Frame in the send queue, that is replaced with all data when it is sent.
+RESYNC = "resync"
+
+# An encoded frame and, if the frame is an autoupdate, the autoupdate message.
+QueueItem = Tuple[Frame, Optional[Dict[str, Any]]]
+
+
+class FullDataCache:
+    """
+    Cache for the encoded full data autoupdates.
+
+    There is one frame for each permissions and codec. It is built once and
+    shared by all clients with these permissions and codec that connect until
+    it is too old. Clients, that connect while the frame is built, wait for the
+    same build.
+    """
+
+    def __init__(self) -> None:
+        self.frames: Dict[Tuple[Permissions, str], Tuple[int, asyncio.Future]] = {}
+
+    async def get(self, permissions: Permissions, codec: Codec) -> Tuple[int, Frame]:
+        """
+        Returns the change_id and the encoded full data frame.
+        """
+        key = (permissions, codec.name)
+        cached = self.frames.get(key)
+        if cached is None or not self.is_usable(*cached):
+            full_data = restrict_autoupdate(get_full_data(), permissions)
+            cached = (
+                full_data["change_id"],
+                asyncio.ensure_future(self.build(full_data, codec)),
+            )
+            self.frames[key] = cached
+        change_id, frame = cached
+        return change_id, await asyncio.shield(frame)
+
+    def is_usable(self, change_id: int, frame: asyncio.Future) -> bool:
+        """
+        Returns True, if a cached frame is new enough and the changes since
+        then are in the change history.
+        """
+        if frame.done() and frame.exception():
+            return False
+        if get_change_id() - change_id > FULL_DATA_MAX_AGE:
+            return False
+        return get_changed_elements_since(change_id) is not None
+
+    async def build(self, full_data: Dict[str, Any], codec: Codec) -> Frame:
+        return await asyncio.get_event_loop().run_in_executor(
+            None, codec.encode, full_data
+        )
+
+
+full_data_cache = FullDataCache()
 
 
 class Client:
     all_clients: Set["Client"] = set()
 
-    def __init__(self, websocket: websockets.WebSocketServerProtocol) -> None:
+    # Counters for all clients since the server started.
+    dropped_messages = 0
+    coalesced_messages = 0
+    resyncs = 0
+
+    def __init__(
+        self,
+        websocket: websockets.WebSocketServerProtocol,
+        user_id: Optional[int],
+        delta: bool = False,
+        subscription: Optional[Subscription] = None,
+    ) -> None:
         self.websocket = websocket
+        self.user_id = user_id
+        # The client gets patches for changed elements. See delta.py.
+        self.delta = delta
+        # The elements, the client gets. None means all. See subscriptions.py.
+        self.subscription = subscription
+        self.permissions = get_permissions(user_id)
+        self.codec = get_codec(websocket.subprotocol)
+        self.queue: Deque[QueueItem] = deque()
+        self.queue_event = asyncio.Event()
+        self.resync_pending = False
+        self.sender: Optional[asyncio.Future] = None
+        self.in_flight: Set[asyncio.Future] = set()
 
     def __enter__(self) -> "Client":
         self.all_clients.add(self)
+        subscription_index.add(self, self.subscription)
+        self.sender = asyncio.ensure_future(self.send_queue())
         return self
 
     def __exit__(self, *args: Any) -> None:
         self.all_clients.remove(self)
+        subscription_index.remove(self, self.subscription)
+        if self.sender is not None:
+            self.sender.cancel()
 
-    async def connected(self) -> None:
+    async def connected(self, change_id: Optional[int] = None) -> None:
         """
         Called when the websocket is opened.
+
+        If the client sends the change_id of its last autoupdate, it only gets
+        the changes since then. It gets all data, if there is no change_id or
+        the change is too old.
         """
-        all_data: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-        for collection, data in (await get_database()).items():
-            for element in data.values():
-                all_data[collection].append(element)
+        if change_id is not None:
+            autoupdate = get_autoupdate_since(change_id)
+            if autoupdate is not None:
+                autoupdate = filter_autoupdate(autoupdate, self.subscription)
+                await self.send(restrict_autoupdate(autoupdate, self.permissions))
+                return
 
-        await self.send(
-            {"type": "autoupdate", "changed": all_data, "deleted": {}, "all_data": True}
+        for frame in await get_full_data_frames(
+            self.permissions, self.codec, self.subscription
+        ):
+            self.enqueue(frame)
+
+    def receive(self, message: Dict[str, Any]) -> None:
+        """
+        Handles a message in the background, so the client can send more
+        messages, before it gets the response.
+
+        If the client has CLIENT_MAX_IN_FLIGHT messages, that are not
+        answered, the message is rejected as busy.
+        """
+        if len(self.in_flight) >= CLIENT_MAX_IN_FLIGHT:
+            inc("openslides_busy_total", reason="client")
+            self.send_busy(message.get("id"), "You sent too many messages at once.")
+            return
+        task = asyncio.ensure_future(self.recv(message))
+        self.in_flight.add(task)
+        task.add_done_callback(self.recv_done)
+
+    def recv_done(self, task: asyncio.Future) -> None:
+        self.in_flight.discard(task)
+        if task.cancelled():
+            return
+        err = task.exception()
+        if err is None:
+            return
+        print(f"Error in a message of user {self.user_id}:", file=sys.stderr)
+        traceback.print_exception(type(err), err, err.__traceback__)
+        asyncio.ensure_future(self.websocket.close(1011))
+
+    def send_busy(self, message_id: Any, error: str) -> None:
+        """
+        Sends a response, that the message was not handled and can be sent
+        again after retry_after seconds.
+        """
+        self.enqueue(
+            self.codec.encode(
+                {
+                    "type": "response",
+                    "error": error,
+                    "busy": True,
+                    "retry_after": BUSY_RETRY_AFTER,
+                    "response-id": message_id,
+                }
+            )
         )
 
     async def recv(self, message: Dict[str, Any]) -> None:
@@ -58,12 +258,26 @@ class Client:
                 }
             ]
         }
+
+        Messages with the type "history" are historical reads. See
+        recv_history(). Messages with the type "subscribe" or "unsubscribe"
+        change the subscription. See recv_subscribe().
         """
         message_id = message["id"]
-        action_data = await prepare_actions(message["actions"])
+        if message.get("type") == "history":
+            await self.recv_history(message)
+            return
+        if message.get("type") in ("subscribe", "unsubscribe"):
+            await self.recv_subscribe(message)
+            return
         try:
-            return_values = await handle_actions(action_data)
-        except ValidationError as err:
+            action_data = await prepare_actions(message.get("actions"))
+            return_values = await handle_actions(
+                action_data, get_priority(action_data, self.permissions)
+            )
+        except Busy as err:
+            self.send_busy(message_id, str(err))
+        except (ValidationError, ActionLogError) as err:
             await self.send(
                 {"type": "response", "error": str(err), "response-id": message_id}
             )
@@ -76,29 +290,353 @@ class Client:
                 }
             )
 
+    async def recv_history(self, message: Dict[str, Any]) -> None:
+        """
+        Sends the elements of a collection, as they were after a past change.
+
+        {
+            "id": "message_id",
+            "type": "history",
+            "change_id": 42,
+            "collection": "users/user",
+            "item_id": 5
+        }
+
+        item_id is optional. Without it, all elements of the collection are
+        sent.
+        """
+        message_id = message["id"]
+        change_id = message.get("change_id")
+        collection = message.get("collection")
+        item_id = message.get("item_id")
+        if not isinstance(change_id, int) or not 0 <= change_id <= get_change_id():
+            error: Optional[str] = f"The change_id {change_id} is not valid."
+        elif not isinstance(collection, str):
+            error = "A history request needs a collection."
+        else:
+            try:
+                version = await history.get_version(change_id)
+            except HistoryNotAvailable as err:
+                error = str(err)
+            else:
+                elements = version.get_elements(collection, item_id, self.permissions)
+                await self.send(
+                    {
+                        "type": "response",
+                        "history": {
+                            "change_id": change_id,
+                            "collection": collection,
+                            "elements": elements,
+                        },
+                        "response-id": message_id,
+                    }
+                )
+                return
+        await self.send({"type": "response", "error": error, "response-id": message_id})
+
+    async def recv_subscribe(self, message: Dict[str, Any]) -> None:
+        """
+        Changes the subscription of the client.
+
+        {
+            "id": "message_id",
+            "type": "subscribe",
+            "collections": {"users/user": [1, 5], "core/config": null}
+        }
+
+        A client without subscription gets all elements. Its first subscribe
+        message limits it to the given collections and elements. Subscribe
+        with "collections": null to get all elements again.
+
+        The response has the new subscription. Then the client gets all data
+        of the new subscription.
+        """
+        message_id = message["id"]
+        collections = message.get("collections")
+        subscription: Optional[Subscription]
+        if message["type"] == "subscribe" and collections is None:
+            subscription = None
+        else:
+            try:
+                parsed = parse_collections(collections)
+            except ValueError as err:
+                await self.send(
+                    {"type": "response", "error": str(err), "response-id": message_id}
+                )
+                return
+            subscription = Subscription()
+            if self.subscription is not None:
+                subscription.add(self.subscription.as_dict())
+            if message["type"] == "subscribe":
+                subscription.add(parsed)
+            else:
+                if self.subscription is None:
+                    subscription = Subscription.everything()
+                subscription.remove(parsed)
+
+        subscription_index.remove(self, self.subscription)
+        self.subscription = subscription
+        subscription_index.add(self, subscription)
+        await self.send(
+            {
+                "type": "response",
+                "subscription": subscription and subscription.as_dict(),
+                "response-id": message_id,
+            }
+        )
+        if not self.resync_pending:
+            for frame in await get_full_data_frames(
+                self.permissions, self.codec, subscription
+            ):
+                self.enqueue(frame)
+
     async def send(self, message: Dict[str, Any]) -> None:
         """
         Sends data to the client.
+
+        The message is added to the send queue of the client. It does not wait
+        until the message is sent.
+        """
+        self.enqueue(self.codec.encode(message))
+
+    def enqueue(self, frame: Frame, autoupdate: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Adds an encoded frame to the send queue.
+
+        If the frame is an autoupdate, the message has to be given, so it can
+        be merged with other autoupdates, when the queue is full.
+        """
+        if autoupdate is not None:
+            if self.resync_pending:
+                Client.dropped_messages += 1
+                return
+            if len(self.queue) >= SEND_QUEUE_SIZE:
+                if SEND_QUEUE_POLICY == "resync":
+                    self.resync()
+                    return
+                self.coalesce(autoupdate)
+                return
+
+        self.queue.append((frame, autoupdate))
+        self.queue_event.set()
+
+    def coalesce(self, autoupdate: Dict[str, Any]) -> None:
         """
-        await self.websocket.send(json.dumps(message))
+        Merges the autoupdates at the end of the queue and the new autoupdate
+        into one autoupdate.
+
+        Only the autoupdates after the last other frame are merged. An other
+        frame can be all data at an older change_id, so the autoupdates after
+        it have to stay after it.
+        """
+        queue = self.queue
+        start = len(queue)
+        while start > 0 and queue[start - 1][1] is not None:
+            start -= 1
+        autoupdates = [
+            queued for _, queued in list(queue)[start:] if queued is not None
+        ]
+        autoupdates.append(autoupdate)
+        merged = merge_autoupdates(autoupdates)
+        Client.coalesced_messages += len(autoupdates) - 1
+
+        for _ in range(start, len(queue)):
+            queue.pop()
+        queue.append((self.codec.encode(merged), merged))
+        self.queue_event.set()
+
+    def resync(self) -> None:
+        """
+        Removes all autoupdates from the queue. The client gets all data
+        instead, when the rest of the queue is sent.
+        """
+        queue: Deque[QueueItem] = deque()
+        for item in self.queue:
+            if item[1] is None:
+                queue.append(item)
+            else:
+                Client.dropped_messages += 1
+        Client.dropped_messages += 1
+        Client.resyncs += 1
+        queue.append((RESYNC, None))
+        self.queue = queue
+        self.resync_pending = True
+        self.queue_event.set()
+
+    async def send_queue(self) -> None:
+        """
+        Sends the frames from the send queue. Runs as long as the client is
+        connected.
+        """
+        try:
+            while True:
+                await self.queue_event.wait()
+                while self.queue:
+                    frame, _ = self.queue.popleft()
+                    if frame == RESYNC:
+                        self.resync_pending = False
+                        for full_data_frame in await get_full_data_frames(
+                            self.permissions, self.codec, self.subscription
+                        ):
+                            await self.send_frame(full_data_frame)
+                    else:
+                        await self.send_frame(frame)
+                self.queue_event.clear()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def send_frame(self, frame: Frame) -> None:
+        inc("openslides_sent_frames_total", codec=self.codec.name)
+        inc("openslides_sent_bytes_total", len(frame), codec=self.codec.name)
+        await self.websocket.send(frame)
 
     @classmethod
-    async def send_to_all(cls, message: Dict[str, Any]) -> None:
+    async def send_to_all(
+        cls, message: Dict[str, Any], previous: Optional[PreviousType] = None
+    ) -> None:
         """
-        Sends data to all connected clients.
+        Sends an autoupdate to all connected clients, that subscribed one of
+        its elements.
+
+        The clients are grouped by their permissions and the part of the
+        autoupdate, that they subscribed (see subscriptions.py). The
+        autoupdate is restricted once for each permissions, filtered once for
+        each part and encoded once for each codec. Then it is added to the
+        send queue of each client of the group.
+
+        Clients with delta get patches against the previous versions of the
+        elements instead. The queue keeps the whole autoupdate, so it can be
+        merged with others.
+
+        Clients, whose permissions changed, get all data again.
         """
-        encoded = json.dumps(message)
-        for client in cls.all_clients:
-            await client.websocket.send(encoded)
+        with timer("openslides_send_to_all_seconds"):
+            shapes = subscription_index.get_shapes(message)
+            permissions_by_user: Dict[Optional[int], Permissions] = {}
+            groups: Dict[Permissions, Dict[Optional[Shape], List[Client]]] = (
+                defaultdict(lambda: defaultdict(list))
+            )
+            for client in list(cls.all_clients):
+                if client.user_id not in permissions_by_user:
+                    permissions_by_user[client.user_id] = get_permissions(
+                        client.user_id
+                    )
+                permissions = permissions_by_user[client.user_id]
+                if permissions != client.permissions:
+                    client.permissions = permissions
+                    if not client.resync_pending:
+                        client.resync()
+                    continue
+                if client in shapes:
+                    groups[permissions][shapes[client]].append(client)
+
+            inc("openslides_permission_groups_total", len(groups))
+            for permissions, shape_groups in groups.items():
+                with timer("openslides_restrict_seconds"):
+                    restricted = restrict_autoupdate(message, permissions)
+                for clients in shape_groups.values():
+                    filtered = filter_autoupdate(restricted, clients[0].subscription)
+                    delta: Optional[Dict[str, Any]] = None
+                    encoded: Dict[Tuple[str, bool], Frame] = {}
+                    for client in clients:
+                        use_delta = client.delta and previous is not None
+                        key = (client.codec.name, use_delta)
+                        if key not in encoded:
+                            frame_message = filtered
+                            if client.delta and previous is not None:
+                                if delta is None:
+                                    delta = get_delta_autoupdate(
+                                        filtered, previous, permissions
+                                    )
+                                frame_message = delta
+                            with timer(
+                                "openslides_encode_seconds", codec=client.codec.name
+                            ):
+                                encoded[key] = client.codec.encode(frame_message)
+                        client.enqueue(encoded[key], filtered)
+
+    @classmethod
+    def get_queue_stats(cls) -> Dict[str, int]:
+        """
+        Returns the state of the send queues of all clients.
+        """
+        depths = [len(client.queue) for client in cls.all_clients]
+        return {
+            "clients": len(depths),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_messages": cls.dropped_messages,
+            "coalesced_messages": cls.coalesced_messages,
+            "resyncs": cls.resyncs,
+        }
+
+
+async def get_full_data_frames(
+    permissions: Permissions,
+    codec: Codec,
+    subscription: Optional[Subscription] = None,
+) -> List[Frame]:
+    """
+    Returns the frames, a client with the given permissions and codec needs to
+    get all data.
+
+    This is the cached full data frame and, if the frame is older than the
+    database, an autoupdate with the changes since then. Clients with a
+    subscription get a frame with only their elements. It is not cached.
+    """
+    if subscription is not None:
+        full_data = restrict_autoupdate(get_subscribed_data(subscription), permissions)
+        return [codec.encode(full_data)]
+    frame_change_id, frame = await full_data_cache.get(permissions, codec)
+    frames = [frame]
+    if frame_change_id < get_change_id():
+        autoupdate = get_autoupdate_since(frame_change_id)
+        if autoupdate is not None:
+            frames.append(codec.encode(restrict_autoupdate(autoupdate, permissions)))
+    return frames
+
+
+def get_subscription_from_path(path: str) -> Optional[Subscription]:
+    """
+    Returns the subscription from a path like /?subscribe=core/config,users/user.
+    """
+    values = parse_qs(urlparse(path).query).get("subscribe")
+    if not values:
+        return None
+    subscription = Subscription()
+    subscription.add(
+        {collection: None for collection in values[0].split(",") if collection}
+    )
+    return subscription
+
+
+def get_int_from_path(path: str, name: str) -> Optional[int]:
+    """
+    Returns an int argument from a path like /?change_id=42.
+    """
+    values = parse_qs(urlparse(path).query).get(name)
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
 
 
 async def handler(websocket: websockets.WebSocketServerProtocol, path: str) -> None:
-    client = Client(websocket).__enter__()
+    # There is no authentication yet. The client tells its user_id.
+    if "first_connection" not in startup_metrics:
+        startup_metrics["first_connection"] = time.monotonic() - START_TIME
+        debug(f"First connection {startup_metrics['first_connection']:.3f}s after start")
+    client = Client(
+        websocket,
+        get_int_from_path(path, "user_id"),
+        delta=bool(get_int_from_path(path, "delta")),
+        subscription=get_subscription_from_path(path),
+    ).__enter__()
     try:
         debug(f"New connection, currently {len(Client.all_clients)} connected clients")
-        await client.connected()
+        await client.connected(get_int_from_path(path, "change_id"))
         async for message in websocket:
-            await client.recv(json.loads(message))
+            client.receive(client.codec.decode(message))
     except websockets.exceptions.ConnectionClosed:
         pass
     finally:
@@ -106,8 +644,84 @@ async def handler(websocket: websockets.WebSocketServerProtocol, path: str) -> N
         debug(f"Lost connection, currently {len(Client.all_clients)} connected clients")
 
 
+def register_gauges() -> None:
+    """
+    Declares the gauges for the metrics endpoint.
+    """
+
+    def get_value(func: Callable[[], Dict[str, Any]], key: str) -> float:
+        return func().get(key, 0)
+
+    register_gauge("openslides_change_id", get_change_id)
+    register_gauge("openslides_action_log_bytes", lambda: action_log.size)
+    register_gauge("openslides_action_log_actions", lambda: action_log.action_count)
+    register_gauge(
+        "openslides_write_queue_length", lambda: len(actions.write_scheduler)
+    )
+    for key in Client.get_queue_stats():
+        register_gauge(
+            f"openslides_{key}", partial(get_value, Client.get_queue_stats, key)
+        )
+    for key in get_compression_stats():
+        register_gauge(
+            f"openslides_compression_{key}",
+            partial(get_value, get_compression_stats, key),
+        )
+    register_gauge("openslides_restricted_cache_hits", lambda: restricted_cache.hits)
+    register_gauge(
+        "openslides_restricted_cache_misses", lambda: restricted_cache.misses
+    )
+    for key in ("load_snapshot", "init_db", "listening", "first_connection"):
+        register_gauge(
+            f"openslides_startup_{key}_seconds",
+            partial(get_value, startup_metrics.copy, key),
+        )
+
+
+class ServerProtocol(WebSocketServerProtocol):
+    """
+    Websocket protocol, that uses permessage-deflate only for connections
+    without a +zlib subprotocol. Their frames are already compressed.
+    """
+
+    def process_extensions(  # type: ignore
+        self,
+        headers: Headers,
+        available_extensions: Optional[Sequence[ServerExtensionFactory]],
+    ) -> Tuple[Optional[str], List[Extension]]:
+        subprotocol = self.process_subprotocol(headers, self.available_subprotocols)
+        if isinstance(get_codec(subprotocol), CompressedCodec):
+            available_extensions = None
+        return super().process_extensions(headers, available_extensions)
+
+
+async def start_server(host: str, port: int, reuse_port: bool = False) -> None:
+    """
+    Starts the websocket server. With reuse_port, many processes can use the
+    same port. See cluster.py.
+    """
+    await websockets.serve(
+        handler,
+        host,
+        port,
+        subprotocols=list(codecs),
+        compression="deflate" if COMPRESSION else None,
+        create_protocol=ServerProtocol,
+        reuse_port=reuse_port,
+    )
+    startup_metrics["listening"] = time.monotonic() - START_TIME
+    print(
+        f"Started Server on {host}:{port} after {startup_metrics['listening']:.3f}s"
+    )
+    asyncio.ensure_future(load_lazy_collections())
+
+
 def serve(host: str, port: int) -> None:
-    start_server = websockets.serve(handler, host, port)
-    asyncio.get_event_loop().run_until_complete(start_server)
-    print(f"Started Server on {host}:{port}")
+    asyncio.get_event_loop().run_until_complete(start_server(host, port))
+    asyncio.ensure_future(run_compactor())
+    if metrics.METRICS_ENABLED:
+        register_gauges()
+        asyncio.get_event_loop().run_until_complete(
+            serve_metrics(host, metrics.METRICS_PORT)
+        )
     asyncio.get_event_loop().run_forever()
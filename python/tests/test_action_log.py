@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from runtime import db
+from runtime.actions import Action, all_data_var
+from runtime.db import ActionLog, ActionLogError
+
+
+class SetValue(Action, name="test/set_value"):
+    async def execute(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        all_data_var.get()["test/log"][payload["id"]] = payload
+        return {}
+
+
+def record(change_id: int) -> Dict[str, Any]:
+    return {
+        "change_id": change_id,
+        "actions": [{"action": "test/set_value", "payload": {"id": change_id}}],
+    }
+
+
+class ActionLogTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "actions.log")
+        self.log = ActionLog(self.path)
+        self.log.open()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self) -> None:
+        self.log.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.tmp_dir.cleanup()
+
+    def write(self, *change_ids: int) -> List[Any]:
+        async def append() -> List[Any]:
+            futures = [self.log.append(record(change_id)) for change_id in change_ids]
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        return self.loop.run_until_complete(append())
+
+    def read_change_ids(self, after: int = 0) -> List[int]:
+        return [record["change_id"] for record in self.log.read(after)]
+
+    def test_read_records(self) -> None:
+        self.write(1, 2, 3)
+
+        self.assertEqual(self.read_change_ids(), [1, 2, 3])
+        self.assertEqual(self.read_change_ids(after=1), [2, 3])
+        self.assertEqual(self.log.action_count, 3)
+
+    def test_cut_off_broken_end(self) -> None:
+        self.write(1, 2)
+        size = os.path.getsize(self.path)
+        with open(self.path, "ab") as file:
+            file.write(db.FRAME_HEADER.pack(100, 0) + b"broken")
+
+        self.assertEqual(self.read_change_ids(), [1, 2])
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_failed_write(self) -> None:
+        self.write(1)
+        size = os.path.getsize(self.path)
+
+        with mock.patch(
+            "runtime.db.os.fsync", side_effect=OSError("disk full")
+        ), mock.patch("runtime.db.restore_database", new=mock.AsyncMock()) as restore:
+            results = self.write(2, 3)
+
+        self.assertTrue(all(isinstance(result, OSError) for result in results))
+        restore.assert_called_once()
+        self.assertEqual(os.path.getsize(self.path), size)
+        with self.assertRaises(ActionLogError):
+            self.write(4)
+        self.assertEqual(self.read_change_ids(), [1])
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.change_id = db.CHANGE_ID
+        db.DATABASE["test/log"] = {}
+
+    def tearDown(self) -> None:
+        db.CHANGE_ID = self.change_id
+        db.DATABASE.pop("test/log", None)
+
+    def test_replay_actions(self) -> None:
+        records = [record(self.change_id + 1), record(self.change_id + 2)]
+        asyncio.run(db.replay_actions(records))
+
+        self.assertEqual(
+            db.DATABASE["test/log"],
+            {
+                self.change_id + 1: {"id": self.change_id + 1},
+                self.change_id + 2: {"id": self.change_id + 2},
+            },
+        )
+        self.assertEqual(db.CHANGE_ID, self.change_id + 2)
@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from runtime.actions import ValidationError
+from runtime.all_data import AllData, index_definitions, plain, register_index
+
+
+class UniqueIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        register_index("test/unique", "key", unique=True)
+        self.all_data = AllData(
+            {"test/unique": {1: {"id": 1, "key": "a"}, 2: {"id": 2, "key": "b"}}}
+        )
+
+    def tearDown(self) -> None:
+        index_definitions.pop("test/unique", None)
+
+    def test_value_of_other_element(self) -> None:
+        data = self.all_data.begin()
+        data["test/unique"][2]["key"] = "a"
+        with self.assertRaises(ValidationError):
+            data.check_unique()
+
+    def test_value_twice_in_transaction(self) -> None:
+        data = self.all_data.begin()
+        data["test/unique"][3] = {"id": 3, "key": "c"}
+        data["test/unique"][4] = {"id": 4, "key": "c"}
+        with self.assertRaises(ValidationError):
+            data.check_unique()
+
+    def test_swap_values(self) -> None:
+        data = self.all_data.begin()
+        data["test/unique"][1]["key"] = "b"
+        data["test/unique"][2]["key"] = "a"
+        data.check_unique()
+
+    def test_unchanged_value_is_not_looked_up(self) -> None:
+        data = AllData(self.all_data.committed)
+        data["test/unique"][1]["other"] = True
+        data.check_unique()
+        self.assertEqual(data["test/unique"].read_values, {})
+
+
+class ConflictTest(unittest.TestCase):
+    def setUp(self) -> None:
+        register_index("test/unique", "key", unique=True)
+        self.committed = {
+            "test/unique": {1: {"id": 1, "key": "a"}, 2: {"id": 2, "key": "b"}}
+        }
+
+    def tearDown(self) -> None:
+        index_definitions.pop("test/unique", None)
+
+    def write(self, item_id: int, key: str) -> AllData:
+        data = AllData(self.committed)
+        data["test/unique"][item_id] = {"id": item_id, "key": key}
+        data.check_unique()
+        return data
+
+    def test_disjoint_writes(self) -> None:
+        first = self.write(1, "c")
+        second = self.write(2, "d")
+        first.commit()
+        self.assertFalse(second.has_conflicts({("test/unique", 1)}))
+
+    def test_same_new_value(self) -> None:
+        first = self.write(3, "c")
+        second = self.write(4, "c")
+        first.commit()
+        self.assertTrue(second.has_conflicts({("test/unique", 3)}))
+
+    def test_changed_element_takes_value(self) -> None:
+        first = self.write(2, "c")
+        second = self.write(3, "c")
+        first.commit()
+        self.assertTrue(second.has_conflicts({("test/unique", 2)}))
+
+
+class CopyOnWriteTest(unittest.TestCase):
+    def test_copy_view_with_nested_values(self) -> None:
+        all_data = AllData({"test/copy": {1: {"id": 1, "list": [{"a": 1}]}}})
+        collection = all_data.begin()["test/copy"]
+        collection[2] = collection[1]
+        collection[2]["list"][0]["a"] = 2
+
+        self.assertEqual(
+            json.loads(json.dumps(collection[1], default=plain)),
+            {"id": 1, "list": [{"a": 1}]},
+        )
+        self.assertEqual(collection.get_element(2), {"id": 1, "list": [{"a": 2}]})
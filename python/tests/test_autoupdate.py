@@ -0,0 +1,36 @@
+import unittest
+
+from runtime.all_data import AllData
+from runtime.autoupdate import render_elements
+from runtime.db import DATABASE
+
+
+class RenderElementsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        DATABASE["test/render"] = {
+            1: {"id": 1, "value": "a"},
+            2: {"id": 2, "value": "b"},
+            3: {"id": 3, "value": "c"},
+        }
+
+    def tearDown(self) -> None:
+        DATABASE.pop("test/render", None)
+
+    def test_elements_of_all_data(self) -> None:
+        all_data = AllData(DATABASE)
+        all_data["test/render"][1]["value"] = "changed"
+        del all_data["test/render"][2]
+        all_data.commit()
+        # A newer change, that is committed before the autoupdate is sent.
+        DATABASE["test/render"][1] = {"id": 1, "value": "newer"}
+        DATABASE["test/render"][2] = {"id": 2, "value": "created again"}
+
+        changed, deleted = render_elements(
+            {("test/render", 1), ("test/render", 2), ("test/render", 3)}, all_data
+        )
+
+        self.assertEqual(
+            sorted(changed["test/render"], key=lambda element: element["id"]),
+            [{"id": 1, "value": "changed"}, {"id": 3, "value": "c"}],
+        )
+        self.assertEqual(deleted["test/render"], [2])
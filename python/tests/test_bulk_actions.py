@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from typing import Any, Dict, List
+
+from runtime.actions import (
+    BulkCreateAction,
+    BulkDeleteAction,
+    BulkUpdateAction,
+    ValidationError,
+    all_data_var,
+    run_actions,
+    validate_message,
+)
+from runtime.all_data import AllData, index_definitions, register_index
+
+
+class CreateItems(BulkCreateAction, name="test/create_items"):
+    collection = "test/bulk"
+    fields = frozenset({"name"})
+    required_fields = ("name",)
+    unique_fields = ("name",)
+
+
+class UpdateItems(BulkUpdateAction, name="test/update_items"):
+    collection = "test/bulk"
+    fields = frozenset({"id", "name"})
+    unique_fields = ("name",)
+
+
+class DeleteItems(BulkDeleteAction, name="test/delete_items"):
+    collection = "test/bulk"
+
+
+class BulkActionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        register_index("test/bulk", "name", unique=True)
+        self.all_data = AllData(
+            {"test/bulk": {1: {"id": 1, "name": "a"}, 2: {"id": 2, "name": "b"}}}, {}
+        )
+
+    def tearDown(self) -> None:
+        index_definitions.pop("test/bulk", None)
+
+    def run_action(self, name: str, elements: List[Dict[str, Any]]) -> Any:
+        actions_data: Any = [{"action": name, "payload": {"elements": elements}}]
+        validate_message(actions_data)
+        all_data_var.set(self.all_data)
+        return asyncio.run(run_actions(actions_data))[0]
+
+    def test_create(self) -> None:
+        result = self.run_action("test/create_items", [{"name": "c"}, {"name": "d"}])
+
+        self.assertEqual(result, {"ids": [3, 4]})
+        self.assertEqual(
+            self.all_data["test/bulk"].get_element(4), {"id": 4, "name": "d"}
+        )
+
+    def test_create_existing_value(self) -> None:
+        with self.assertRaisesRegex(ValidationError, "name `a` already exists"):
+            self.run_action("test/create_items", [{"name": "c"}, {"name": "a"}])
+        self.assertEqual(self.all_data["test/bulk"].changed, set())
+
+    def test_create_value_twice(self) -> None:
+        with self.assertRaisesRegex(ValidationError, "name `c` is used more than once"):
+            self.run_action("test/create_items", [{"name": "c"}, {"name": "c"}])
+
+    def test_schema(self) -> None:
+        for elements in ([], [{"name": "c", "other": 1}], [{"id": 5, "name": "c"}]):
+            with self.subTest(elements=elements):
+                with self.assertRaises(ValidationError):
+                    self.run_action("test/create_items", elements)
+
+    def test_update_swap_values(self) -> None:
+        self.run_action(
+            "test/update_items", [{"id": 1, "name": "b"}, {"id": 2, "name": "a"}]
+        )
+
+        self.assertEqual(self.all_data["test/bulk"].get_element(1)["name"], "b")
+        self.assertEqual(self.all_data["test/bulk"].get_element(2)["name"], "a")
+
+    def test_update_unknown_id(self) -> None:
+        with self.assertRaisesRegex(ValidationError, "id `3` does not exist"):
+            self.run_action("test/update_items", [{"id": 1, "name": "c"}, {"id": 3}])
+        self.assertEqual(self.all_data["test/bulk"].get_element(1)["name"], "a")
+
+    def test_update_id_twice(self) -> None:
+        with self.assertRaisesRegex(ValidationError, "id `1` is used more than once"):
+            self.run_action("test/update_items", [{"id": 1}, {"id": 1}])
+
+    def test_delete(self) -> None:
+        self.run_action("test/delete_items", [{"id": 1}, {"id": 2}])
+
+        self.assertEqual(self.all_data["test/bulk"].deleted, {1, 2})
+        self.assertEqual(self.all_data["test/bulk"].as_dict(), {})
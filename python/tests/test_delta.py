@@ -0,0 +1,136 @@
+import copy
+import unittest
+from typing import Any, Dict, Optional
+from unittest import mock
+
+from runtime import delta
+from runtime.all_data import Element
+from runtime.delta import PreviousElements, get_delta_autoupdate, get_patch
+from runtime.restrict import Permissions
+
+
+def element(element_id: int, **fields: Any) -> Element:
+    result: Element = {"id": element_id}
+    result.update({f"field_{index}": "x" * 20 for index in range(10)})
+    result.update(fields)
+    return result
+
+
+def apply_patch(stored: Element, patch: Dict[str, Any]) -> Element:
+    """
+    Applies a patch the way the test client does.
+    """
+    result = copy.deepcopy(stored)
+    result.update(patch["set"])
+    for key in patch["removed"]:
+        result.pop(key, None)
+    return result
+
+
+def hide_secret(element: Element, permissions: Permissions) -> Optional[Element]:
+    return {key: value for key, value in element.items() if key != "secret"}
+
+
+class PatchTest(unittest.TestCase):
+    def test_changed_field(self) -> None:
+        previous = element(1, value=1, old="y")
+        new = element(1, value=2)
+
+        patch = get_patch(previous, new)
+
+        self.assertEqual(patch, {"id": 1, "set": {"value": 2}, "removed": ["old"]})
+        assert patch is not None
+        self.assertEqual(apply_patch(previous, patch), new)
+
+    def test_nested_value(self) -> None:
+        previous = element(1, value={"a": [1, 2]})
+        new = element(1, value={"a": [1, 3]})
+
+        patch = get_patch(previous, new)
+
+        assert patch is not None
+        self.assertEqual(apply_patch(previous, patch), new)
+
+    def test_unchanged(self) -> None:
+        previous = element(1)
+
+        self.assertEqual(
+            get_patch(previous, element(1)), {"id": 1, "set": {}, "removed": []}
+        )
+
+    def test_too_large(self) -> None:
+        previous = {"id": 1, "value": 1}
+
+        self.assertIsNone(get_patch(previous, {"id": 1, "value": 2}))
+        self.assertIsNone(get_patch(element(1), element(1, value="y" * 500)))
+
+
+class DeltaAutoupdateTest(unittest.TestCase):
+    def autoupdate(self, *elements: Element) -> Dict[str, Any]:
+        return {
+            "type": "autoupdate",
+            "changed": {"test/delta": list(elements)},
+            "deleted": {},
+            "all_data": False,
+        }
+
+    def test_patched_and_changed(self) -> None:
+        previous = {"test/delta": {1: element(1, value=1)}}
+        autoupdate = self.autoupdate(element(1, value=2), element(2))
+
+        result = get_delta_autoupdate(autoupdate, previous, frozenset())
+
+        self.assertEqual(result["changed"], {"test/delta": [element(2)]})
+        self.assertEqual(
+            result["patched"],
+            {"test/delta": [{"id": 1, "set": {"value": 2}, "removed": []}]},
+        )
+        self.assertEqual(autoupdate["changed"]["test/delta"][0], element(1, value=2))
+
+    def test_no_patches(self) -> None:
+        result = get_delta_autoupdate(self.autoupdate(element(1)), {}, frozenset())
+
+        self.assertEqual(result["changed"], {"test/delta": [element(1)]})
+        self.assertNotIn("patched", result)
+
+    def test_previous_is_restricted(self) -> None:
+        previous = {"test/delta": {1: element(1, value=1, secret="s")}}
+        autoupdate = self.autoupdate(element(1, value=2))
+
+        with mock.patch.dict(delta.restrict_hooks, {"test/delta": hide_secret}):
+            result = get_delta_autoupdate(autoupdate, previous, frozenset())
+
+        self.assertEqual(
+            result["patched"],
+            {"test/delta": [{"id": 1, "set": {"value": 2}, "removed": []}]},
+        )
+
+
+class PreviousElementsTest(unittest.TestCase):
+    def test_replace(self) -> None:
+        previous = PreviousElements()
+
+        self.assertIsNone(previous.replace(("test/delta", 1), element(1, value=1)))
+        self.assertEqual(
+            previous.replace(("test/delta", 1), element(1, value=2)),
+            element(1, value=1),
+        )
+
+    def test_cache_size(self) -> None:
+        previous = PreviousElements()
+
+        with mock.patch.object(delta, "DELTA_CACHE_SIZE", 2):
+            for element_id in (1, 2, 1, 3):
+                previous.replace(("test/delta", element_id), element(element_id))
+
+        self.assertEqual(
+            list(previous.elements), [("test/delta", 1), ("test/delta", 3)]
+        )
+
+    def test_discard(self) -> None:
+        previous = PreviousElements()
+        previous.replace(("test/delta", 1), element(1))
+
+        previous.discard([("test/delta", 1), ("test/delta", 2)])
+
+        self.assertEqual(len(previous.elements), 0)
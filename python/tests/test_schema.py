@@ -0,0 +1,82 @@
+import unittest
+from typing import Any
+
+from runtime.schema import Schema, SchemaError, compile_schema
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "elements": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 2,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": False,
+                    "username": {"type": "string", "minLength": 1},
+                    "level": {"type": "integer", "minimum": 0, "maximum": 3},
+                    "role": {"enum": ["admin", "user"]},
+                    "note": {"type": ["string", "null"]},
+                },
+                "required": ["username"],
+                "additionalProperties": False,
+            },
+        },
+    },
+}
+
+
+class CompileSchemaTest(unittest.TestCase):
+    def assert_error(self, schema: Schema, value: Any, message: str) -> None:
+        with self.assertRaises(SchemaError) as context:
+            compile_schema(schema)(value)
+        self.assertEqual(str(context.exception), message)
+
+    def test_valid(self) -> None:
+        compile_schema(SCHEMA)(
+            {
+                "elements": [
+                    {"username": "a", "level": 3, "role": "admin", "note": None},
+                    {"username": "b"},
+                ]
+            }
+        )
+
+    def test_errors(self) -> None:
+        def payload(**fields: Any) -> Any:
+            return {"elements": [{"username": "a"}, dict({"username": "b"}, **fields)]}
+
+        cases = [
+            (payload(username=""), "elements[1].username needs at least 1 characters"),
+            (payload(level=4), "elements[1].level can not be more than 3"),
+            (payload(level=-1), "elements[1].level has to be at least 0"),
+            (payload(level=1.5), "elements[1].level has to be integer"),
+            (payload(level=True), "elements[1].level has to be integer"),
+            (payload(note=1), "elements[1].note has to be string or null"),
+            (payload(role="x"), "elements[1].role has to be one of 'admin', 'user'"),
+            (payload(id=1), "elements[1].id is not allowed"),
+            (payload(other=1), "elements[1].other is not allowed"),
+            ({"elements": [{}]}, "elements[0] username is required"),
+            ({"elements": []}, "elements needs at least 1 items"),
+            (
+                {"elements": [{"username": "a"}] * 3},
+                "elements can not have more than 2 items",
+            ),
+            ({"elements": {}}, "elements has to be array"),
+            ([], "has to be object"),
+        ]
+        for value, message in cases:
+            with self.subTest(message=message):
+                self.assert_error(SCHEMA, value, message)
+
+    def test_bool_schemas(self) -> None:
+        compile_schema(True)(object())
+        self.assert_error(False, 1, "is not allowed")
+
+    def test_invalid_schema(self) -> None:
+        for schema in ({"type": "int"}, {"pattern": "a+"}, 1, {"items": None}):
+            with self.subTest(schema=schema):
+                with self.assertRaises(ValueError):
+                    compile_schema(schema)
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from runtime import websocket
+from runtime.websocket import Client
+
+
+class FakeWebsocket:
+    subprotocol = "json"
+
+
+def autoupdate(change_id: int, value: str) -> Dict[str, Any]:
+    return {
+        "type": "autoupdate",
+        "changed": {"core/config": [{"id": 1, "value": value}]},
+        "deleted": {},
+        "all_data": False,
+        "change_id": change_id,
+        "from_change_id": change_id - 1,
+    }
+
+
+def full_data(change_id: int, value: str) -> Dict[str, Any]:
+    return dict(autoupdate(change_id, value), all_data=True, from_change_id=0)
+
+
+def apply_frames(client: Client) -> Dict[str, Any]:
+    """
+    Applies the queued frames like a client and returns its config value.
+    """
+    store: Dict[int, Any] = {}
+    for frame, _ in client.queue:
+        message = client.codec.decode(frame)
+        if message["all_data"]:
+            store = {}
+        for element in message["changed"]["core/config"]:
+            store[element["id"]] = element
+    return store[1]
+
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.client = Client(FakeWebsocket(), None)  # type: ignore
+
+    def enqueue(self, message: Dict[str, Any], is_autoupdate: bool = True) -> None:
+        frame = self.client.codec.encode(message)
+        self.client.enqueue(frame, message if is_autoupdate else None)
+
+    def test_autoupdates_stay_after_full_data(self) -> None:
+        with mock.patch.object(websocket, "SEND_QUEUE_SIZE", 3):
+            self.enqueue(autoupdate(1, "a"))
+            self.enqueue(full_data(1, "a"), is_autoupdate=False)
+            self.enqueue(autoupdate(2, "b"))
+            self.enqueue(autoupdate(3, "c"))
+
+        change_ids: List[int] = [
+            self.client.codec.decode(frame)["change_id"]
+            for frame, _ in self.client.queue
+        ]
+        self.assertEqual(change_ids, [1, 1, 3])
+        self.assertEqual(apply_frames(self.client)["value"], "c")
+
+    def test_coalesce_merges_autoupdates(self) -> None:
+        with mock.patch.object(websocket, "SEND_QUEUE_SIZE", 2):
+            for change_id in range(1, 5):
+                self.enqueue(autoupdate(change_id, str(change_id)))
+
+        self.assertEqual(len(self.client.queue), 2)
+        self.assertEqual(apply_frames(self.client)["value"], "4")
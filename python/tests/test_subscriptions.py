@@ -0,0 +1,127 @@
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from runtime import subscriptions
+from runtime.subscriptions import (
+    Subscription,
+    SubscriptionIndex,
+    filter_autoupdate,
+    iter_element_ids,
+    parse_collections,
+)
+
+
+def autoupdate(
+    changed: Dict[str, List[int]], deleted: Dict[str, List[int]]
+) -> Dict[str, Any]:
+    return {
+        "type": "autoupdate",
+        "changed": {
+            collection: [{"id": item_id} for item_id in item_ids]
+            for collection, item_ids in changed.items()
+        },
+        "deleted": deleted,
+        "all_data": False,
+    }
+
+
+class SubscriptionTest(unittest.TestCase):
+    def test_add_and_remove(self) -> None:
+        subscription = Subscription()
+        subscription.add({"test/a": None, "test/b": [1, 2]})
+        subscription.add({"test/b": [3], "test/a": [5]})
+        subscription.remove({"test/b": [1]})
+
+        self.assertEqual(subscription.as_dict(), {"test/a": None, "test/b": [2, 3]})
+        self.assertTrue(subscription.contains("test/a", 100))
+        self.assertFalse(subscription.contains("test/b", 1))
+
+    def test_remove_from_whole_collection(self) -> None:
+        subscription = Subscription()
+        subscription.add({"test/a": None})
+
+        with mock.patch.dict(subscriptions.DATABASE, {"test/a": {1: {}, 2: {}}}):
+            subscription.remove({"test/a": [1]})
+
+        self.assertEqual(subscription.as_dict(), {"test/a": [2]})
+
+    def test_remove_last_element(self) -> None:
+        subscription = Subscription()
+        subscription.add({"test/a": [1], "test/b": None})
+        subscription.remove({"test/a": [1], "test/b": None})
+
+        self.assertEqual(subscription.as_dict(), {})
+
+
+class ParseCollectionsTest(unittest.TestCase):
+    def test_valid(self) -> None:
+        self.assertEqual(parse_collections(["test/a"]), {"test/a": None})
+        self.assertEqual(parse_collections({"test/a": [1]}), {"test/a": [1]})
+
+    def test_invalid(self) -> None:
+        for value in ("test/a", {1: None}, {"test/a": 1}, {"test/a": ["1"]}):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_collections(value)
+
+
+class SubscriptionIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = SubscriptionIndex()
+        self.subscriptions: Dict[str, Any] = {
+            "all": None,
+            "collection": Subscription(),
+            "element": Subscription(),
+        }
+        self.subscriptions["collection"].add({"test/a": None})
+        self.subscriptions["element"].add({"test/a": [1], "test/b": [2]})
+        for client, subscription in self.subscriptions.items():
+            self.index.add(client, subscription)
+
+    def test_get_shapes(self) -> None:
+        shapes = self.index.get_shapes(autoupdate({"test/a": [1, 3]}, {"test/b": [2]}))
+
+        self.assertEqual(
+            shapes,
+            {
+                "all": None,
+                "collection": (("test/a",), ()),
+                "element": ((), (("test/a", 1), ("test/b", 2))),
+            },
+        )
+
+    def test_uninterested_client(self) -> None:
+        shapes = self.index.get_shapes(autoupdate({"test/a": [3]}, {}))
+
+        self.assertEqual(set(shapes), {"all", "collection"})
+
+    def test_remove(self) -> None:
+        for client, subscription in self.subscriptions.items():
+            self.index.remove(client, subscription)
+
+        self.assertEqual(self.index.everything, set())
+        self.assertEqual(self.index.collections, {})
+        self.assertEqual(self.index.elements, {})
+
+    def test_shapes_match_filter(self) -> None:
+        update = autoupdate({"test/a": [1, 3], "test/c": [1]}, {"test/b": [2, 4]})
+
+        for client, shape in self.index.get_shapes(update).items():
+            filtered = filter_autoupdate(update, self.subscriptions[client])
+            if shape is None:
+                self.assertIs(filtered, update)
+                continue
+            collections, element_ids = shape
+            expected = {
+                element_id
+                for collection, ids in iter_element_ids(update)
+                if collection in collections
+                for element_id in ids
+            } | set(element_ids)
+            got = {
+                element_id
+                for _, ids in iter_element_ids(filtered)
+                for element_id in ids
+            }
+            self.assertEqual(got, expected, client)
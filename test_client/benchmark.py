@@ -0,0 +1,389 @@
+"""
+Benchmark for the python and the go server.
+
+Connects active clients, that send write requests, and idle listeners, that
+only receive autoupdates. Measures the latencies, the throughput and the
+received bytes and writes the results as json.
+
+  python test_client/benchmark.py --clients 100 --requests 20 --output result.json
+
+The workload of each client is created from --seed, so two runs send the
+same requests.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from client import Busy, Client
+
+
+# Actions and their default weight in the workload. core/set_config is not
+# supported by the go server.
+ACTIONS = {"users/update_password": 9, "users/create_user": 1, "core/set_config": 0}
+
+CONFIG_KEY = "general_event_name"
+
+
+class BenchmarkClient(Client):
+    """
+    Client, that measures its latencies.
+
+    `pending` has the start time of the last write for each element, until
+    an autoupdate with the element arrives.
+    """
+
+    __slots__ = {
+        "request_latencies": List[float],
+        "visible_latencies": List[float],
+        "reconnect_latencies": List[float],
+        "pending": Dict[Tuple[str, Any], float],
+        "reconnect_start": Optional[float],
+        "errors": int,
+        "busy": int,
+        "run_id": str,
+    }
+
+    def __init__(self, protocol: str, delta: bool, run_id: str) -> None:
+        super().__init__(protocol, delta)
+        self.run_id = run_id
+        self.request_latencies: List[float] = []
+        self.visible_latencies: List[float] = []
+        self.reconnect_latencies: List[float] = []
+        self.pending: Dict[Tuple[str, Any], float] = {}
+        self.reconnect_start: Optional[float] = None
+        self.errors = 0
+        # Requests, that the server rejected, because it was overloaded.
+        self.busy = 0
+
+    async def recv_autoupdate(self, message: Dict[str, Any]) -> None:
+        now = perf_counter()
+        if self.reconnect_start is not None:
+            self.reconnect_latencies.append(now - self.reconnect_start)
+            self.reconnect_start = None
+        if self.pending:
+            for collection, elements in [
+                *message["changed"].items(),
+                *message.get("patched", {}).items(),
+            ]:
+                for element in elements:
+                    # A patch has the id and the changed fields. The other
+                    # fields are in the store.
+                    values = element
+                    if "set" in element:
+                        values = {**self.store[collection].get(element["id"], {})}
+                        values.update(element["set"])
+                    for key in (
+                        element["id"],
+                        values.get("username"),
+                        values.get("key"),
+                    ):
+                        start = self.pending.pop((collection, key), None)
+                        if start is not None:
+                            self.visible_latencies.append(now - start)
+        await super().recv_autoupdate(message)
+
+    async def request(
+        self, action: str, payload: Dict[str, Any], element: Tuple[str, Any]
+    ) -> Any:
+        """
+        Sends one action and waits for the response.
+
+        `element` is the collection and the id, username or key of the element,
+        that the action changes.
+        """
+        start = perf_counter()
+        self.pending[element] = start
+        try:
+            response = await (await self.send([{"action": action, "payload": payload}]))
+        except Busy:
+            self.busy += 1
+            self.pending.pop(element, None)
+            return None
+        except ValueError:
+            self.errors += 1
+            self.pending.pop(element, None)
+            return None
+        finally:
+            self.request_latencies.append(perf_counter() - start)
+        return response
+
+    async def create_user(self, username: str) -> None:
+        response = await self.request(
+            "users/create_user", {"username": username}, ("users/user", username)
+        )
+        if response is not None:
+            self.user_id = response[0]["id"]
+
+    async def run_action(self, action: str, rand: random.Random) -> None:
+        if action == "users/create_user":
+            username = f"bench-{rand.getrandbits(64):x}-{self.run_id}"
+            await self.request(action, {"username": username}, ("users/user", username))
+        elif action == "users/update_password":
+            if self.user_id is None:
+                # create_user failed, so there is no user to update.
+                self.errors += 1
+                return
+            await self.request(
+                action,
+                {"id": self.user_id, "password": f"password{rand.getrandbits(32)}"},
+                ("users/user", self.user_id),
+            )
+        elif action == "core/set_config":
+            await self.request(
+                action,
+                {"key": CONFIG_KEY, "value": f"Event {rand.getrandbits(32)}"},
+                ("core/config", CONFIG_KEY),
+            )
+
+    async def reconnect(self) -> None:
+        self.reconnect_start = perf_counter()
+        await super().reconnect()
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """
+    Parses a workload like users/update_password=9,users/create_user=1.
+    """
+    weights: Dict[str, int] = {}
+    for part in mix.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action {action}")
+        weights[action] = int(weight or 1)
+    return weights
+
+
+def get_stats(values: List[float]) -> Dict[str, Any]:
+    """
+    Returns count, p50, p95, p99 and max of latencies in milliseconds.
+    """
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def percentile(percent: float) -> float:
+        index = max(0, int(round(percent / 100 * len(values))) - 1)
+        return round(values[index] * 1000, 3)
+
+    return {
+        "count": len(values),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": round(values[-1] * 1000, 3),
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def connect_all(
+    clients: List[BenchmarkClient], address: str, ramp_up: float
+) -> None:
+    """
+    Connects the clients. With ramp_up, the connects are spread over that many
+    seconds.
+    """
+
+    async def connect(index: int, client: BenchmarkClient) -> None:
+        if ramp_up:
+            await asyncio.sleep(ramp_up * index / len(clients))
+        await client.connect(address)
+
+    await asyncio.gather(
+        *(connect(index, client) for index, client in enumerate(clients))
+    )
+
+
+async def run_client(
+    client: BenchmarkClient, args: argparse.Namespace, rand: random.Random
+) -> None:
+    actions = list(args.mix)
+    weights = [args.mix[action] for action in actions]
+    for _ in range(args.requests):
+        await client.run_action(rand.choices(actions, weights)[0], rand)
+        if args.think_time:
+            await asyncio.sleep(rand.uniform(0, 2 * args.think_time))
+
+
+async def reconnect_storm(
+    clients: List[BenchmarkClient], args: argparse.Namespace
+) -> None:
+    """
+    Reconnects --storm-clients listeners at the same time, after --storm-at
+    seconds. Active clients are not reconnected, because the responses of
+    their open requests would be lost.
+    """
+    await asyncio.sleep(args.storm_at)
+    await asyncio.gather(
+        *(client.reconnect() for client in clients[: args.storm_clients])
+    )
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    # Usernames have to be new in each run, because the server saves them.
+    run_id = f"{time():.0f}"
+    active = [
+        BenchmarkClient(args.protocol, args.delta, run_id) for _ in range(args.clients)
+    ]
+    listeners = [
+        BenchmarkClient(args.protocol, args.delta, run_id)
+        for _ in range(args.listeners)
+    ]
+    all_clients = active + listeners
+
+    start = perf_counter()
+    await connect_all(all_clients, args.address, args.ramp_up)
+    connect_time = perf_counter() - start
+
+    # Every active client needs a user for update_password.
+    await asyncio.gather(
+        *(
+            client.create_user(f"bench-{index}-{run_id}")
+            for index, client in enumerate(active)
+        )
+    )
+    for client in active:
+        client.request_latencies.clear()
+        client.visible_latencies.clear()
+
+    start = perf_counter()
+    tasks = [
+        run_client(client, args, random.Random(f"{args.seed}-{index}"))
+        for index, client in enumerate(active)
+    ]
+    if args.storm_clients:
+        tasks.append(reconnect_storm(listeners, args))
+    await asyncio.gather(*tasks)
+    duration = perf_counter() - start
+
+    # Wait for the last autoupdates.
+    await asyncio.sleep(args.settle)
+    await asyncio.gather(*(client.disconnect() for client in all_clients))
+
+    requests = sum(len(client.request_latencies) for client in active)
+
+    def collect(name: str, clients: List[BenchmarkClient]) -> List[float]:
+        return [value for client in clients for value in getattr(client, name)]
+
+    return {
+        "label": args.label,
+        "commit": get_commit(),
+        "started": time(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "label")
+        },
+        "results": {
+            "connect_time": round(connect_time, 3),
+            "duration": round(duration, 3),
+            "requests": requests,
+            "throughput": round(requests / duration, 1) if duration else 0,
+            "errors": sum(client.errors for client in active),
+            "busy": sum(client.busy for client in active),
+            "request_latency": get_stats(collect("request_latencies", active)),
+            "visible_latency": get_stats(collect("visible_latencies", active)),
+            "reconnect_latency": get_stats(collect("reconnect_latencies", all_clients)),
+            "bytes_received": sum(client.bytes_received for client in all_clients),
+            "bytes_received_listeners": sum(
+                client.bytes_received for client in listeners
+            ),
+            "missed_autoupdates": sum(len(client.pending) for client in active),
+        },
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--address", default="ws://localhost:8000")
+    parser.add_argument(
+        "--protocol", default="json", help="json, msgpack, json+zlib or msgpack+zlib"
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="get patches instead of whole elements (python server only)",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=100, help="clients, that send requests"
+    )
+    parser.add_argument(
+        "--listeners",
+        type=int,
+        default=0,
+        help="clients, that only receive autoupdates",
+    )
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={action: weight for action, weight in ACTIONS.items() if weight},
+        help="weights of the actions, for example users/update_password=9,users/create_user=1",
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="mean seconds between two requests of a client",
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=0.0, help="seconds to connect all clients"
+    )
+    parser.add_argument(
+        "--storm-clients",
+        type=int,
+        default=0,
+        help="listeners, that reconnect at the same time",
+    )
+    parser.add_argument(
+        "--storm-at",
+        type=float,
+        default=1.0,
+        help="seconds after the start of the requests",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=0.5,
+        help="seconds to wait for autoupdates at the end",
+    )
+    parser.add_argument("--seed", default="1")
+    parser.add_argument(
+        "--label",
+        default="",
+        help="name of the run in the results, for example python or go",
+    )
+    parser.add_argument("--output", help="json file for the results, default is stdout")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    result = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,32 +4,125 @@ import asyncio
 import json
 import random
 import string
+import zlib
 from collections import defaultdict
 from contextlib import asynccontextmanager
 from random import randint
-from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Union
 
+import msgpack
 import websockets
 
 
+def compressed_encoder(encode: Callable[[Any], Any]) -> Callable[[Any], bytes]:
+    """
+    Encoder for +zlib protocols. The client does not compress its messages.
+    """
+
+    def encoder(message: Any) -> bytes:
+        data = encode(message)
+        return b"\x00" + (data.encode() if isinstance(data, str) else data)
+
+    return encoder
+
+
+def compressed_decoder(decode: Callable[[Any], Any]) -> Callable[[bytes], Any]:
+    """
+    Decoder for +zlib protocols. The first byte tells, if the frame is
+    compressed.
+    """
+
+    def decoder(data: bytes) -> Any:
+        if data[:1] == b"\x01":
+            return decode(zlib.decompress(data[1:]))
+        return decode(data[1:])
+
+    return decoder
+
+
+def msgpack_decode(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# Encoder and decoder for each websocket subprotocol.
+PROTOCOLS: Dict[str, Any] = {
+    "json": (json.dumps, json.loads),
+    "msgpack": (msgpack.packb, msgpack_decode),
+    "json+zlib": (compressed_encoder(json.dumps), compressed_decoder(json.loads)),
+    "msgpack+zlib": (
+        compressed_encoder(msgpack.packb),
+        compressed_decoder(msgpack_decode),
+    ),
+}
+
+
+class Busy(ValueError):
+    """
+    The server did not handle the message, because it has too many. It can be
+    sent again after retry_after seconds.
+    """
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class Client:
     __slots__ = {
         "connection": Optional[websockets.WebSocketClientProtocol],
         "store": Dict[str, Dict[int, Dict[str, Any]]],
         "user_id": Optional[int],
         "current_requests": Dict[str, asyncio.Future],
+        "change_id": Optional[int],
+        "address": str,
+        "protocol": str,
+        "delta": bool,
+        "subscribed_collections": Optional[List[str]],
+        "bytes_received": int,
     }
 
-    def __init__(self) -> None:
+    def __init__(self, protocol: str = "json", delta: bool = False) -> None:
         self.store: Dict[str, Dict[int, Dict[str, Any]]] = defaultdict(dict)
         self.current_requests: Dict[str, asyncio.Future] = {}
         self.connection = None
         self.user_id = None
+        self.change_id = None
+        self.address = "ws://localhost:8000"
+        self.protocol = protocol
+        # Get patches instead of whole elements, when they change.
+        self.delta = delta
+        # Collections to get, when the client connects. None means all.
+        self.subscribed_collections = None
+        self.bytes_received = 0
 
     async def connect(self, address: str = "ws://localhost:8000") -> None:
-        self.connection = await websockets.connect(address)
+        self.address = address
+        query = []
+        if self.change_id is not None:
+            query.append(f"change_id={self.change_id}")
+        if self.user_id is not None:
+            query.append(f"user_id={self.user_id}")
+        if self.delta:
+            query.append("delta=1")
+        if self.subscribed_collections is not None:
+            query.append(f"subscribe={','.join(self.subscribed_collections)}")
+        if query:
+            address = f"{address}/?{'&'.join(query)}"
+        self.connection = await websockets.connect(
+            address,
+            subprotocols=[self.protocol],
+            compression=None if self.protocol.endswith("+zlib") else "deflate",
+        )
         asyncio.create_task(self.handle_recv())
 
+    async def reconnect(self) -> None:
+        """
+        Closes the connection and opens a new one. The server only sends the
+        changes since the last autoupdate.
+        """
+        await self.disconnect()
+        await self.connect(self.address)
+
     async def disconnect(self) -> None:
         if self.connection is not None:
             await self.connection.close()
@@ -39,7 +132,8 @@ class Client:
             raise RuntimeError("Client not connected")
         try:
             async for raw_message in self.connection:
-                message = json.loads(raw_message)
+                self.bytes_received += len(raw_message)
+                message = self.decode(raw_message)
                 message_type = message["type"]
                 if message_type == "autoupdate":
                     await self.recv_autoupdate(message)
@@ -52,13 +146,29 @@ class Client:
             pass
 
     async def recv_autoupdate(self, message: Dict[str, Any]) -> None:
+        # The go server sends no change_id. Then the client gets all data, when
+        # it connects again.
+        change_id = message.get("change_id")
         if message["all_data"]:
             self.store = defaultdict(dict)
+            self.change_id = change_id
+        elif change_id is not None:
+            self.change_id = max(self.change_id or 0, change_id)
 
         for collection, elements in message["changed"].items():
             for element in elements:
                 self.store[collection][int(element["id"])] = element
 
+        for collection, patches in message.get("patched", {}).items():
+            for patch in patches:
+                stored = self.store[collection].get(int(patch["id"]))
+                if stored is None:
+                    # The patch came before all data. All data has this change.
+                    continue
+                stored.update(patch["set"])
+                for key in patch["removed"]:
+                    stored.pop(key, None)
+
         for collection, element_ids in message["deleted"].items():
             for element_id in element_ids:
                 if int(element_id) in self.store[collection]:
@@ -67,10 +177,16 @@ class Client:
     async def recv_response(self, message: Dict[str, Any]) -> None:
         message_id = message["response-id"]
         future = self.current_requests[message_id]
-        if "error" in message:
+        if message.get("busy"):
+            future.set_exception(Busy(message["error"], message["retry_after"]))
+        elif "error" in message:
             # When the future is awaited, this takes a very long time. I don't know
             # why
             future.set_exception(ValueError(message["error"]))
+        elif "history" in message:
+            future.set_result(message["history"])
+        elif "subscription" in message:
+            future.set_result(message["subscription"])
         else:
             future.set_result(message["responses"])
         del self.current_requests[message_id]
@@ -79,6 +195,24 @@ class Client:
         """
         only sends actions.
         """
+        return await self.send_message({"actions": actions})
+
+    async def send_with_retry(self, actions: List[dict]) -> Any:
+        """
+        Sends actions and waits for the response. Sends them again, when the
+        server is busy.
+        """
+        while True:
+            try:
+                return await (await self.send(actions))
+            except Busy as err:
+                await asyncio.sleep(err.retry_after)
+
+    async def send_message(self, message: Dict[str, Any]) -> asyncio.Future:
+        """
+        Sends a message with a new message id. Returns a future for the
+        response.
+        """
         if self.connection is None:
             raise RuntimeError("Client not connected")
 
@@ -88,16 +222,56 @@ class Client:
 
         future = asyncio.get_running_loop().create_future()
         self.current_requests[message_id] = future
-        await self.connection.send(json.dumps({"id": message_id, "actions": actions}))
+        await self.connection.send(self.encode(dict(message, id=message_id)))
         return future
 
+    async def history(
+        self, change_id: int, collection: str, item_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the elements of a collection after a past change.
+        """
+        message: Dict[str, Any] = {
+            "type": "history",
+            "change_id": change_id,
+            "collection": collection,
+        }
+        if item_id is not None:
+            message["item_id"] = item_id
+        response = await (await self.send_message(message))
+        return response["elements"]
+
+    async def subscribe(
+        self, collections: Optional[Dict[str, Optional[List[int]]]]
+    ) -> Optional[Dict[str, Optional[List[int]]]]:
+        """
+        Subscribes collections or elements. None subscribes everything.
+        Returns the new subscription.
+        """
+        message = {"type": "subscribe", "collections": collections}
+        return await (await self.send_message(message))
+
+    async def unsubscribe(
+        self, collections: Dict[str, Optional[List[int]]]
+    ) -> Optional[Dict[str, Optional[List[int]]]]:
+        """
+        Unsubscribes collections or elements. Returns the new subscription.
+        """
+        message = {"type": "unsubscribe", "collections": collections}
+        return await (await self.send_message(message))
+
+    def encode(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        return PROTOCOLS[self.protocol][0](message)
+
+    def decode(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        return PROTOCOLS[self.protocol][1](data)
+
     async def create_user(self, username: str) -> None:
         action: dict = {
             "action": "users/create_user",
             "payload": {"username": username},
         }
-        response_waiter = await self.send([action])
-        response = await response_waiter
+        response = await self.send_with_retry([action])
         self.user_id = response[0]["id"]
 
     async def set_password(self, password: str) -> None:
@@ -107,8 +281,7 @@ class Client:
             "action": "users/update_password",
             "payload": {"id": self.user_id, "password": password},
         }
-        response_waiter = await self.send([action])
-        await response_waiter
+        await self.send_with_retry([action])
 
 
 def get_message_id() -> str:
@@ -116,10 +289,12 @@ def get_message_id() -> str:
 
 
 @asynccontextmanager
-async def connect_clients(count: int) -> AsyncGenerator[List[Client], None]:
+async def connect_clients(
+    count: int, protocol: str = "json"
+) -> AsyncGenerator[List[Client], None]:
     clients: List[Client] = []
     try:
-        clients = [Client() for _ in range(count)]
+        clients = [Client(protocol) for _ in range(count)]
         await asyncio.gather(*(client.connect() for client in clients))
 
         yield clients
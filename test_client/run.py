@@ -7,6 +7,10 @@ from client import connect_clients, create_users, set_password
 
 
 CLIENT_COUNT = 100
+
+# Websocket subprotocol of the clients: "json", "msgpack", "json+zlib" or
+# "msgpack+zlib".
+PROTOCOL = "json"
 starttime = time()
 
 
@@ -15,8 +19,8 @@ def log(message: str) -> None:
 
 
 async def test() -> None:
-    log(f"connect {CLIENT_COUNT} clients.")
-    async with connect_clients(CLIENT_COUNT) as clients:
+    log(f"connect {CLIENT_COUNT} clients with {PROTOCOL}.")
+    async with connect_clients(CLIENT_COUNT, PROTOCOL) as clients:
         log("create users.")
         await create_users(clients)
         log("set passwords for each user 10 times.")